@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+
+"""
+This module benchmarks the runkubejobs controller against the fake API
+server (see benchmarks.fakeapi).
+
+For each cluster size the fake server is reset with that many nodes, then a
+fresh process runs the threads engine end to end: node inventory, the
+multiplexer's shared per-namespace event streams and informers, dispatcher
+(parse_queue) and concurrent spawn, until every task group has completed.
+With --namespaces N, a group runs in each of N namespaces on the same nodes;
+with --barrier, each group's pods are released together from a start
+barrier (pod patches). Each run measures:
+
+    * spawn throughput (jobs created per second, across groups)
+    * event-to-decision latency: from an event being queued to the
+      dispatcher's handler returning for it
+    * API requests per node, by verb and resource
+    * peak RSS of the controller process
+    * with --barrier, time from spawned to every pod released
+
+Results are written as JSON, so runs can be compared to track regressions.
+
+Usage:
+    python -m benchmarks.bench_controller --sizes 10,100,1000,5000 \\
+        --namespaces 2 --barrier --output bench-results.json
+
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import kubernetes
+import kubernetes.client as client
+
+from runkubejobs import barrier
+from runkubejobs import inventory
+from runkubejobs import kubejobs
+from runkubejobs import multiplex
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "runkubejobs",
+    "kube-job-tmpl-runxhpl.yaml",
+)
+
+
+class TimedQueue(queue.Queue):
+    """
+    A Queue that records when each item was put.
+
+    Attributes:
+        last_put_time (float): Monotonic put time of the last item got.
+    """
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._put_times = collections.deque()
+        self.last_put_time = None
+
+    def _put(self, item):
+        super()._put(item)
+        self._put_times.append(time.monotonic())
+
+    def _get(self):
+        self.last_put_time = self._put_times.popleft()
+        return super()._get()
+
+
+def get_url_json(url, data = None):
+    """
+    Get JSON from a fake API server endpoint.
+
+    Args:
+        url (str): URL of the endpoint.
+        data (dict): JSON body to POST, GET if None.
+
+    Returns:
+        obj (dict): Decoded response.
+    """
+    body = None if data is None else json.dumps(data).encode()
+    req = urllib.request.Request(url, data = body, method = "GET" if body is None else "POST")
+    with urllib.request.urlopen(req) as resp:
+        return json.load(resp)
+
+
+def run_one(url, max_in_flight = 16, timeout = 600, namespaces = 1, barrier_ = False):
+    """
+    Run the controller once against a fake API server.
+
+    Args:
+        url (str): URL of the fake API server, already reset.
+        max_in_flight (int): Maximum number of concurrent spawns.
+        timeout (int): Maximum seconds to wait for the groups to finish.
+        namespaces (int): Number of namespaces, each running a task group.
+        barrier_ (bool): Whether to start each group's pods with a barrier.
+
+    Returns:
+        result (dict): Measurements of the run.
+    """
+    configuration = client.Configuration()
+    configuration.host = url
+    client.Configuration.set_default(configuration)
+    kubejobs.configure_api_client(pool_maxsize = max(32, max_in_flight * namespaces))
+    task = "runxhpl"
+    log_id = "bench{0}".format(os.getpid())
+
+    stats_start = get_url_json(url + "/_stats")
+    time_start = time.monotonic()
+    node_inventory = inventory.NodeInventory()
+    node_inventory.start()
+    nodes = kubejobs.get_task_nodes(["all"], node_inventory)
+
+    q_watch = TimedQueue()
+    q_exc = queue.Queue()
+    mux = multiplex.Multiplexer(log_id, q_watch)
+    groups = [
+        mux.add_group(
+            multiplex.TaskGroup(
+                task, "bench-{0}".format(i), TEMPLATE, None,
+                barrier = barrier_,
+            ),
+            expected = len(nodes),
+        )
+        for i in range(namespaces)
+    ]
+    sources = mux.start()
+
+    decision_latencies = []
+
+    def _handle(w_event, q_exc):
+        done = mux.handle(w_event, q_exc)
+        decision_latencies.append(time.monotonic() - q_watch.last_put_time)
+        return done
+
+    m = threading.Thread(
+        target = kubejobs.parse_queue,
+        args = (q_watch, q_exc,),
+        kwargs = {"sources": sources, "handler": _handle},
+        name = "thread.main",
+        daemon = True,
+    )
+    m.start()
+    time_setup = time.monotonic() - time_start
+
+    def _start(group):
+        (workers, errors, latencies) = kubejobs.spawn_workers(
+            TEMPLATE, task, nodes, log_id, None, max_in_flight, node_inventory,
+            namespace = group.namespace,
+            barrier = group.barrier,
+        )
+        group.workers = workers
+        time_spawned = time.monotonic()
+        time_barrier = None
+        if barrier_ and not errors:
+            pods = barrier.wait(group.cache, len(nodes), timeout)
+            barrier.release(pods, lead = 1, max_in_flight = max_in_flight)
+            time_barrier = time.monotonic() - time_spawned
+        return (errors, latencies, time_spawned, time_barrier)
+
+    time_spawn_start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = len(groups)) as executor:
+        started = list(executor.map(_start, groups))
+    time_spawn = max(time_spawned for (_, _, time_spawned, _) in started) - time_spawn_start
+    m.join(timeout)
+    time_total = time.monotonic() - time_start
+    stats_end = get_url_json(url + "/_stats")
+
+    failures = []
+    for q in [q_exc] + [group.q_exc for group in groups]:
+        while not q.empty():
+            failures.append(str(q.get()[1]))
+    api_calls = {
+        key: stats_end.get(key, 0) - stats_start.get(key, 0)
+        for key in sorted(stats_end)
+        if stats_end.get(key, 0) - stats_start.get(key, 0)
+    }
+    total_calls = sum(api_calls.values())
+    spawned = sum(len(group.workers) for group in groups)
+    spawn_latencies = [
+        latency for (_, latencies, _, _) in started for latency in latencies.values()
+    ]
+    barrier_times = [t for (_, _, _, t) in started if t is not None]
+    result = {
+        "nodes": len(nodes),
+        "namespaces": namespaces,
+        "barrier": barrier_,
+        "max_in_flight": max_in_flight,
+        "spawned": spawned,
+        "spawn_errors": sum(len(errors) for (errors, _, _, _) in started),
+        "completed": not m.is_alive() and not failures,
+        "failures": failures[:10],
+        "setup_s": time_setup,
+        "spawn_s": time_spawn,
+        "barrier_s": max(barrier_times) if barrier_times else None,
+        "total_s": time_total,
+        "spawn_per_s": spawned / time_spawn if time_spawn else None,
+        "spawn_latency_s": get_distribution(spawn_latencies),
+        "events": len(decision_latencies),
+        "decision_latency_s": get_distribution(decision_latencies),
+        "api_calls": api_calls,
+        "api_calls_total": total_calls,
+        "api_calls_per_node": total_calls / len(nodes) if nodes else None,
+        "peak_rss_bytes": get_peak_rss(),
+    }
+    mux.stop()
+    node_inventory.stop()
+    return result
+
+
+def get_distribution(values):
+    """
+    Summarise a list of values.
+
+    Args:
+        values (list): Values.
+
+    Returns:
+        summary (dict): Count, mean, p50, p95, p99 and max, or None if empty.
+    """
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": kubejobs.get_percentile(values, 50),
+        "p95": kubejobs.get_percentile(values, 95),
+        "p99": kubejobs.get_percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def get_peak_rss():
+    """Get the peak resident set size of this process, bytes."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def start_server(scenario_file = None):
+    """
+    Start the fake API server in a child process.
+
+    Args:
+        scenario_file (str): Scenario JSON file of the server.
+
+    Returns:
+        tuple(
+            proc (Popen): Server process.
+            url (str): URL of the server.
+        )
+    """
+    cmd = [sys.executable, "-m", "benchmarks.fakeapi", "--port", "0"]
+    if scenario_file:
+        cmd += ["--scenario", scenario_file]
+    proc = subprocess.Popen(cmd, stdout = subprocess.PIPE, text = True)
+    url = proc.stdout.readline().strip()
+    if not url:
+        raise RuntimeError("Fake API Server Failed", cmd)
+    return (proc, url)
+
+
+def run_size(url, size, scenario, max_in_flight, timeout, namespaces = 1, barrier_ = False):
+    """
+    Reset the fake API server to a cluster size and benchmark a fresh
+    controller process against it.
+
+    Args:
+        url (str): URL of the fake API server.
+        size (int): Number of nodes.
+        scenario (dict): Scenario of the run, see fakeapi.DEFAULT_SCENARIO.
+        max_in_flight (int): Maximum number of concurrent spawns.
+        timeout (int): Maximum seconds to wait for the groups to finish.
+        namespaces (int): Number of namespaces, each running a task group.
+        barrier_ (bool): Whether to start each group's pods with a barrier.
+
+    Returns:
+        result (dict): Measurements of the run.
+    """
+    get_url_json(url + "/_reset", dict(scenario, nodes = size))
+    cmd = [
+        sys.executable, "-m", "benchmarks.bench_controller",
+        "--run-one", url,
+        "--max-in-flight", str(max_in_flight),
+        "--namespaces", str(namespaces),
+        "--timeout", str(timeout),
+    ]
+    if barrier_:
+        cmd.append("--barrier")
+    proc = subprocess.run(
+        cmd,
+        stdout = subprocess.PIPE,
+        text = True,
+        check = True,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def get_meta():
+    """Get the environment of a benchmark run."""
+    with open(os.path.join(os.path.dirname(TEMPLATE), os.pardir, "VERSION")) as f:
+        version = f.read().strip()
+    return {
+        "runkubejobs": version,
+        "kubernetes": kubernetes.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def get_command(args):
+    parser = argparse.ArgumentParser(
+        description = "Benchmark runkubejobs against a fake Kubernetes API server",
+    )
+    parser.add_argument(
+        "--barrier",
+        action = "store_true",
+        help = "start each group's pods together with a barrier",
+        required = False,
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        action = "store",
+        type = int,
+        help = "set maximum number of concurrent job spawns",
+        default = 16,
+        required = False,
+    )
+    parser.add_argument(
+        "--namespaces",
+        action = "store",
+        type = int,
+        help = "set number of namespaces, each running a task group",
+        default = 1,
+        required = False,
+    )
+    parser.add_argument(
+        "-o", "--output",
+        action = "store",
+        type = str,
+        help = "set JSON results file",
+        default = "bench-results.json",
+        required = False,
+    )
+    parser.add_argument(
+        "--run-one",
+        action = "store",
+        type = str,
+        help = argparse.SUPPRESS,
+        required = False,
+    )
+    parser.add_argument(
+        "--scenario",
+        action = "store",
+        type = str,
+        help = "set fake API server scenario JSON file",
+        required = False,
+    )
+    parser.add_argument(
+        "--sizes",
+        action = "store",
+        type = str,
+        help = "set comma-separated cluster sizes",
+        default = "10,100,1000,5000",
+        required = False,
+    )
+    parser.add_argument(
+        "--timeout",
+        action = "store",
+        type = int,
+        help = "set maximum seconds per run",
+        default = 600,
+        required = False,
+    )
+    return vars(parser.parse_args(args))
+
+
+def main():
+    d = get_command(sys.argv[1:])
+    logging.basicConfig(level = logging.WARNING)
+    if d["run_one"]:
+        result = run_one(
+            d["run_one"], d["max_in_flight"], d["timeout"], d["namespaces"], d["barrier"]
+        )
+        print(json.dumps(result), flush = True)
+        os._exit(0)  # Watch threads block in reads
+
+    scenario = {}
+    if d["scenario"]:
+        with open(d["scenario"]) as f:
+            scenario = json.load(f)
+    (proc, url) = start_server(d["scenario"])
+    results = []
+    try:
+        for size in [int(v) for v in d["sizes"].split(",")]:
+            result = run_size(
+                url, size, scenario, d["max_in_flight"], d["timeout"],
+                d["namespaces"], d["barrier"],
+            )
+            results.append(result)
+            print(
+                "nodes: {nodes:>5}, spawn: {spawn_per_s:8.1f}/s, "
+                "decision p99: {p99:.4f}s, api calls/node: "
+                "{api_calls_per_node:.1f}, peak rss: {rss:.1f} MiB, "
+                "completed: {completed}".format(
+                    p99 = result["decision_latency_s"]["p99"],
+                    rss = result["peak_rss_bytes"] / 2**20,
+                    **result
+                ),
+                flush = True,
+            )
+    finally:
+        proc.terminate()
+        proc.wait()
+    with open(d["output"], "w") as f:
+        json.dump(
+            {"meta": get_meta(), "scenario": scenario, "results": results},
+            f,
+            indent = 2,
+        )
+    return None
+
+
+if __name__ == "__main__":
+    main()
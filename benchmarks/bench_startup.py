@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""
+This module benchmarks the startup time of the runkubejobs CLI.
+
+Every check runs in a fresh interpreter, so nothing is imported already:
+
+    * modules loaded by parsing a command line: none of HEAVY_MODULES may
+      be (the Kubernetes client, engcommon, pkg_resources, the run)
+    * import time of runkubejobs.cli (python -X importtime, cumulative)
+    * wall time of "runkubejobs --help", and of a bare interpreter
+
+The benchmark fails (exit 1) if a heavy module is loaded, or if the import
+time is over the limit or regressed from a baseline results file. Results
+are written as JSON, so a run can be the next baseline.
+
+Usage:
+    python -m benchmarks.bench_startup --output startup.json \\
+        --baseline startup-baseline.json
+
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules that parsing a command line must not load
+HEAVY_MODULES = (
+    "engcommon",
+    "kubernetes",
+    "kubernetes_asyncio",
+    "pkg_resources",
+    "runkubejobs.runner",
+    "urllib3",
+    "yaml",
+)
+
+PARSE_CODE = """
+import json, sys
+from runkubejobs import cli
+cli.get_command(["-t", "runxhpl", "-n", "all", "--group", "runxhpl@perf"])
+print(json.dumps(sorted(sys.modules)))
+"""
+
+HELP_CODE = """
+import sys
+sys.argv[0] = "runkubejobs"
+from runkubejobs import cli
+cli.main()
+"""
+
+
+def get_heavy_modules():
+    """
+    Get the heavy modules loaded by parsing a command line.
+
+    Returns:
+        modules (list): Names of the loaded HEAVY_MODULES (or submodules).
+    """
+    out = subprocess.run(
+        [sys.executable, "-c", PARSE_CODE],
+        check = True,
+        capture_output = True,
+        text = True,
+    ).stdout
+    return [
+        name for name in json.loads(out)
+        if any(name == m or name.startswith(m + ".") for m in HEAVY_MODULES)
+    ]
+
+
+def get_import_time(module = "runkubejobs.cli"):
+    """
+    Get the cumulative import time of a module in a fresh interpreter.
+
+    Returns:
+        ms (float): Import time in milliseconds.
+    """
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {0}".format(module)],
+        check = True,
+        capture_output = True,
+        text = True,
+    ).stderr
+    for line in err.splitlines():
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError("Import Time Not Found", module)
+
+
+def get_wall_time(code, args = ()):
+    """Get the wall time in milliseconds of a fresh interpreter running code."""
+    time_start = time.monotonic()
+    subprocess.run(
+        [sys.executable, "-c", code] + list(args),
+        check = True,
+        stdout = subprocess.DEVNULL,
+    )
+    return (time.monotonic() - time_start) * 1000
+
+
+def run(runs = 10):
+    """
+    Benchmark the CLI startup.
+
+    Args:
+        runs (int): Runs of each timing, the median is kept.
+
+    Returns:
+        results (dict): heavy_modules, import_ms, help_ms, python_ms.
+    """
+    return {
+        "heavy_modules": get_heavy_modules(),
+        "import_ms": statistics.median(get_import_time() for _ in range(runs)),
+        "help_ms": statistics.median(get_wall_time(HELP_CODE, ["--help"]) for _ in range(runs)),
+        "python_ms": statistics.median(get_wall_time("pass") for _ in range(runs)),
+    }
+
+
+def get_regressions(results, max_import_ms, baseline = None, tolerance = 0.5, slack_ms = 2):
+    """
+    Get the regressions of a benchmark.
+
+    Args:
+        results (dict): Benchmark results, see run().
+        max_import_ms (float): Maximum import time.
+        baseline (dict): Results of a previous benchmark.
+        tolerance (float): Maximum import time increase over the baseline,
+            as a fraction.
+        slack_ms (float): Import time increase always tolerated (noise).
+
+    Returns:
+        regressions (list): Messages, empty if none.
+    """
+    regressions = []
+    if results["heavy_modules"]:
+        regressions.append("Heavy modules loaded: {0}".format(
+            ", ".join(results["heavy_modules"])
+        ))
+    if results["import_ms"] > max_import_ms:
+        regressions.append("Import time {0:.1f}ms over {1:.1f}ms".format(
+            results["import_ms"], max_import_ms
+        ))
+    if baseline:
+        limit = max(
+            baseline["import_ms"] * (1 + tolerance),
+            baseline["import_ms"] + slack_ms,
+        )
+        if results["import_ms"] > limit:
+            regressions.append("Import time {0:.1f}ms regressed from {1:.1f}ms".format(
+                results["import_ms"], baseline["import_ms"]
+            ))
+    return regressions
+
+
+def get_command(args):
+    """
+    Parse command argument list into dict.
+
+    Parameters:
+        args (list): Argument list (typically sys.argv[1:]).
+
+    Returns:
+        args (dict): Argument dict.
+    """
+    parser = argparse.ArgumentParser(
+        description = "Benchmark runkubejobs CLI startup time",
+    )
+    parser.add_argument(
+        "--baseline",
+        action = "store",
+        type = str,
+        help = "compare with a previous results JSON file",
+        required = False,
+    )
+    parser.add_argument(
+        "--max-import-ms",
+        action = "store",
+        type = float,
+        help = "set maximum import time of runkubejobs.cli (milliseconds)",
+        default = 25,
+        required = False,
+    )
+    parser.add_argument(
+        "-o", "--output",
+        action = "store",
+        type = str,
+        help = "write results JSON to file",
+        required = False,
+    )
+    parser.add_argument(
+        "--runs",
+        action = "store",
+        type = int,
+        help = "set runs of each timing",
+        default = 10,
+        required = False,
+    )
+    parser.add_argument(
+        "--tolerance",
+        action = "store",
+        type = float,
+        help = "set maximum import time increase over the baseline (fraction)",
+        default = 0.5,
+        required = False,
+    )
+    args = vars(parser.parse_args(args))
+    return args
+
+
+def main():
+    d = get_command(sys.argv[1:])
+    results = run(d["runs"])
+    results["python"] = platform.python_version()
+    print(
+        "import: {import_ms:.1f}ms, --help: {help_ms:.1f}ms "
+        "(python: {python_ms:.1f}ms)".format(**results)
+    )
+    baseline = None
+    if d["baseline"]:
+        with open(d["baseline"]) as f:
+            baseline = json.load(f)
+    if d["output"]:
+        with open(d["output"], "w") as f:
+            json.dump(results, f, indent = 2)
+    regressions = get_regressions(
+        results,
+        d["max_import_ms"],
+        baseline = baseline,
+        tolerance = d["tolerance"],
+    )
+    for msg in regressions:
+        print("FAIL: {0}".format(msg))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1030 @@
+#!/usr/bin/env python3
+
+"""
+This module implements a local stand-in for the Kubernetes API server.
+
+It serves the job, pod, node and event endpoints used by runkubejobs (list,
+watch, read, create, patch, delete, delete collection and pod log) from an
+in-memory store, so the controller can be benchmarked without a cluster.
+Objects are namespaced as in Kubernetes. Pods of created jobs go through a
+scripted lifecycle (Pending, Running, then Succeeded or Failed) with
+Kubernetes events for each transition.
+
+Patches are JSON merge patches. Two of them drive the lifecycle as the
+controller expects: a pod with a start barrier init container (see
+kubejobs.get_barrier_dict) waits at it until annotated with its release time
+(see barrier.release), and a job's activeDeadlineSeconds fails its active
+pods once exceeded (see kubejobs.cancel_job).
+
+The scenario (number of nodes, lifecycle delays, failures and per-request
+latency) is set on start-up and can be replaced at run time with
+POST /_reset. Request counts are served by GET /_stats.
+
+Usage:
+    python -m benchmarks.fakeapi --port 8080 --scenario scenario.json
+
+"""
+
+import argparse
+import bisect
+import collections
+import copy
+import datetime
+import heapq
+import http.server
+import itertools
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCENARIO = {
+    "nodes": 10,  # Number of ready worker nodes
+    "schedule_delay": 0.05,  # Job created -> pod Pending, seconds
+    "start_delay": 0.1,  # Pod Pending -> Running, seconds
+    "run_time": 0.5,  # Pod Running -> Succeeded/Failed, seconds
+    "jitter": 0.0,  # Random +/- fraction of each delay
+    "fail_nodes": [],  # Pods on these nodes fail
+    "fail_rate": 0.0,  # Fraction of other pods that fail
+    "latency": {},  # Added seconds per request, keyed by verb
+    "seed": 0,
+}
+
+RESOURCES = {
+    "jobs": ("batch/v1", "Job"),
+    "pods": ("v1", "Pod"),
+    "nodes": ("v1", "Node"),
+    "events": ("v1", "Event"),
+}
+
+# Start barrier of rendered templates, see kubejobs.get_barrier_dict
+BARRIER_ANNOTATION = "runkubejobs/release-at"
+BARRIER_CONTAINER = "barrier"
+
+ROUTES = [
+    re.compile(r"^/api/v1/(?P<resource>nodes)(?:/(?P<name>[^/]+))?$"),
+    re.compile(
+        r"^/api/v1/namespaces/(?P<namespace>[^/]+)/(?P<resource>pods|events)"
+        r"(?:/(?P<name>[^/]+)(?:/(?P<sub>log))?)?$"
+    ),
+    re.compile(
+        r"^/apis/batch/v1/namespaces/(?P<namespace>[^/]+)/(?P<resource>jobs)"
+        r"(?:/(?P<name>[^/]+))?$"
+    ),
+]
+
+
+def get_timestamp(t = None):
+    """
+    Get an RFC3339 timestamp.
+
+    Args:
+        t (float): Seconds since the epoch, now if None.
+
+    Returns:
+        ts (str): Timestamp in UTC.
+    """
+    dt = datetime.datetime.fromtimestamp(
+        time.time() if t is None else t,
+        datetime.timezone.utc,
+    )
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_timestamp(ts):
+    """
+    Parse an RFC3339 timestamp.
+
+    Args:
+        ts (str): Timestamp in UTC, as from get_timestamp.
+
+    Returns:
+        t (float): Seconds since the epoch.
+    """
+    dt = datetime.datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ")
+    return dt.replace(tzinfo = datetime.timezone.utc).timestamp()
+
+
+def get_merge_patch(obj, patch):
+    """
+    Apply a JSON merge patch (RFC 7386) to an object.
+
+    Args:
+        obj (dict): Object, not modified.
+        patch (dict): Merge patch; None values remove keys.
+
+    Returns:
+        obj (dict): Patched copy of the object.
+    """
+    obj = dict(obj) if isinstance(obj, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            obj.pop(key, None)
+        elif isinstance(value, dict):
+            obj[key] = get_merge_patch(obj.get(key), value)
+        else:
+            obj[key] = copy.deepcopy(value)
+    return obj
+
+
+def get_field(obj, path):
+    """
+    Get a field of an object by dotted path (e.g. involvedObject.kind).
+
+    Args:
+        obj (dict): Object.
+        path (str): Dotted path of the field.
+
+    Returns:
+        value (str or None): Value of the field.
+    """
+    for key in path.split("."):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def parse_selector(selector):
+    """
+    Parse a label or field selector, equality or set-based.
+
+    Args:
+        selector (str): Selector (e.g. "task=runxhpl,log-id=abc" or
+            "job-group notin (a,b)").
+
+    Returns:
+        terms (list): (key, values, negated) tuples; an object matches a
+            term if its value is in values, or is not if negated.
+    """
+    terms = []
+    # Commas inside a set's parentheses do not separate terms
+    for term in re.split(r",(?![^()]*\))", selector or ""):
+        term = term.strip()
+        if not term:
+            continue
+        match = re.match(r"^(\S+)\s+(in|notin)\s*\((.*)\)$", term)
+        if match:
+            (key, op, values) = match.groups()
+            values = frozenset(v.strip() for v in values.split(",") if v.strip())
+            terms.append((key, values, op == "notin"))
+        elif "!=" in term:
+            (key, value) = term.split("!=", 1)
+            terms.append((key, frozenset([value]), True))
+        else:
+            (key, value) = term.split("==", 1) if "==" in term else term.split("=", 1)
+            terms.append((key, frozenset([value]), False))
+    return terms
+
+
+def is_match(obj, label_terms, field_terms):
+    """
+    Check if an object matches parsed label and field selectors.
+
+    Args:
+        obj (dict): Object.
+        label_terms (list): Parsed label selector.
+        field_terms (list): Parsed field selector.
+
+    Returns:
+        match (bool): Whether the object matches.
+    """
+    labels = obj["metadata"].get("labels") or {}
+    for (key, values, negated) in label_terms:
+        if (labels.get(key) in values) == negated:
+            return False
+    for (key, values, negated) in field_terms:
+        if (str(get_field(obj, key)) in values) == negated:
+            return False
+    return True
+
+
+class Store:
+    """
+    A class for the in-memory objects of the fake API server.
+
+    Objects are keyed by (namespace, name), with a namespace of None for
+    nodes. Every change bumps a global resourceVersion and is appended to a
+    change log that watches read from. Stored objects are never mutated,
+    each change stores a new copy.
+
+    Attributes:
+        scenario (dict): Scenario of the run.
+        stats (Counter): Number of requests, keyed by "VERB resource".
+    """
+    def __init__(self, scenario):
+        """
+        Init with scenario.
+
+        Args:
+            scenario (dict): Scenario of the run, see DEFAULT_SCENARIO.
+        """
+        self._cond = threading.Condition()
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._stopped = False
+        self.reset(scenario)
+        self._thread = threading.Thread(
+            target = self._run_timers,
+            name = "thread.lifecycle",
+            daemon = True,
+        )
+        self._thread.start()
+
+    def reset(self, scenario):
+        """
+        Replace all objects, pending lifecycles and stats.
+
+        Args:
+            scenario (dict): Scenario of the run, see DEFAULT_SCENARIO.
+
+        Returns:
+            None
+        """
+        with self._cond:
+            self.scenario = dict(DEFAULT_SCENARIO, **(scenario or {}))
+            self.stats = collections.Counter()
+            self._objs = {resource: {} for resource in RESOURCES}
+            self._log = []
+            self._log_rvs = []
+            self._rv = 0
+            self._timers = []
+            self._random = random.Random(self.scenario["seed"])
+            self._event_seq = itertools.count()
+            for i in range(self.scenario["nodes"]):
+                self._put("nodes", "ADDED", get_node("node-{0:05d}".format(i)))
+            self._cond.notify_all()
+        return None
+
+    def stop(self):
+        """Stop the lifecycle thread and end all watches."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        return None
+
+    def _put(self, resource, event_type, obj):
+        """Store a change and append it to the change log. Needs the lock."""
+        self._rv += 1
+        obj["metadata"]["resourceVersion"] = str(self._rv)
+        key = get_key(obj)
+        if event_type == "DELETED":
+            self._objs[resource].pop(key, None)
+        else:
+            self._objs[resource][key] = obj
+        self._log.append((resource, event_type, obj))
+        self._log_rvs.append(self._rv)
+        self._cond.notify_all()
+        return obj
+
+    def get_resource_version(self):
+        """Get the current resourceVersion."""
+        with self._cond:
+            return self._rv
+
+    def get(self, resource, namespace, name):
+        """
+        Get an object.
+
+        Args:
+            resource (str): Resource (e.g. jobs).
+            namespace (str): Namespace of the object, None for nodes.
+            name (str): Name of the object.
+
+        Returns:
+            obj (dict or None): Object.
+        """
+        with self._cond:
+            return self._objs[resource].get((namespace, name))
+
+    def list(
+        self, resource, namespace = None, label_selector = None,
+        field_selector = None
+    ):
+        """
+        List objects matching selectors.
+
+        Args:
+            resource (str): Resource (e.g. jobs).
+            namespace (str): Namespace of the objects, None for all.
+            label_selector (str): Label selector.
+            field_selector (str): Field selector.
+
+        Returns:
+            tuple(
+                resource_version (str): resourceVersion of the list.
+                items (list): Objects.
+            )
+        """
+        label_terms = parse_selector(label_selector)
+        field_terms = parse_selector(field_selector)
+        with self._cond:
+            items = [
+                obj for (namespace_, _), obj in self._objs[resource].items()
+                if namespace in (None, namespace_)
+                and is_match(obj, label_terms, field_terms)
+            ]
+            return (str(self._rv), items)
+
+    def gen_changes(
+        self, resource, resource_version, timeout, namespace = None,
+        label_selector = None, field_selector = None
+    ):
+        """
+        Generate changes after a resourceVersion until timeout.
+
+        Args:
+            resource (str): Resource (e.g. jobs).
+            resource_version (str): Only changes after this are generated.
+            timeout (float): Seconds until the watch ends.
+            namespace (str): Namespace of the objects, None for all.
+            label_selector (str): Label selector.
+            field_selector (str): Field selector.
+
+        Yields:
+            change (tuple): (event_type, obj).
+        """
+        label_terms = parse_selector(label_selector)
+        field_terms = parse_selector(field_selector)
+        time_deadline = time.monotonic() + timeout
+        rv = int(resource_version or 0)
+        while True:
+            with self._cond:
+                pos = bisect.bisect_right(self._log_rvs, rv)
+                while pos >= len(self._log) and not self._stopped:
+                    time_remaining = time_deadline - time.monotonic()
+                    if time_remaining <= 0:
+                        return None
+                    self._cond.wait(time_remaining)
+                if self._stopped:
+                    return None
+                changes = self._log[pos:]
+                rv = self._log_rvs[-1]
+            for (resource_, event_type, obj) in changes:
+                if (
+                    resource_ == resource
+                    and namespace in (None, obj["metadata"].get("namespace"))
+                    and is_match(obj, label_terms, field_terms)
+                ):
+                    yield (event_type, obj)
+
+    def create(self, resource, namespace, obj):
+        """
+        Create an object, and start the lifecycle of a job.
+
+        Args:
+            resource (str): Resource (e.g. jobs).
+            namespace (str): Namespace of the object.
+            obj (dict): Object to create.
+
+        Returns:
+            obj (dict or None): Created object, None if it already exists.
+        """
+        obj = copy.deepcopy(obj)
+        metadata = obj.setdefault("metadata", {})
+        metadata["namespace"] = namespace
+        metadata["uid"] = str(uuid.uuid4())
+        metadata["creationTimestamp"] = get_timestamp()
+        obj["status"] = {}
+        with self._cond:
+            key = get_key(obj)
+            if key in self._objs[resource]:
+                return None
+            self._put(resource, "ADDED", obj)
+            if resource == "jobs":
+                self._add_event(obj, "SuccessfulCreate", "Normal")
+                self._after("schedule_delay", self._create_pods, key)
+        return obj
+
+    def patch(self, resource, namespace, name, patch):
+        """
+        Patch an object with a JSON merge patch.
+
+        A release time annotated on a pod waiting at its start barrier
+        starts it at that time, and an activeDeadlineSeconds set on a job
+        fails its active pods once exceeded.
+
+        Args:
+            resource (str): Resource (e.g. jobs).
+            namespace (str): Namespace of the object.
+            name (str): Name of the object.
+            patch (dict): Merge patch.
+
+        Returns:
+            obj (dict or None): Patched object, None if not found.
+        """
+        key = (namespace, name)
+        with self._cond:
+            obj = self._objs[resource].get(key)
+            if obj is None:
+                return None
+            obj = get_merge_patch(obj, patch)
+            self._put(resource, "MODIFIED", obj)
+            if resource == "pods":
+                release_at = (obj["metadata"].get("annotations") or {}).get(
+                    BARRIER_ANNOTATION
+                )
+                if release_at and is_at_barrier(obj):
+                    self._at(
+                        max(0, int(release_at) - time.time()),
+                        self._set_phase, key, "Running",
+                    )
+            elif resource == "jobs":
+                deadline = obj["spec"].get("activeDeadlineSeconds")
+                if deadline is not None:
+                    time_elapsed = time.time() - parse_timestamp(
+                        obj["status"].get("startTime") or obj["metadata"]["creationTimestamp"]
+                    )
+                    self._at(max(0, deadline - time_elapsed), self._expire_job, key)
+        return obj
+
+    def delete(self, resource, namespace, name):
+        """
+        Delete an object, and the pods of a job.
+
+        Args:
+            resource (str): Resource (e.g. jobs).
+            namespace (str): Namespace of the object, None for nodes.
+            name (str): Name of the object.
+
+        Returns:
+            obj (dict or None): Deleted object, None if not found.
+        """
+        with self._cond:
+            obj = self._objs[resource].get((namespace, name))
+            if obj is None:
+                return None
+            if resource == "jobs":
+                for pod in self._get_job_pods((namespace, name)):
+                    self._put("pods", "DELETED", copy.deepcopy(pod))
+            self._put(resource, "DELETED", copy.deepcopy(obj))
+        return obj
+
+    def _get_job_pods(self, job_key):
+        """Get the pods of a job. Needs the lock."""
+        (namespace, job_name) = job_key
+        return [
+            pod for (namespace_, _), pod in list(self._objs["pods"].items())
+            if namespace_ == namespace
+            and pod["metadata"]["labels"].get("job-name") == job_name
+        ]
+
+    def _after(self, delay_key, fn, *args):
+        """Run fn(*args) after a scenario delay. Needs the lock."""
+        delay = self.scenario[delay_key]
+        jitter = self.scenario["jitter"]
+        if jitter:
+            delay *= 1 + self._random.uniform(-jitter, jitter)
+        return self._at(delay, fn, *args)
+
+    def _at(self, delay, fn, *args):
+        """Run fn(*args) after delay seconds. Needs the lock."""
+        heapq.heappush(
+            self._timers,
+            (time.monotonic() + max(0, delay), next(self._timer_seq), fn, args),
+        )
+        self._cond.notify_all()
+        return None
+
+    def _run_timers(self):
+        """Run scripted lifecycle steps when they are due."""
+        with self._cond:
+            while not self._stopped:
+                if not self._timers:
+                    self._cond.wait()
+                    continue
+                time_due = self._timers[0][0]
+                time_remaining = time_due - time.monotonic()
+                if time_remaining > 0:
+                    self._cond.wait(time_remaining)
+                    continue
+                (_, _, fn, args) = heapq.heappop(self._timers)
+                fn(*args)
+        return None
+
+    def _add_event(self, obj, reason, event_type):
+        """Add a Kubernetes event about an object. Needs the lock."""
+        name = "{0}.{1:x}".format(obj["metadata"]["name"], next(self._event_seq))
+        ts = get_timestamp()
+        event = {
+            "metadata": {"name": name, "namespace": obj["metadata"]["namespace"]},
+            "involvedObject": {
+                "kind": obj["kind"],
+                "name": obj["metadata"]["name"],
+                "namespace": obj["metadata"]["namespace"],
+                "uid": obj["metadata"]["uid"],
+            },
+            "reason": reason,
+            "type": event_type,
+            "message": reason,
+            "count": 1,
+            "firstTimestamp": ts,
+            "lastTimestamp": ts,
+        }
+        self._put("events", "ADDED", event)
+        return None
+
+    def _create_pods(self, job_key):
+        """Create the pods of a job in Pending phase."""
+        job = self._objs["jobs"].get(job_key)
+        if job is None:
+            return None
+        spec = job["spec"]
+        completions = spec.get("completions") or 1
+        indexed = spec.get("completionMode") == "Indexed"
+        nodes = get_affinity_nodes(spec["template"]["spec"])
+        for index in range(completions):
+            node = nodes[index % len(nodes)] if nodes else "node-00000"
+            pod = get_pod(job, index if indexed else None, node, self._random)
+            self._put("pods", "ADDED", pod)
+            self._add_event(pod, "Scheduled", "Normal")
+            if is_barrier(pod):
+                self._after("start_delay", self._start_barrier, get_key(pod))
+            else:
+                self._after("start_delay", self._set_phase, get_key(pod), "Running")
+        self._update_job(job_key)
+        return None
+
+    def _start_barrier(self, pod_key):
+        """Start the barrier init container of a pod, still Pending."""
+        pod = self._objs["pods"].get(pod_key)
+        if pod is None or pod["status"]["phase"] != "Pending":
+            return None
+        pod = copy.deepcopy(pod)
+        pod["status"]["initContainerStatuses"] = [{
+            "name": BARRIER_CONTAINER,
+            "ready": False,
+            "restartCount": 0,
+            "image": pod["spec"]["initContainers"][-1].get("image") or "",
+            "imageID": "",
+            "state": {"running": {"startedAt": get_timestamp()}},
+        }]
+        self._put("pods", "MODIFIED", pod)
+        # Already annotated, e.g. by a release racing the barrier's start
+        release_at = (pod["metadata"].get("annotations") or {}).get(BARRIER_ANNOTATION)
+        if release_at:
+            self._at(max(0, int(release_at) - time.time()), self._set_phase, pod_key, "Running")
+        return None
+
+    def _set_phase(self, pod_key, phase):
+        """Move a pod to a phase, then schedule its next step."""
+        pod = self._objs["pods"].get(pod_key)
+        if pod is None or pod["status"]["phase"] in ("Succeeded", "Failed", phase):
+            return None
+        pod = copy.deepcopy(pod)
+        pod["status"]["phase"] = phase
+        for cs in pod["status"].get("initContainerStatuses") or []:
+            cs["state"] = {"terminated": {"exitCode": 0, "reason": "Completed"}}
+        self._put("pods", "MODIFIED", pod)
+        if phase == "Running":
+            self._add_event(pod, "Started", "Normal")
+            node = pod["spec"]["nodeName"]
+            failed = (
+                node in self.scenario["fail_nodes"]
+                or self._random.random() < self.scenario["fail_rate"]
+            )
+            self._after(
+                "run_time", self._set_phase, pod_key,
+                "Failed" if failed else "Succeeded",
+            )
+        elif phase == "Failed":
+            self._add_event(pod, "BackOff", "Warning")
+        else:
+            self._add_event(pod, "Completed", "Normal")
+        self._update_job((pod_key[0], pod["metadata"]["labels"]["job-name"]))
+        return None
+
+    def _expire_job(self, job_key):
+        """Fail a job past its activeDeadlineSeconds, and its active pods."""
+        job = self._objs["jobs"].get(job_key)
+        if job is None or job["status"].get("conditions"):
+            return None
+        for pod in self._get_job_pods(job_key):
+            if pod["status"]["phase"] in ("Pending", "Running"):
+                pod = copy.deepcopy(pod)
+                pod["status"]["phase"] = "Failed"
+                pod["status"]["reason"] = "DeadlineExceeded"
+                self._put("pods", "MODIFIED", pod)
+        job = copy.deepcopy(job)
+        job["status"]["conditions"] = [{
+            "type": "Failed",
+            "status": "True",
+            "reason": "DeadlineExceeded",
+        }]
+        self._put("jobs", "MODIFIED", job)
+        self._update_job(job_key)
+        self._add_event(job, "DeadlineExceeded", "Warning")
+        return None
+
+    def _update_job(self, job_key):
+        """Update job status from the phases of its pods."""
+        job = self._objs["jobs"].get(job_key)
+        if job is None:
+            return None
+        phases = collections.Counter(
+            pod["status"]["phase"] for pod in self._get_job_pods(job_key)
+        )
+        job = copy.deepcopy(job)
+        status = {
+            "active": phases["Pending"] + phases["Running"],
+            "startTime": job["status"].get("startTime") or get_timestamp(),
+        }
+        if phases["Succeeded"]:
+            status["succeeded"] = phases["Succeeded"]
+        if phases["Failed"]:
+            status["failed"] = phases["Failed"]
+        condition = None
+        if job["status"].get("conditions"):
+            condition = job["status"]["conditions"][0]["type"]  # Finished
+        elif phases["Failed"] > (job["spec"].get("backoffLimit") or 0):
+            condition = "Failed"
+        elif phases["Succeeded"] >= (job["spec"].get("completions") or 1):
+            condition = "Complete"
+        if job["status"].get("conditions"):
+            status["conditions"] = job["status"]["conditions"]
+            status["completionTime"] = job["status"].get("completionTime") or get_timestamp()
+        elif condition:
+            status["conditions"] = [{"type": condition, "status": "True"}]
+            status["completionTime"] = get_timestamp()
+        if status == job["status"]:
+            return None
+        changed = condition and not job["status"].get("conditions")
+        job["status"] = status
+        self._put("jobs", "MODIFIED", job)
+        if changed:
+            self._add_event(
+                job,
+                "Completed" if condition == "Complete" else "BackoffLimitExceeded",
+                "Normal" if condition == "Complete" else "Warning",
+            )
+        return None
+
+
+def get_key(obj):
+    """Get the store key of an object, (namespace, name)."""
+    return (obj["metadata"].get("namespace"), obj["metadata"]["name"])
+
+
+def is_barrier(pod):
+    """Check if a pod has a start barrier init container."""
+    return any(
+        c.get("name") == BARRIER_CONTAINER
+        for c in pod["spec"].get("initContainers") or []
+    )
+
+
+def is_at_barrier(pod):
+    """Check if a pod is waiting at its start barrier."""
+    return pod["status"]["phase"] == "Pending" and any(
+        cs["name"] == BARRIER_CONTAINER and "running" in cs["state"]
+        for cs in pod["status"].get("initContainerStatuses") or []
+    )
+
+
+def get_node(name):
+    """
+    Get a ready worker node.
+
+    Args:
+        name (str): Name of the node.
+
+    Returns:
+        obj (dict): Node.
+    """
+    return {
+        "metadata": {
+            "name": name,
+            "labels": {"kubernetes.io/hostname": name},
+            "uid": str(uuid.uuid4()),
+            "creationTimestamp": get_timestamp(),
+        },
+        "spec": {},
+        "status": {
+            "conditions": [{"type": "Ready", "status": "True"}],
+            "allocatable": {"cpu": "64", "memory": "256Gi"},
+        },
+    }
+
+
+def get_affinity_nodes(pod_spec):
+    """
+    Get the node names of a pod's required hostname node affinity.
+
+    Args:
+        pod_spec (dict): Pod spec.
+
+    Returns:
+        nodes (list): Node names.
+    """
+    nodes = []
+    terms = get_field(
+        pod_spec,
+        "affinity.nodeAffinity.requiredDuringSchedulingIgnoredDuringExecution",
+    ) or {}
+    for term in terms.get("nodeSelectorTerms", []):
+        for expr in term.get("matchExpressions", []):
+            if expr.get("key") == "kubernetes.io/hostname":
+                nodes.extend(expr.get("values", []))
+    return nodes
+
+
+def get_pod(job, index, node, random_):
+    """
+    Get a Pending pod of a job.
+
+    Args:
+        job (dict): Parent job.
+        index (int or None): Completion index, None if not indexed.
+        node (str): Name of the node the pod is scheduled on.
+        random_ (Random): Random generator, for the name suffix.
+
+    Returns:
+        obj (dict): Pod.
+    """
+    template = job["spec"]["template"]
+    job_name = job["metadata"]["name"]
+    suffix = "".join(random_.choice("bcdfghjklmnpqrstvwxz2456789") for _ in range(5))
+    prefix = job_name if index is None else "{0}-{1}".format(job_name, index)
+    labels = dict(template.get("metadata", {}).get("labels") or {})
+    labels["job-name"] = job_name
+    annotations = {}
+    if index is not None:
+        annotations["batch.kubernetes.io/job-completion-index"] = str(index)
+    spec = copy.deepcopy(template["spec"])
+    spec["nodeName"] = node
+    return {
+        "kind": "Pod",
+        "apiVersion": "v1",
+        "metadata": {
+            "name": "{0}-{1}".format(prefix, suffix),
+            "namespace": job["metadata"]["namespace"],
+            "labels": labels,
+            "annotations": annotations,
+            "uid": str(uuid.uuid4()),
+            "creationTimestamp": get_timestamp(),
+        },
+        "spec": spec,
+        "status": {"phase": "Pending", "startTime": get_timestamp()},
+    }
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    A class for handling fake Kubernetes API requests.
+
+    Attributes:
+        store (Store): Store of the server, set by get_server.
+    """
+    protocol_version = "HTTP/1.1"
+    store = None
+
+    def log_message(self, format_, *args):
+        logger.debug(format_ % args)
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+    def _send_status(self, code, reason, message):
+        self._send_json(code, {
+            "kind": "Status",
+            "apiVersion": "v1",
+            "status": "Failure" if code >= 400 else "Success",
+            "reason": reason,
+            "message": message,
+            "code": code,
+        })
+        return None
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _route(self):
+        """Parse the request path into (route, params)."""
+        url = urllib.parse.urlsplit(self.path)
+        params = {
+            key: values[-1]
+            for key, values in urllib.parse.parse_qs(url.query).items()
+        }
+        for pattern in ROUTES:
+            m = pattern.match(url.path)
+            if m:
+                return (m.groupdict(), params)
+        return (None, params)
+
+    def _count(self, verb, resource):
+        store = self.store
+        store.stats["{0} {1}".format(verb, resource)] += 1
+        latency = store.scenario["latency"].get(verb)
+        if latency:
+            time.sleep(latency)
+        return None
+
+    def do_GET(self):
+        if self.path.startswith("/_stats"):
+            return self._send_json(200, dict(self.store.stats))
+        (route, params) = self._route()
+        if route is None:
+            return self._send_status(404, "NotFound", self.path)
+        resource = route["resource"]
+        if route.get("sub"):
+            self._count("LOG", resource)
+            return self._send_log(route["namespace"], route["name"])
+        if route["name"]:
+            self._count("GET", resource)
+            obj = self.store.get(resource, route.get("namespace"), route["name"])
+            if obj is None:
+                return self._send_status(404, "NotFound", route["name"])
+            return self._send_json(200, self._with_kind(resource, obj))
+        if params.get("watch") in ("true", "1"):
+            self._count("WATCH", resource)
+            return self._send_watch(resource, route, params)
+        self._count("LIST", resource)
+        (rv, items) = self.store.list(
+            resource,
+            route.get("namespace"),
+            params.get("labelSelector"),
+            params.get("fieldSelector"),
+        )
+        (api_version, kind) = RESOURCES[resource]
+        return self._send_json(200, {
+            "kind": "{0}List".format(kind),
+            "apiVersion": api_version,
+            "metadata": {"resourceVersion": rv},
+            "items": items,
+        })
+
+    def do_POST(self):
+        if self.path.startswith("/_reset"):
+            self.store.reset(self._read_body())
+            return self._send_json(200, {"nodes": self.store.scenario["nodes"]})
+        (route, params) = self._route()
+        if route is None or route["name"]:
+            return self._send_status(405, "MethodNotAllowed", self.path)
+        resource = route["resource"]
+        self._count("CREATE", resource)
+        obj = self.store.create(resource, route["namespace"], self._read_body())
+        if obj is None:
+            return self._send_status(409, "AlreadyExists", self.path)
+        return self._send_json(201, self._with_kind(resource, obj))
+
+    def do_PATCH(self):
+        (route, params) = self._route()
+        if route is None or not route["name"] or route.get("sub"):
+            return self._send_status(405, "MethodNotAllowed", self.path)
+        resource = route["resource"]
+        patch = self._read_body()
+        if resource not in ("jobs", "pods") or not isinstance(patch, dict):
+            return self._send_status(415, "UnsupportedMediaType", self.path)
+        self._count("PATCH", resource)
+        obj = self.store.patch(resource, route["namespace"], route["name"], patch)
+        if obj is None:
+            return self._send_status(404, "NotFound", route["name"])
+        return self._send_json(200, self._with_kind(resource, obj))
+
+    def do_DELETE(self):
+        (route, params) = self._route()
+        if route is None:
+            return self._send_status(404, "NotFound", self.path)
+        self._read_body()
+        resource = route["resource"]
+        if route["name"]:
+            self._count("DELETE", resource)
+            obj = self.store.delete(resource, route.get("namespace"), route["name"])
+            if obj is None:
+                return self._send_status(404, "NotFound", route["name"])
+            return self._send_status(200, None, route["name"])
+        self._count("DELETECOLLECTION", resource)
+        (_, items) = self.store.list(
+            resource,
+            route.get("namespace"),
+            params.get("labelSelector"),
+            params.get("fieldSelector"),
+        )
+        for obj in items:
+            self.store.delete(resource, *get_key(obj))
+        return self._send_status(200, None, resource)
+
+    def _with_kind(self, resource, obj):
+        (api_version, kind) = RESOURCES[resource]
+        return dict(obj, apiVersion = api_version, kind = kind)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        return None
+
+    def _send_watch(self, resource, route, params):
+        # A reset starts a new change log, so older watches must re-list
+        if int(params.get("resourceVersion") or 0) > self.store.get_resource_version():
+            return self._send_status(410, "Expired", "too old resource version")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for (event_type, obj) in self.store.gen_changes(
+                resource,
+                params.get("resourceVersion"),
+                float(params.get("timeoutSeconds") or 300),
+                route.get("namespace"),
+                params.get("labelSelector"),
+                params.get("fieldSelector"),
+            ):
+                line = json.dumps({
+                    "type": event_type,
+                    "object": self._with_kind(resource, obj),
+                })
+                self._write_chunk(line.encode() + b"\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        return None
+
+    def _send_log(self, namespace, pod_name):
+        pod = self.store.get("pods", namespace, pod_name)
+        if pod is None:
+            return self._send_status(404, "NotFound", pod_name)
+        ts = pod["metadata"]["creationTimestamp"]
+        body = "".join(
+            "{0} {1} line {2}\n".format(ts, pod_name, i) for i in range(10)
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+
+def get_server(port = 0, scenario = None, host = "127.0.0.1"):
+    """
+    Create a fake Kubernetes API server.
+
+    Args:
+        port (int): Port to listen on, 0 for any free port.
+        scenario (dict): Scenario of the run, see DEFAULT_SCENARIO.
+        host (str): Address to listen on.
+
+    Returns:
+        server (ThreadingHTTPServer): Server, not yet serving.
+    """
+    handler = type("BoundHandler", (Handler,), {"store": Store(scenario)})
+    http.server.ThreadingHTTPServer.request_queue_size = 1024
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def get_command(args):
+    parser = argparse.ArgumentParser(
+        description = "Fake Kubernetes API server for benchmarks",
+    )
+    parser.add_argument(
+        "--port",
+        action = "store",
+        type = int,
+        help = "set port to listen on (0 for any)",
+        default = 0,
+        required = False,
+    )
+    parser.add_argument(
+        "--scenario",
+        action = "store",
+        type = str,
+        help = "set scenario JSON file",
+        required = False,
+    )
+    return vars(parser.parse_args(args))
+
+
+def main():
+    d = get_command(sys.argv[1:])
+    scenario = None
+    if d["scenario"]:
+        with open(d["scenario"]) as f:
+            scenario = json.load(f)
+    server = get_server(d["port"], scenario)
+    print("http://{0}:{1}".format(*server.server_address), flush = True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+
+"""
+This module implements an asyncio engine for the Kubernetes Job controller.
+
+Spawning, watching, status checks, log collection and cleanup are coroutines
+on one event loop. All of them share one ApiClient, and therefore one HTTP
+connection pool, so a single process can drive thousands of nodes without a
+thread per stream.
+
+The group is tracked the same way as by the threaded engine: jobs and pods
+are listed then watched by task/log-id labels into a local store, events are
+streamed for logging, and each change is checked for completion/failure.
+Status logic is shared with kubejobs.
+
+Requires the optional kubernetes_asyncio package:
+
+    python3 -m pip install runkubejobs[async]
+
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import sys
+import time
+
+import aiohttp
+from kubernetes_asyncio import client
+from kubernetes_asyncio import config
+from kubernetes_asyncio import utils as kubeutils
+from kubernetes_asyncio import watch
+from kubernetes_asyncio.client.rest import ApiException
+
+from runkubejobs import kubejobs
+from runkubejobs import podlogs
+
+logger = logging.getLogger(__name__)
+
+
+class GroupStore:
+    """
+    A class for storing the Jobs and Pods of a task group.
+
+    Attributes:
+        expected (int or None): Number of jobs expected in the group.
+        jobs (dict): Jobs, keyed by name.
+        pods (dict): Pods, keyed by name.
+        counts (dict): Number of jobs per status.
+    """
+    def __init__(self, expected = None):
+        """
+        Init with expected number of jobs.
+
+        Args:
+            expected (int): Number of jobs expected in the group.
+        """
+        self.expected = expected
+        self.jobs = {}
+        self.pods = {}
+        self.counts = {"Succeeded": 0, "Failed": 0, "": 0}
+        self._status = {}
+        self._pod_by_job = {}
+
+    def apply(self, event_type, obj):
+        """
+        Apply a job/pod change to the store.
+
+        Args:
+            event_type (str): ADDED, MODIFIED or DELETED.
+            obj (V1Job or V1Pod): Changed object.
+
+        Returns:
+            None
+        """
+        name = obj.metadata.name
+        if isinstance(obj, client.V1Job):
+            old = self._status.pop(name, None)
+            if old is not None:
+                self.counts[old] -= 1
+            if event_type == "DELETED":
+                self.jobs.pop(name, None)
+            else:
+                self.jobs[name] = obj
+                status = kubejobs.get_job_status(obj)
+                self._status[name] = status
+                self.counts[status] += 1
+        else:
+            job_name = (obj.metadata.labels or {}).get("job-group")
+            if event_type == "DELETED":
+                self.pods.pop(name, None)
+                if self._pod_by_job.get(job_name) == name:
+                    del self._pod_by_job[job_name]
+            else:
+                self.pods[name] = obj
+                self._pod_by_job.setdefault(job_name, name)
+        return None
+
+    def get_objs(self, kind, name):
+        """
+        Get the Job and Pod of an object.
+
+        Args:
+            kind (str): "job" or "pod".
+            name (str): Name of the object.
+
+        Returns:
+            tuple(
+                job (V1Job or None): Stored job.
+                pod (V1Pod or None): Stored pod.
+            )
+        """
+        job = None
+        pod = None
+        if kind == "job":
+            job = self.jobs.get(name)
+            pod = self.pods.get(self._pod_by_job.get(name))
+        elif kind == "pod":
+            pod = self.pods.get(name)
+            if pod:
+                job = self.jobs.get(pod.metadata.labels["job-group"])
+        return (job, pod)
+
+    def is_completed(self):
+        """
+        Check if all jobs in the group have succeeded.
+
+        Returns:
+            completed (bool): Whether the group is completed.
+        """
+        total = self.expected if self.expected else len(self._status)
+        return bool(total) and self.counts["Succeeded"] >= total
+
+
+async def relist(list_fn, known, namespace = "default", **kw_params):
+    """
+    List Kubernetes objects and diff them against the known objects.
+
+    Args:
+        list_fn (coroutine function): Kubernetes API list function.
+        known (dict): Known objects, keyed by name. Updated in place.
+        namespace (str): Namespace of the objects.
+        kw_params (dict): List parameters (e.g. label_selector).
+
+    Returns:
+        tuple(
+            resource_version (str): resourceVersion of the list.
+            events (list): Synthesised watch events for the differences.
+        )
+    """
+    list_ = await list_fn(namespace, **kw_params)
+    events = kubejobs.diff_objs(known, list_.items)
+    return (list_.metadata.resource_version, events)
+
+
+async def get_resource_version(list_fn, namespace = "default", **kw_params):
+    """
+    Get the current resourceVersion of Kubernetes objects, listing one.
+
+    This is the coroutine version of kubejobs.get_resource_version.
+
+    Args:
+        list_fn (coroutine function): Kubernetes API list function.
+        namespace (str): Namespace of the objects.
+        kw_params (dict): List parameters (e.g. field_selector).
+
+    Returns:
+        resource_version (str): resourceVersion of the list.
+    """
+    list_ = await list_fn(namespace, limit = 1, **kw_params)
+    return list_.metadata.resource_version
+
+
+async def gen_resumable_watch(
+    list_fn, known, resource_version, namespace = "default",
+    timeout = 300, backoff_max = 30, **kw_params
+):
+    """
+    Generate Kubernetes watch events, resuming the watch when it drops.
+
+    This is the coroutine version of kubejobs.gen_resumable_watch.
+
+    Args:
+        list_fn (coroutine function): Kubernetes API list function.
+        known (dict): Known objects, keyed by name. Updated in place. None
+            to not track them (e.g. events, which are only logged).
+        resource_version (str): resourceVersion to start the watch from.
+        namespace (str): Namespace of the objects.
+        timeout (int): Server-side timeout of each watch request, seconds.
+        backoff_max (int): Maximum seconds between reconnects.
+        kw_params (dict): Watch parameters (e.g. label_selector).
+
+    Yields:
+        event (dict): Kubernetes watch event.
+
+    Raises:
+        ApiException: A non-retryable error occured watching the objects.
+    """
+    backoff = 1
+    while True:
+        try:
+            async with watch.Watch() as w:
+                async for event in w.stream(
+                    list_fn,
+                    namespace,
+                    resource_version = resource_version,
+                    allow_watch_bookmarks = True,
+                    timeout_seconds = timeout,
+                    **kw_params
+                ):
+                    backoff = 1
+                    if event["type"] == "BOOKMARK":
+                        resource_version = event["raw_object"]["metadata"]["resourceVersion"]
+                        continue
+                    obj = event["object"]
+                    resource_version = obj.metadata.resource_version
+                    if known is not None and event["type"] == "DELETED":
+                        known.pop(obj.metadata.name, None)
+                    elif known is not None:
+                        known[obj.metadata.name] = obj
+                    yield event
+        except ApiException as err:
+            if err.status == 410 and known is None:
+                logger.info("Watch expired, resuming from now")
+                resource_version = await get_resource_version(
+                    list_fn, namespace, **kw_params
+                )
+                continue
+            elif err.status == 410:  # Gone, resourceVersion too old
+                logger.info("Watch expired, re-listing")
+                (resource_version, events) = await relist(
+                    list_fn, known, namespace, **kw_params
+                )
+                for event in events:
+                    yield event
+                continue
+            elif err.status and 400 <= err.status < 500 and err.status != 429:
+                raise err
+            logger.warning("Watch error, reconnecting in {0}s: {1}".format(
+                backoff, err.reason
+            ))
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as err:
+            logger.warning("Watch dropped, reconnecting in {0}s: {1}".format(
+                backoff, err
+            ))
+        else:
+            continue
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, backoff_max)
+
+
+async def spawn_job(api_client, worker_yaml):
+    """
+    Spawn a Kubernetes job from a dict of Kubernetes YAML.
+
+    Existing jobs of the same name are not looked up: the run has swept
+    them first (see kubejobs.sweep_jobs).
+
+    Args:
+        api_client (ApiClient): Shared Kubernetes API client.
+        worker_yaml (dict): Dict of Kubernetes YAML with runtime substitutions.
+
+    Returns:
+        job (V1Job): Spawned job.
+
+    Raises:
+        FailToCreateError: An error occured creating the job.
+    """
+    batch = client.BatchV1Api(api_client)
+    name = worker_yaml["metadata"]["name"]
+    logger.info("Creating worker: {0}".format(name))
+    await kubeutils.create_from_dict(api_client, worker_yaml)
+    job = await batch.read_namespaced_job(name, "default")
+    return job
+
+
+async def spawn_workers(
+    api_client, tmpl, task, nodes, log_id, image, max_in_flight = 16,
+    pull_policy = None
+):
+    """
+    Spawn Kubernetes jobs on worker nodes concurrently.
+
+    Args:
+        api_client (ApiClient): Shared Kubernetes API client.
+        tmpl (str): Filename of YAML template.
+        task (str): Job task to run (e.g. runxhpl).
+        nodes (list): Names of worker nodes.
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker nodes.
+        max_in_flight (int): Maximum number of concurrent spawns.
+        pull_policy (str): imagePullPolicy of all containers, None to keep
+            the template's.
+
+    Returns:
+        tuple(
+            workers (dict): Spawned V1Job, keyed by node name.
+            errors (dict): Spawn exceptions, keyed by node name.
+            latencies (dict): Spawn latency in seconds, keyed by node name.
+        )
+    """
+    workers = {}
+    errors = {}
+    latencies = {}
+    sem = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def _spawn(node):
+        async with sem:
+            time_start = time.monotonic()
+            try:
+                worker_yaml = kubejobs.get_dict_from_yaml(
+                    task, node, tmpl, log_id, image,
+                    pull_policy = pull_policy,
+                )
+                workers[node] = await spawn_job(api_client, worker_yaml)
+            except Exception as err:
+                logger.error("Failed to spawn worker: {0}-{1}: {2}".format(
+                    task, node, err
+                ))
+                errors[node] = err
+            else:
+                latencies[node] = time.monotonic() - time_start
+
+    await asyncio.gather(*[_spawn(node) for node in nodes])
+    return (workers, errors, latencies)
+
+
+async def delete_jobs(api_client, label_selector, propagation_policy = "Foreground"):
+    """
+    Delete Kubernetes jobs in the default namespace by label selector.
+
+    This is the coroutine version of kubejobs.delete_jobs.
+
+    Args:
+        api_client (ApiClient): Shared Kubernetes API client.
+        label_selector (str): Label selector of the jobs.
+        propagation_policy (str): Propagation policy, see kubejobs.delete_obj.
+
+    Returns:
+        None
+    """
+    logger.info("Deleting jobs: default/{0}".format(label_selector))
+    await client.BatchV1Api(api_client).delete_collection_namespaced_job(
+        "default",
+        label_selector = label_selector,
+        propagation_policy = propagation_policy,
+    )
+    return None
+
+
+async def watch_objs(q, list_fn, known, resource_version, kind, **kw_params):
+    """
+    Put job/pod/event changes from a resumable watch on a queue.
+
+    STOP_EVENT (see kubejobs) is put on the queue when the watch ends, e.g.
+    on a non-retryable error, so the dispatcher does not wait forever.
+
+    Args:
+        q (asyncio.Queue): Queue of (kind, event) for the dispatcher.
+        list_fn (coroutine function): Kubernetes API list function.
+        known (dict): Known objects, keyed by name.
+        resource_version (str): resourceVersion to start the watch from.
+        kind (str): "job", "pod" or "event".
+        kw_params (dict): Watch parameters (e.g. label_selector).
+
+    Returns:
+        None
+    """
+    try:
+        async for event in gen_resumable_watch(
+            list_fn, known, resource_version, **kw_params
+        ):
+            await q.put((kind, event))
+    except Exception as err:
+        logger.error("Watch failed: {0}: {1}".format(kind, err))
+    finally:
+        q.put_nowait(kubejobs.STOP_EVENT)
+    return None
+
+
+async def parse_queue(q, store, task, q_exc, pending_timeout = 60):
+    """
+    Parse job, pod and event changes until the group completes or fails.
+
+    The watches resume on their own, so one only ends (STOP_EVENT) on an
+    error: the group can no longer be tracked, and the run fails with
+    "Event Stream Ended" as with the threaded engine (see
+    kubejobs.parse_queue).
+
+    There is no deadline scheduler: the pending timeout is checked on the
+    pod's Warning events (see kubejobs.is_failed), and there are no image
+    pull or run timeouts.
+
+    Args:
+        q (asyncio.Queue): Queue of (kind, event), or STOP_EVENT.
+        store (GroupStore): Store of the group's jobs and pods.
+        task (str): Job task (e.g. runxhpl), used to filter events.
+        q_exc (Queue): Queue to pass exceptions to the caller.
+        pending_timeout (int): Seconds a pod may be Pending, None for no
+            limit.
+
+    Returns:
+        None
+    """
+    name_prefix = "{0}-".format(task)
+    while True:
+        item = await q.get()
+        if item is kubejobs.STOP_EVENT:
+            try:
+                raise RuntimeError("Event Stream Ended")
+            except RuntimeError:
+                q_exc.put(sys.exc_info())
+            break
+        (kind, event) = item
+        ev_type = None
+        obj = event["object"]
+        if kind == "event":
+            name = obj.involved_object.name or ""
+            if event["type"] == "DELETED" or not name.startswith(name_prefix):
+                continue
+            kubejobs.log_event(obj)
+            ev_type = obj.type
+            kind = obj.involved_object.kind.lower()
+        else:
+            store.apply(event["type"], obj)
+            name = obj.metadata.name
+        (job, pod) = store.get_objs(kind, name)
+        if job is None or pod is None:
+            continue
+        if (
+            store.is_completed()
+            or kubejobs.is_failed(ev_type, job, pod, q_exc, pending_timeout)
+        ):
+            break
+    return None
+
+
+async def save_pod_log(
+    api_client, pod_name, logdir, compress = False, tail_lines = 100,
+    tail_bytes = 65536, chunk_size = 65536
+):
+    """
+    Stream the log of a Kubernetes Pod to a file.
+
+    This is the coroutine version of podlogs.save_pod_log. The file is
+    opened, written and closed in a worker thread (gzip compression
+    included), so the event loop only waits on the network.
+
+    Args:
+        api_client (ApiClient): Shared Kubernetes API client.
+        pod_name (str): Name of the pod.
+        logdir (str): Directory of pod logs.
+        compress (bool): Whether to gzip compress the log.
+        tail_lines (int): Maximum number of lines returned.
+        tail_bytes (int): Maximum number of bytes returned.
+        chunk_size (int): Bytes read from the stream at a time.
+
+    Returns:
+        tuple(
+            filename (str): Filename of the pod log.
+            tail (str): Tail of the pod log.
+        )
+    """
+    core = client.CoreV1Api(api_client)
+    filename = podlogs.get_log_filename(logdir, pod_name, compress)
+    tail = podlogs.LogTail(tail_lines, tail_bytes)
+    resp = await core.read_namespaced_pod_log(
+        pod_name, "default", _preload_content = False
+    )
+    try:
+        f = await asyncio.to_thread(podlogs.open_log, filename, "wb", compress)
+        try:
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                await asyncio.to_thread(f.write, chunk)
+                tail.feed(chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+    finally:
+        resp.release()
+    return (filename, tail.get())
+
+
+async def clean_up(
+    api_client, workers, store, log_opts, log_pod = None, task = None,
+    log_id = None, propagation_policy = "Foreground"
+):
+    """
+    Clean up Kubernetes jobs on worker nodes.
+
+    Logs of failed pods are streamed concurrently to files and their
+    results passed to log_pod. The other jobs of the group are deleted with
+    one collection delete (see kubejobs.get_group_selector).
+
+    Args:
+        api_client (ApiClient): Shared Kubernetes API client.
+        workers (dict): Spawned V1Job, keyed by node name.
+        store (GroupStore): Store of the group's jobs and pods.
+        log_opts (dict): Parameters of save_pod_log (e.g. logdir).
+        log_pod (function): Callable taking (pod_name, result).
+        task (str): Job task of the group, its jobs are not deleted if None.
+        log_id (str): log_id (unique ID) of run.
+        propagation_policy (str): Propagation policy of the jobs' delete.
+
+    Returns:
+        None
+    """
+    failed = []
+    failed_jobs = []
+    for node, job in workers.items():
+        (j, p) = store.get_objs("job", job.metadata.name)
+        j = j or job
+        if p is None:
+            continue
+        if j.status and (j.status.failed or p.status.phase == "Failed"):
+            failed.append(p.metadata.name)
+            failed_jobs.append(j.metadata.name)
+
+    results = await asyncio.gather(*[
+        save_pod_log(api_client, pod_name, **log_opts)
+        for pod_name in failed
+    ], return_exceptions = True)
+    for pod_name, result in zip(failed, results):
+        if log_pod:
+            log_pod(pod_name, result)
+    if task and len(failed_jobs) < len(workers):
+        label_selector = kubejobs.get_group_selector(task, log_id, exclude = failed_jobs)
+        try:
+            await delete_jobs(api_client, label_selector, propagation_policy)
+        except ApiException as err:
+            logger.error("Failed to delete jobs: {0}: {1}".format(label_selector, err.reason))
+    return None
+
+
+async def run(
+    kubeconfig, tmpl, task, nodes, log_id, image,
+    max_in_flight = 16, pool_maxsize = 100, log_opts = None, log_pod = None,
+    pull_policy = None, propagation_policy = "Foreground", pending_timeout = 60
+):
+    """
+    Run a task group on nodes with the asyncio engine.
+
+    Args:
+        kubeconfig (str): Filename of kubeconfig.
+        tmpl (str): Filename of YAML template.
+        task (str): Job task to run (e.g. runxhpl).
+        nodes (list): Names of worker nodes.
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker nodes.
+        max_in_flight (int): Maximum number of concurrent spawns.
+        pool_maxsize (int): Maximum connections in the shared pool.
+        log_opts (dict): Parameters of save_pod_log (e.g. logdir).
+        log_pod (function): Callable taking (pod_name, result) for failed
+            pods, see save_pod_log.
+        pull_policy (str): imagePullPolicy of all containers, None to keep
+            the template's.
+        propagation_policy (str): Propagation policy of the jobs' delete.
+        pending_timeout (int): Seconds a pod may be Pending, None for no
+            limit (see parse_queue).
+
+    Returns:
+        q_exc (Queue): Queue of exceptions (sys.exc_info) from the run.
+    """
+    q_exc = queue.Queue()
+    if log_opts is None:
+        log_opts = {"logdir": os.path.join("/tmp/logs", log_id, "pods")}
+    configuration = client.Configuration()
+    await config.load_kube_config(
+        config_file = kubeconfig,
+        client_configuration = configuration,
+    )
+    configuration.connection_pool_maxsize = pool_maxsize
+    async with client.ApiClient(configuration) as api_client:
+        batch = client.BatchV1Api(api_client)
+        core = client.CoreV1Api(api_client)
+        store = GroupStore(expected = len(nodes))
+        q = asyncio.Queue()
+        label_selector = "task={0},log-id={1}".format(task, log_id)
+
+        # List then watch jobs, pods and events
+        tasks = []
+        for kind, list_fn, kw_params in (
+            ("job", batch.list_namespaced_job, {"label_selector": label_selector}),
+            ("pod", core.list_namespaced_pod, {"label_selector": label_selector}),
+            ("event", core.list_namespaced_event, {"field_selector": "involvedObject.kind=Job"}),
+            ("event", core.list_namespaced_event, {"field_selector": "involvedObject.kind=Pod"}),
+        ):
+            if kind == "event":
+                # Only logged, not listed (see kubejobs.get_stream)
+                known = None
+                resource_version = await get_resource_version(list_fn, **kw_params)
+            else:
+                known = {}
+                (resource_version, events) = await relist(list_fn, known, **kw_params)
+                for event in events:
+                    store.apply(event["type"], event["object"])
+            tasks.append(asyncio.create_task(
+                watch_objs(q, list_fn, known, resource_version, kind, **kw_params)
+            ))
+
+        logger.info("Creating workers")
+        time_start = time.monotonic()
+        (workers, errors, latencies) = await spawn_workers(
+            api_client, tmpl, task, nodes, log_id, image, max_in_flight,
+            pull_policy = pull_policy,
+        )
+        logger.info("Spawned {0}/{1} workers in {2:.2f}s".format(
+            len(workers), len(nodes), time.monotonic() - time_start
+        ))
+        logger.info("Spawn latency: {0}".format(
+            kubejobs.get_latency_summary(latencies)
+        ))
+        try:
+            if errors:
+                try:
+                    raise RuntimeError("Spawn Failed", sorted(errors))
+                except RuntimeError:
+                    q_exc.put(sys.exc_info())
+            else:
+                await parse_queue(q, store, task, q_exc, pending_timeout)
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+            logger.info("Cleaning up")
+            await clean_up(
+                api_client, workers, store, log_opts, log_pod,
+                task = task,
+                log_id = log_id,
+                propagation_policy = propagation_policy,
+            )
+    return q_exc
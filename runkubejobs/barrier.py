@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+This module implements a synchronized start barrier across the pods of a
+run.
+
+With the barrier enabled (see kubejobs.get_barrier_dict), every pod starts
+with an init container that blocks until the pod is annotated with a
+release time. The controller waits, on the informer cache, until every pod
+of the group is waiting at the barrier, then annotates all of them with the
+same release time a few seconds in the future. Each barrier then exits at
+that time, so the containers start together regardless of when each pod was
+scheduled or when its annotation reached the node.
+
+"""
+
+import concurrent.futures
+import logging
+import math
+import time
+
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+
+def is_at_barrier(pod):
+    """
+    Check if a pod is waiting at the start barrier.
+
+    Args:
+        pod (V1Pod): Query pod.
+
+    Returns:
+        at_barrier (bool): Whether the barrier init container is running.
+    """
+    statuses = (pod.status.init_container_statuses or []) if pod.status else []
+    for cs in statuses:
+        if cs.name == kubejobs.BARRIER_CONTAINER:
+            return bool(cs.state and cs.state.running)
+    return False
+
+
+def wait(cache, expected, timeout = 600):
+    """
+    Wait until every pod of the group is waiting at the start barrier.
+
+    Args:
+        cache (JobCache): Informer cache of the group.
+        expected (int): Number of pods expected in the group.
+        timeout (float): Maximum seconds to wait.
+
+    Returns:
+        pods (list): Pods of the group, all at the barrier.
+
+    Raises:
+        RuntimeError: Pod failed before the barrier was released.
+        RuntimeError: Pods not at the barrier within timeout.
+    """
+    def _get_failed(pods):
+        return sorted(
+            pod.metadata.name for pod in pods
+            if pod.status and pod.status.phase == "Failed"
+        )
+
+    def _get_pending():
+        pods = cache.pods.list()
+        if _get_failed(pods):
+            return []
+        pending = sorted(
+            pod.metadata.name for pod in pods if not is_at_barrier(pod)
+        )
+        if len(pods) < expected:
+            pending.append("{0} pods not created".format(expected - len(pods)))
+        return pending
+
+    pending = cache.wait_until(_get_pending, timeout)
+    if pending:
+        raise RuntimeError("Barrier Timeout", pending)
+    pods = cache.pods.list()
+    failed = _get_failed(pods)
+    if failed:
+        raise RuntimeError("Barrier Pod Failed", failed)
+    return pods
+
+
+def wait_for_start(cache, timeout = 60):
+    """
+    Wait until every pod of the group has passed the barrier.
+
+    Args:
+        cache (JobCache): Informer cache of the group.
+        timeout (float): Maximum seconds to wait.
+
+    Returns:
+        pending (list): Names of the pods still at the barrier.
+    """
+    def _get_pending():
+        return sorted(
+            pod.metadata.name for pod in cache.pods.list()
+            if not pod.status
+            or pod.status.phase not in ("Running", "Succeeded", "Failed")
+        )
+
+    return cache.wait_until(_get_pending, timeout)
+
+
+def release(pods, lead = 5, max_in_flight = 16):
+    """
+    Release the start barrier of pods at a common time.
+
+    Args:
+        pods (list): Pods waiting at the barrier.
+        lead (float): Seconds from now to the release time. Must cover the
+            time to annotate every pod and for the kubelets to see it.
+        max_in_flight (int): Maximum number of concurrent pod patches.
+
+    Returns:
+        release_at (int): Release time, seconds since the epoch.
+
+    Raises:
+        ApiException: An error occured annotating a pod.
+    """
+    release_at = int(math.ceil(time.time() + lead))
+    body = {
+        "metadata": {
+            "annotations": {kubejobs.BARRIER_ANNOTATION: str(release_at)},
+        },
+    }
+    core = kubejobs.get_core_api()
+
+    def _patch(pod):
+        core.patch_namespaced_pod(
+            pod.metadata.name,
+            pod.metadata.namespace or "default",
+            body,
+            _request_timeout = kubejobs.get_request_timeout(),
+        )
+        return None
+
+    time_start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers = max(1, min(max_in_flight, len(pods))),
+        thread_name_prefix = "thread.barrier",
+    ) as executor:
+        for future in [executor.submit(_patch, pod) for pod in pods]:
+            future.result()
+    time_patch = time.monotonic() - time_start
+    if time_patch > lead:
+        logger.warning("Barrier release took {0:.2f}s, over lead of {1}s".format(
+            time_patch, lead
+        ))
+    return release_at
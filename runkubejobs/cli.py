@@ -5,24 +5,28 @@ This module implements the command-line interface for package.
 """
 
 import argparse
-import atexit
-import logging
-import os
-import pkg_resources
-import queue
 import sys
-import threading
-import traceback
 from argparse import ArgumentError
 
-import kubernetes.config as config
-import kubernetes.client as client
-import kubernetes.watch as watch
+# Only the parser's imports are loaded up front, so --help and --version
+# stay fast: the run (runner, with the Kubernetes client and engcommon) and
+# the daemon client are imported once needed (see benchmarks.bench_startup).
 
-from engcommon import clihelper
-from engcommon import ini
-from engcommon.constants import _const as CONSTANTS
-from runkubejobs import kubejobs
+# Tasks with a packaged template (kube-job-tmpl-TASK.yaml)
+TASKS = [
+    "runxhpl",
+]
+
+# Exit codes of a run
+EXIT_OK = 0
+EXIT_ERROR = 1  # Setup, spawn or controller error
+EXIT_FAIL_FAST = 3  # A node failed, the remaining jobs were cancelled
+EXIT_NODES_FAILED = 4  # Every node finished, some failed (continue)
+
+CONFIG_TTL = 3600  # Default seconds the INI config is cached (see confcache)
+
+# Options taking a path, resolved by the submitting client (see daemon.submit)
+PATH_OPTIONS = ["--metrics-file", "-p", "--prefix", "--tmpl"]
 
 
 def csv_str(vstr, sep = ","):
@@ -51,6 +55,107 @@ def csv_str(vstr, sep = ","):
     return values
 
 
+def quantity(vstr):
+    """
+    Parse Kubernetes quantity string (e.g. "16Gi") for "min-memory" option.
+
+    Args:
+        vstr (str): Value string from CLI.
+
+    Returns:
+        value (int): Quantity value.
+
+    Raises:
+        ArgumentTypeError: Invalid quantity.
+    """
+    import kubernetes.utils as kubeutils
+
+    try:
+        value = int(kubeutils.parse_quantity(vstr))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid quantity: {0}".format(vstr))
+    return value
+
+
+def group_spec(vstr):
+    """
+    Parse task group string "TASK[@NAMESPACE][=IMAGE]" for "group" option.
+
+    Args:
+        vstr (str): Value string from CLI.
+
+    Returns:
+        group (dict): task, namespace (None for --namespace) and image
+            (None for the task's default).
+
+    Raises:
+        ArgumentTypeError: Invalid task group.
+    """
+    (spec, _, image) = vstr.partition("=")
+    (task, _, namespace) = spec.partition("@")
+    if task not in TASKS:
+        raise argparse.ArgumentTypeError(
+            "Invalid task: {0}, choose from {1}".format(task, ", ".join(TASKS))
+        )
+    return {"task": task, "namespace": namespace or None, "image": image or None}
+
+
+def task_timeout(vstr):
+    """
+    Parse task timeout string "TASK[@NAMESPACE]:KIND=SECONDS" for
+    "task-timeout" option.
+
+    Args:
+        vstr (str): Value string from CLI (e.g. "runxhpl@perf:run=3600").
+
+    Returns:
+        timeout (dict): task, namespace (None for the task's groups in all
+            namespaces), kind (pending, pull or run) and seconds (0 for no
+            limit).
+
+    Raises:
+        ArgumentTypeError: Invalid task timeout.
+    """
+    (spec, _, timeout) = vstr.partition(":")
+    (task, _, namespace) = spec.partition("@")
+    (kind, _, seconds) = timeout.partition("=")
+    if task not in TASKS:
+        raise argparse.ArgumentTypeError(
+            "Invalid task: {0}, choose from {1}".format(task, ", ".join(TASKS))
+        )
+    if kind not in ("pending", "pull", "run"):
+        raise argparse.ArgumentTypeError(
+            "Invalid timeout: {0}, choose from pending, pull, run".format(kind)
+        )
+    try:
+        seconds = int(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid seconds: {0}".format(seconds))
+    return {
+        "task": task,
+        "namespace": namespace or None,
+        "kind": kind,
+        "seconds": seconds,
+    }
+
+
+class VersionAction(argparse.Action):
+    """Version action, looking the installed version up only when asked."""
+    def __init__(self, option_strings, dest = argparse.SUPPRESS, help = None):
+        super().__init__(
+            option_strings,
+            dest,
+            default = argparse.SUPPRESS,
+            nargs = 0,
+            help = help or "show program's version number and exit",
+        )
+
+    def __call__(self, parser, namespace, values, option_string = None):
+        import importlib.metadata
+
+        parser.exit(message = "{0}\n".format(importlib.metadata.version(parser.prog)))
+
+
 def get_command(args):
     """
     Parse command argument list into dict.
@@ -62,6 +167,65 @@ def get_command(args):
         args (dict): Argument dict.
     """
     parser = argparse.ArgumentParser(description = "Spawn kubernetes job on nodes")
+    parser.add_argument(
+        "--api-pool-size",
+        action = "store",
+        type = int,
+        help = "set kubernetes API connection pool size",
+        default = 32,
+        required = False,
+    )
+    parser.add_argument(
+        "--api-timeout",
+        action = "store",
+        type = int,
+        help = "set kubernetes API request timeout (seconds)",
+        default = 60,
+        required = False,
+    )
+    parser.add_argument(
+        "--barrier",
+        action = "store_true",
+        help = "start all pods together with a barrier (threads engine)",
+        required = False,
+    )
+    parser.add_argument(
+        "--barrier-lead",
+        action = "store",
+        type = float,
+        help = "set seconds from barrier release to start",
+        default = 5,
+        required = False,
+    )
+    parser.add_argument(
+        "--barrier-timeout",
+        action = "store",
+        type = int,
+        help = "set maximum seconds for all pods to reach the barrier",
+        default = 600,
+        required = False,
+    )
+    parser.add_argument(
+        "--config-ttl",
+        action = "store",
+        type = int,
+        help = "set maximum age of the cached INI config and kubeconfig (seconds, 0 to always fetch)",
+        default = CONFIG_TTL,
+        required = False,
+    )
+    parser.add_argument(
+        "--daemon",
+        action = "store_true",
+        help = "serve run submissions on an owner-only Unix socket, keeping clients and caches warm",
+        required = False,
+    )
+    parser.add_argument(
+        "--daemon-socket",
+        action = "store",
+        type = str,
+        help = "set Unix socket of the daemon (default: runkubejobs.sock in $XDG_RUNTIME_DIR, else the cache directory)",
+        required = False,
+    )
     parser.add_argument(
         "-d", "--debug",
         action = "store_true",
@@ -74,6 +238,42 @@ def get_command(args):
         help = "print kubernetes API debug information",
         required = False,
     )
+    parser.add_argument(
+        "--engine",
+        action = "store",
+        help = "set controller engine",
+        choices = [
+            "threads",
+            "async",
+        ],
+        default = "threads",
+        required = False,
+    )
+    parser.add_argument(
+        "--failure-policy",
+        action = "store",
+        help = "cancel remaining jobs on a failure, or let all nodes finish",
+        choices = [
+            "fail-fast",
+            "continue",
+        ],
+        default = "fail-fast",
+        required = False,
+    )
+    parser.add_argument(
+        "--follow-logs",
+        action = "store_true",
+        help = "save logs of running pods live (threads engine)",
+        required = False,
+    )
+    parser.add_argument(
+        "--group",
+        action = "append",
+        type = group_spec,
+        help = "also run task group TASK[@NAMESPACE][=IMAGE] (threads engine, repeatable)",
+        default = [],
+        required = False,
+    )
     parser.add_argument(
         "-i", "--image",
         action = "store",
@@ -81,6 +281,12 @@ def get_command(args):
         help = "set container image for task",
         required = False,
     )
+    parser.add_argument(
+        "--indexed",
+        action = "store_true",
+        help = "spawn one Indexed Job across all nodes (threads engine)",
+        required = False,
+    )
     parser.add_argument(
         "-l", "--logid",
         action = "store",
@@ -88,6 +294,79 @@ def get_command(args):
         help = "set log_id for run",
         required = False,
     )
+    parser.add_argument(
+        "--log-compress",
+        action = "store_true",
+        help = "gzip compress saved pod logs",
+        required = False,
+    )
+    parser.add_argument(
+        "--log-tail-bytes",
+        action = "store",
+        type = int,
+        help = "set maximum bytes of failed pod log printed",
+        default = 65536,
+        required = False,
+    )
+    parser.add_argument(
+        "--log-tail-lines",
+        action = "store",
+        type = int,
+        help = "set maximum lines of failed pod log printed",
+        default = 100,
+        required = False,
+    )
+    parser.add_argument(
+        "--max-follows",
+        action = "store",
+        type = int,
+        help = "set maximum number of live log follows (default: one per pod)",
+        required = False,
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        action = "store",
+        type = int,
+        help = "set maximum number of concurrent job spawns",
+        default = 16,
+        required = False,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        action = "store",
+        type = str,
+        help = "write Prometheus metrics to file (textfile collector)",
+        required = False,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        action = "store",
+        type = int,
+        help = "serve Prometheus metrics on localhost port at /metrics",
+        required = False,
+    )
+    parser.add_argument(
+        "--min-cpu",
+        action = "store",
+        type = float,
+        help = "set minimum allocatable CPU cores of nodes",
+        required = False,
+    )
+    parser.add_argument(
+        "--min-memory",
+        action = "store",
+        type = quantity,
+        help = "set minimum allocatable memory of nodes (e.g. 16Gi)",
+        required = False,
+    )
+    parser.add_argument(
+        "--namespace",
+        action = "store",
+        type = str,
+        help = "set namespace of jobs",
+        default = "default",
+        required = False,
+    )
     parser.add_argument(
         "-n", "--nodes",
         action = "store",
@@ -95,6 +374,20 @@ def get_command(args):
         help = "set nodes for task (comma separated)",
         required = False,
     )
+    parser.add_argument(
+        "--node-selector",
+        action = "store",
+        type = str,
+        help = "set node label selector (e.g. rack=r1)",
+        required = False,
+    )
+    parser.add_argument(
+        "--pending-timeout",
+        action = "store",
+        type = int,
+        help = "set maximum seconds for a pod to start a container, excluding its image pull (0 for no limit)",
+        required = False,
+    )
     parser.add_argument(
         "-p", "--prefix",
         action = "store",
@@ -104,13 +397,64 @@ def get_command(args):
         required = False,
     )
     parser.add_argument(
-        "-t", "--task",
+        "--prepull",
+        action = "store_true",
+        help = "pre-pull image on nodes, then run with IfNotPresent",
+        required = False,
+    )
+    parser.add_argument(
+        "--prepull-timeout",
         action = "store",
-        help = "set task to run",
+        type = int,
+        help = "set maximum seconds for a node's image pre-pull",
+        default = 600,
+        required = False,
+    )
+    parser.add_argument(
+        "--propagation-policy",
+        action = "store",
+        help = "set propagation policy of job deletes",
         choices = [
-            "runxhpl",
+            "Foreground",
+            "Background",
         ],
-        required = True,
+        default = "Foreground",
+        required = False,
+    )
+    parser.add_argument(
+        "--pull-timeout",
+        action = "store",
+        type = int,
+        help = "set maximum seconds for a pod's image pull (threads engine, 0 for no limit)",
+        required = False,
+    )
+    parser.add_argument(
+        "--run-timeout",
+        action = "store",
+        type = int,
+        help = "set maximum seconds for a pod to run (threads engine, 0 for no limit)",
+        required = False,
+    )
+    parser.add_argument(
+        "--submit",
+        action = "store_true",
+        help = "submit run to the daemon, stream its progress and exit with its status",
+        required = False,
+    )
+    parser.add_argument(
+        "-t", "--task",
+        action = "store",
+        help = "set task to run",
+        choices = TASKS,
+        required = False,
+    )
+    parser.add_argument(
+        "--task-timeout",
+        action = "append",
+        type = task_timeout,
+        help = "set pending, pull or run timeout of a task group TASK[@NAMESPACE]:KIND=SECONDS (only pending with the async engine, repeatable)",
+        default = [],
+        required = False,
     )
     parser.add_argument(
         "--tmpl",
@@ -119,153 +463,68 @@ def get_command(args):
         help = "set template file",
         required = False,
     )
+    parser.add_argument(
+        "--wave-gate-timeout",
+        action = "store",
+        type = int,
+        help = "set maximum seconds for a wave's pods to be Running",
+        default = 300,
+        required = False,
+    )
+    parser.add_argument(
+        "--wave-label",
+        action = "store",
+        type = str,
+        help = "roll out in waves grouped by node label (e.g. rack)",
+        required = False,
+    )
+    parser.add_argument(
+        "--wave-percent",
+        action = "store",
+        type = float,
+        help = "roll out in waves of percentage of nodes",
+        required = False,
+    )
+    parser.add_argument(
+        "--wave-size",
+        action = "store",
+        type = int,
+        help = "roll out in waves of number of nodes",
+        required = False,
+    )
     parser.add_argument(
         "-v", "--version",
-        action = "version",
-        version = pkg_resources.get_distribution(parser.prog).version
+        action = VersionAction,
     )
     args = vars(parser.parse_args(args))
+    if args["daemon"] and args["submit"]:
+        parser.error("argument --submit: not allowed with argument --daemon")
+    if not args["daemon"] and args["task"] is None:
+        parser.error("the following arguments are required: -t/--task")
     return args
 
 
-def clean_up(workers, my_cli):
-    """
-    Clean up failed Kubernetes jobs on worker nodes.
-
-    Args:
-        workers (dict): Dict of KubeJob instances, keyed by node name.
-        logger (Logger): Logger default.
-        logger_noformat(Logger): Logger with no timestamp prefixes.
-
-    Returns:
-        None
-    """
-    logger = my_cli.logger
-    logger_noformat = my_cli.logger_noformat
-    # Add handler to write failed pod logs to "console" with "noformat"
-    kh = logging.StreamHandler(logger.handlers[1].stream)  # console
-    kh.setFormatter(logger_noformat.handlers[0].formatter)  # noformat
-    kh.setLevel(logging.DEBUG)
-    logger_noformat.addHandler(kh)
-    logger.info("Cleaning up")
-
-    for node, kjobs in workers.items():
-        j = kjobs.job
-        p = kubejobs.get_pod(j)
-        if j.status:
-            if j.status.failed or p.status.phase == "Failed":
-                logger_noformat.debug("\n{0}".format(
-                    (
-                        " Failed pod log: "
-                        + p.metadata.name
-                        + " "
-                    ).center(80, "*")
-                ))
-                s = kubejobs.get_pod_log(p.metadata.name)
-                logger_noformat.debug(s)
-            else:
-                kubejobs.delete_obj(j)
-    my_cli.print_logdir()
-    return None
-
-
-def run(d):
-    """
-    Run package.
-
-    Args:
-        d (dict): Dict of command-line options.
-
-    Returns:
-        None
-
-    Raises:
-        Exception: An error occured in the child event stream processing thread.
-    """
-    project_name = (os.path.dirname(__file__).split("/")[-1])
-    if d["debug_api"]:
-        d["debug"] = True
-        client.rest.logger.setLevel(logging.DEBUG)
-    elif not d["debug_api"]:
-        client.rest.logger.setLevel(logging.WARNING)
-
-    my_cli = clihelper.CLI(project_name, d)
-    log_id = my_cli.log_id
-    logger = my_cli.logger
-    my_cli.print_versions()
-
-    # Setup Kubernetes config and API
-    my_ini = ini.INIConfig(CONSTANTS().INI_URL)
-    config.load_kube_config(my_ini.kubeconfig)
-    w = watch.Watch()
-    q_watch = queue.Queue()  # Queue for event stream
-    q_exc = queue.Queue()  # Queue for thread exceptions
-
-    # Setup stream and child thread(s) of Kubernetes events
-    task = d["task"]
-    requested_nodes = d["nodes"]
-    image = d["image"]
-    tmpl = d["tmpl"]
-    if not tmpl:
-        tmpl = pkg_resources.resource_stream(
-            __name__,
-            "kube-job-tmpl-{0}.yaml".format(task)
-        ).name
-
-    try:
-        nodes = kubejobs.get_task_nodes(requested_nodes)
-    except RuntimeError as err:
-        logger.exception(err)
-        logger.info("Exiting.")
-        sys.exit(1)
-
-    logger.info("Creating Watch() thread")
-    stream = kubejobs.get_stream(w)
-    t_watch = kubejobs.get_thread(q_watch, stream)
-    t_watch.start()
-
-    # Start main thread
-    m = threading.Thread(
-        target = kubejobs.parse_queue,
-        args = (q_watch, q_exc,),
-        name = "thread.main",
-        daemon = True,
-    )
-    m.start()
-
-    logger.info("Creating workers")
-    workers = {}
-    for node in nodes:
-        workers[node] = kubejobs.kubeJob(tmpl, task, node, log_id, image)
-
-    # Register cleanup, handle exception queue from child threads
-    atexit.register(clean_up, workers, my_cli)
-    try:
-        m.join()
-    except KeyboardInterrupt:
-        logger.info("CTRL-C receved")
-        sys.exit(1)
-    else:
-        if not q_exc.empty():
-            exc_type, exc_obj, exc_tb = q_exc.get()
-            exc = "".join(traceback.format_exception(exc_type, exc_obj, exc_tb))
-            try:
-                raise exc_type(exc)
-            except exc_type:
-                logger.error(exc)
-                raise
-
-
 def main():
     args = sys.argv[1:]
     d = get_command(args)
-    run(d)
+    if d["submit"]:
+        from runkubejobs import daemon
+
+        sys.exit(daemon.submit(args, d["daemon_socket"], path_options = PATH_OPTIONS))
+    from runkubejobs import runner
+
+    if d["daemon"]:
+        runner.serve(d)
+    else:
+        runner.run(d)
 
 
 if __name__ == "__main__":
     try:
         main()
     except Exception:
+        import logging
+
         logging.exception("Exceptions Found")
         logging.critical("Exiting.")
-        sys.exit(1)
+        sys.exit(EXIT_ERROR)
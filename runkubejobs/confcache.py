@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+"""
+This module implements an on-disk cache of the remote INI config.
+
+Each run would otherwise fetch the INI config (see engcommon.ini) over the
+network to find its kubeconfig. The kubeconfig is copied to a cache
+directory, keyed by INI URL, with the time it was fetched, and reused by
+later processes until it is older than the TTL. Files are replaced
+atomically and readable by the owner only, as the kubeconfig holds
+credentials. Relative certificate, key and token file paths are made
+absolute, as they resolve against the kubeconfig's own directory.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "runkubejobs",
+)
+
+# File path fields of kubeconfig clusters and users
+PATH_FIELDS = {
+    "clusters": ("cluster", ("certificate-authority",)),
+    "users": ("user", ("client-certificate", "client-key", "tokenFile")),
+}
+
+
+def get_cache_path(url, cache_dir = None):
+    """
+    Get the cache directory of an INI config.
+
+    Args:
+        url (str): URL of the INI config.
+        cache_dir (str): Cache directory, CACHE_DIR if None.
+
+    Returns:
+        path (str): Directory of the INI config's cached files.
+    """
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir or CACHE_DIR, key)
+
+
+def get_abs_kubeconfig(filename):
+    """
+    Get a kubeconfig with its relative file paths made absolute.
+
+    Args:
+        filename (str): Filename of kubeconfig.
+
+    Returns:
+        tree (dict): Kubeconfig, with the relative file paths of its
+            clusters and users joined to its directory.
+
+    Raises:
+        YAMLError: The kubeconfig is not valid YAML.
+    """
+    base = os.path.dirname(os.path.abspath(filename))
+    with open(filename) as f:
+        tree = yaml.safe_load(f) or {}
+    for (section, (key, fields)) in PATH_FIELDS.items():
+        for item in tree.get(section) or []:
+            value = (item or {}).get(key) or {}
+            for field in fields:
+                path = value.get(field)
+                if path and not os.path.isabs(path):
+                    value[field] = os.path.join(base, path)
+    return tree
+
+
+def replace_file(filename, write):
+    """
+    Replace a file atomically, with owner-only permissions.
+
+    Args:
+        filename (str): Filename to replace.
+        write (function): Callable taking the open temporary file.
+
+    Returns:
+        None
+    """
+    (fd, tmp) = tempfile.mkstemp(dir = os.path.dirname(filename), prefix = ".tmp.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            write(f)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return None
+
+
+def get_kubeconfig(url, fetch, ttl, cache_dir = None):
+    """
+    Get the kubeconfig of an INI config, from the cache while fresh.
+
+    Args:
+        url (str): URL of the INI config.
+        fetch (function): Callable fetching the INI config, returning the
+            filename of its kubeconfig.
+        ttl (int): Maximum age of the cached kubeconfig in seconds, 0 to
+            always fetch (and not cache).
+        cache_dir (str): Cache directory, CACHE_DIR if None.
+
+    Returns:
+        kubeconfig (str): Filename of kubeconfig.
+    """
+    path = get_cache_path(url, cache_dir)
+    kubeconfig = os.path.join(path, "kubeconfig")
+    meta_file = os.path.join(path, "meta.json")
+    if ttl:
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+            age = time.time() - meta["fetched"]
+            if meta["url"] == url and 0 <= age < ttl and os.path.isfile(kubeconfig):
+                logger.debug("Using cached kubeconfig: {0} ({1:.0f}s old)".format(
+                    kubeconfig, age
+                ))
+                return kubeconfig
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # Missing or unreadable, fetch again
+
+    source = fetch()
+    if not ttl:
+        return source
+    try:
+        tree = get_abs_kubeconfig(source)
+        os.makedirs(path, mode = 0o700, exist_ok = True)
+        replace_file(kubeconfig, lambda f: yaml.safe_dump(tree, f, default_flow_style = False))
+        # Written last, so a fresh meta.json always has its kubeconfig
+        replace_file(meta_file, lambda f: json.dump({"url": url, "fetched": time.time()}, f))
+    except (OSError, yaml.YAMLError) as err:
+        logger.warning("Failed to cache kubeconfig: {0}".format(err))
+        return source
+    return kubeconfig
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+"""
+This module implements a daemon mode and its thin client.
+
+The daemon is a long-running controller process that keeps warm what each
+run would otherwise set up again (see runner.Session): the INI config, the
+kubeconfig and API connection pool, and node inventories, listed once and
+then watched. Only these are kept: the job and pod informers and the event
+streams are selected by a run's log-id, so each run still starts its own
+and stops them once done (see runner.clean_up_groups). Runs are submitted
+as the command-line arguments of a run, over HTTP on a Unix socket:
+
+    POST /runs  {"args": ["-t", "runxhpl", "-n", "all", ...]}
+
+The response streams the run's log records as JSON lines ({"log": ...}),
+then its exit code ({"exit": N}). Runs are executed one at a time, as a
+run's log records are streamed from the package loggers, which are shared
+by the whole process (see runner.run_session); later submissions wait for
+the run in progress.
+
+    GET /health  {"status": "ok", "running": true}
+
+The socket is readable and writable by its owner only (0600), as runs
+use the daemon's kubeconfig credentials and read templates with its
+permissions: other local users cannot submit them.
+
+"""
+
+import http.client
+import http.server
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import urllib.parse
+
+from runkubejobs import confcache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or confcache.CACHE_DIR,
+    "runkubejobs.sock",
+)
+
+
+class _StreamHandler(logging.Handler):
+    """Log handler writing records as JSON lines to a response stream."""
+    def __init__(self, wfile):
+        logging.Handler.__init__(self, level = logging.INFO)
+        self.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        self._wfile = wfile
+        self._closed = False
+
+    def write(self, msg):
+        """Write a message, once the client is gone drop it."""
+        self.acquire()
+        try:
+            if self._closed:
+                return None
+            try:
+                self._wfile.write((json.dumps(msg) + "\n").encode())
+                self._wfile.flush()
+            except OSError:
+                self._closed = True  # The run carries on without its client
+        finally:
+            self.release()
+        return None
+
+    def emit(self, record):
+        try:
+            self.write({"log": self.format(record)})
+        except Exception:
+            self.handleError(record)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server on a Unix socket."""
+    daemon_threads = True
+
+
+class _Connection(http.client.HTTPConnection):
+    """HTTP connection to a Unix socket."""
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, "localhost")
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Handler of run submissions."""
+    def _send_json(self, code, msg):
+        body = (json.dumps(msg) + "\n").encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != "/health":
+            self.send_error(404)
+            return None
+        running = self.server.run_lock.locked()
+        self._send_json(200, {"status": "ok", "running": running})
+        return None
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path != "/runs":
+            self.send_error(404)
+            return None
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            args = json.loads(self.rfile.read(length))["args"]
+            if not all(isinstance(arg, str) for arg in args):
+                raise ValueError("args must be strings")
+        except (KeyError, TypeError, ValueError) as err:
+            self._send_json(400, {"error": "Invalid run: {0}".format(err)})
+            return None
+
+        # No Content-Length: the run's records stream until it exits
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        handler = _StreamHandler(self.wfile)
+        if self.server.run_lock.locked():
+            handler.write({"log": "Waiting for the run in progress"})
+        with self.server.run_lock:
+            logger.info("Run submitted: {0}".format(" ".join(args)))
+            exit_code = self.server.run_fn(args, handler)
+            logger.info("Run exited: {0}".format(exit_code))
+        handler.write({"exit": exit_code})
+        return None
+
+    def log_message(self, format_, *args):
+        logger.debug(format_ % args)
+
+
+def remove_stale_socket(path):
+    """
+    Remove the socket of a daemon that is no longer running.
+
+    Args:
+        path (str): Path of the socket.
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: Daemon already running on path.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except FileNotFoundError:
+        return None
+    except ConnectionRefusedError:
+        os.unlink(path)  # Left behind by a daemon that exited
+        return None
+    finally:
+        sock.close()
+    raise RuntimeError("Daemon Already Running", path)
+
+
+def serve(run_fn, path = None):
+    """
+    Serve run submissions until interrupted.
+
+    Args:
+        run_fn (function): Callable taking (args, log handler), running a
+            run with its command-line arguments and its log records sent
+            to the handler, and returning its exit code.
+        path (str): Path of the Unix socket, DEFAULT_SOCKET if None.
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: Daemon already running on path.
+    """
+    path = path or DEFAULT_SOCKET
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode = 0o700, exist_ok = True)
+    remove_stale_socket(path)
+    umask = os.umask(0o177)  # Created 0600, never open to others
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(umask)
+    server.run_fn = run_fn
+    server.run_lock = threading.Lock()
+    logger.info("Serving runs on {0}".format(path))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+    return None
+
+
+def resolve_paths(args, options):
+    """
+    Resolve relative path arguments against the current directory.
+
+    Options are matched as spelled in full, "--opt value" or "--opt=value",
+    and short options also as "-ovalue".
+
+    Args:
+        args (list): Command-line arguments.
+        options (list): Options taking a path, e.g. ["-p", "--prefix"].
+
+    Returns:
+        args (list): Command-line arguments with absolute paths.
+    """
+    resolved = []
+    args = iter(args)
+    for arg in args:
+        if arg == "--":
+            resolved.append(arg)
+            resolved.extend(args)
+            break
+        if arg in options:
+            resolved.append(arg)
+            path = next(args, None)
+            if path is not None:
+                resolved.append(os.path.abspath(path) if path else path)
+            continue
+        for opt in options:
+            sep = "=" if opt.startswith("--") else ""
+            if arg.startswith(opt + sep) and len(arg) > len(opt + sep):
+                arg = opt + sep + os.path.abspath(arg[len(opt + sep):])
+                break
+        resolved.append(arg)
+    return resolved
+
+
+def submit(args, path = None, out = None, path_options = ()):
+    """
+    Submit a run to the daemon and stream its progress.
+
+    Relative path arguments are resolved against the client's current
+    directory, as the daemon runs in its own (see resolve_paths).
+
+    Args:
+        args (list): Command-line arguments of the run.
+        path (str): Path of the daemon's Unix socket, DEFAULT_SOCKET if
+            None.
+        out (file): Stream to write the run's log records to, stdout if
+            None.
+        path_options (list): Options taking a path.
+
+    Returns:
+        exit_code (int): Exit code of the run, 1 if the daemon went away
+            before the run exited.
+
+    Raises:
+        RuntimeError: Daemon not running on path.
+        RuntimeError: Run rejected by the daemon.
+    """
+    path = path or DEFAULT_SOCKET
+    out = out or sys.stdout
+    args = resolve_paths(args, path_options)
+    conn = _Connection(path)
+    try:
+        conn.request(
+            "POST",
+            "/runs",
+            body = json.dumps({"args": args}),
+            headers = {"Content-Type": "application/json"},
+        )
+        resp = conn.getresponse()
+    except OSError as err:
+        raise RuntimeError("Daemon Not Running", path, err)
+    if resp.status != 200:
+        raise RuntimeError("Run Rejected", resp.status, resp.read().decode().strip())
+    exit_code = 1
+    try:
+        for line in iter(resp.readline, b""):
+            msg = json.loads(line)
+            if "log" in msg:
+                out.write(msg["log"] + "\n")
+                out.flush()
+            elif "exit" in msg:
+                exit_code = msg["exit"]
+    finally:
+        conn.close()
+    return exit_code
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+"""
+This module implements a deadline scheduler for pod timeouts.
+
+Each pod of a run gets deadlines for its phases:
+
+    * pending: from when the pod is first seen Pending until one of its
+      containers (init or main) is running, not counting the first image
+      pull: it is paused on the pod's first Pulling event and restarted
+      (with the full timeout) on its Pulled event
+    * pull: from the pod's first Pulling event until its Pulled event;
+      later pulls (e.g. of another container's image) count as pending
+    * run: from when the pod is first seen Running until it has finished
+
+So at most one of pending and pull runs for a pod at any time, and a slow
+pull fails with the pull timeout, not the pending one.
+
+Deadlines are kept on a heap and a single thread sleeps until the earliest
+one, so a timeout is reported within moments of its deadline whether or not
+any further events arrive. An expired deadline puts its RuntimeError on the
+exception queue, then DONE_EVENT on the watch queue to stop the
+dispatcher (see kubejobs.parse_queue), or calls an on_expire callback
+instead (e.g. to cancel the pod's job and carry on).
+
+Deadlines are armed and cancelled from the informer cache (on_pod) and the
+event stream (on_event). Cancelled deadlines stay on the heap and are
+skipped when they come up, so both are O(log n).
+
+"""
+
+import heapq
+import logging
+import sys
+import threading
+import time
+
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+# Timeouts in seconds, None for no limit
+DEFAULT_TIMEOUTS = {
+    "pending": 60,
+    "pull": 600,
+    "run": None,
+}
+
+# Overrides of DEFAULT_TIMEOUTS per task, themselves overridden on the
+# command line (--pending-timeout, etc. for all groups, then --task-timeout)
+TASK_TIMEOUTS = {
+    "runxhpl": {},
+}
+
+# Messages of the RuntimeError of an expired deadline
+TIMEOUT_MESSAGES = {
+    "pending": "Pending Timeout Exceeded",
+    "pull": "Image Pull Timeout Exceeded",
+    "run": "Run Timeout Exceeded",
+}
+
+
+def get_timeouts(task, task_overrides = None, **overrides):
+    """
+    Get the timeouts of a task.
+
+    Args:
+        task (str): Job task (e.g. runxhpl).
+        task_overrides (dict): Timeouts of the task's group overriding all
+            others, keyed by pending, pull or run.
+        overrides (dict): Timeouts overriding the task's, keyed by pending,
+            pull or run. None values are ignored.
+
+    Returns:
+        timeouts (dict): Seconds (or None for no limit), keyed by pending,
+            pull and run.
+    """
+    timeouts = dict(DEFAULT_TIMEOUTS)
+    timeouts.update(TASK_TIMEOUTS.get(task, {}))
+    timeouts.update({k: v for k, v in overrides.items() if v is not None})
+    timeouts.update(task_overrides or {})
+    return {k: (v if v and v > 0 else None) for k, v in timeouts.items()}
+
+
+class DeadlineScheduler:
+    """
+    A class for scheduling per-pod phase deadlines on a heap.
+
+    Attributes:
+        timeouts (dict): Seconds (or None for no limit), keyed by pending,
+            pull and run.
+        expired (list): (pod name, deadline kind) of expired deadlines.
+    """
+    def __init__(self, q_watch, q_exc, timeouts = None, on_expire = None):
+        """
+        Init with the dispatcher's queues.
+
+        Args:
+            q_watch (Queue): Watch queue of the dispatcher, to stop it.
+            q_exc (Queue): Queue to pass timeout exceptions to main thread.
+            timeouts (dict): Seconds (or None for no limit), keyed by
+                pending, pull and run. DEFAULT_TIMEOUTS if None.
+            on_expire (function): Callable taking (pod name, kind), called
+                on an expired deadline instead of stopping the dispatcher.
+        """
+        self.timeouts = dict(DEFAULT_TIMEOUTS if timeouts is None else timeouts)
+        self.expired = []
+        self._q_watch = q_watch
+        self._q_exc = q_exc
+        self._on_expire = on_expire
+        self._heap = []  # (deadline, seq, key)
+        self._active = {}  # key: seq of the live heap entry
+        self._seen = set()  # keys already armed once
+        self._paused = set()  # pods with pending paused by their first pull
+        self._pulled = set()  # pods whose first pull has ended
+        self._started = set()  # pods with a container running (or done)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def arm(self, pod_name, kind, again = False):
+        """
+        Arm a deadline of a pod, once per pod and kind.
+
+        Args:
+            pod_name (str): Name of the pod.
+            kind (str): pending, pull or run.
+            again (bool): Arm it again (with the full timeout) even if it
+                was armed before.
+
+        Returns:
+            armed (bool): Whether the deadline was armed.
+        """
+        timeout = self.timeouts.get(kind)
+        key = (pod_name, kind)
+        with self._cond:
+            if not timeout or (key in self._seen and not again):
+                return False
+            self._seen.add(key)
+            self._seq += 1
+            self._active[key] = self._seq
+            heapq.heappush(self._heap, (time.monotonic() + timeout, self._seq, key))
+            self._cond.notify()
+        return True
+
+    def cancel(self, pod_name, kind = None):
+        """
+        Cancel deadlines of a pod.
+
+        Args:
+            pod_name (str): Name of the pod.
+            kind (str): pending, pull or run. All kinds if None.
+
+        Returns:
+            None
+        """
+        with self._cond:
+            for kind_ in ([kind] if kind else list(self.timeouts)):
+                self._active.pop((pod_name, kind_), None)
+        return None
+
+    def on_pod(self, event_type, pod):
+        """
+        Informer handler: arm or cancel deadlines from a pod's phase.
+
+        Args:
+            event_type (str): ADDED, MODIFIED or DELETED.
+            pod (V1Pod): Changed pod.
+
+        Returns:
+            None
+        """
+        name = pod.metadata.name
+        phase = pod.status.phase if pod.status else None
+        if event_type == "DELETED" or phase in ("Succeeded", "Failed"):
+            with self._cond:
+                self._started.add(name)
+                self._paused.discard(name)
+            self.cancel(name)
+            return None
+        if phase == "Pending" or phase is None:
+            statuses = []
+            if pod.status:
+                statuses = list(pod.status.init_container_statuses or [])
+                statuses += list(pod.status.container_statuses or [])
+            if any(cs.state and cs.state.running for cs in statuses):
+                with self._cond:
+                    self._started.add(name)
+                self.cancel(name, "pending")
+            else:
+                with self._cond:
+                    paused = name in self._paused
+                if not paused:
+                    self.arm(name, "pending")
+        elif phase == "Running":
+            with self._cond:
+                self._started.add(name)
+            self.cancel(name, "pending")
+            self.cancel(name, "pull")
+            self.arm(name, "run")
+        return None
+
+    def on_event(self, ev):
+        """
+        Switch a pod between its pending and image pull deadlines from a
+        Kubernetes event.
+
+        The first Pulling event pauses pending and arms pull; its Pulled
+        event cancels pull and restarts pending, unless a container is
+        already running.
+
+        Args:
+            ev (V1Event): Kubernetes event.
+
+        Returns:
+            None
+        """
+        obj = ev.involved_object
+        if obj.kind != "Pod":
+            return None
+        name = obj.name
+        if ev.reason == "Pulling":
+            with self._cond:
+                if name in self._pulled or name in self._started or name in self._paused:
+                    return None
+                self._paused.add(name)
+            self.cancel(name, "pending")
+            self.arm(name, "pull")
+        elif ev.reason == "Pulled":
+            self.cancel(name, "pull")
+            with self._cond:
+                resume = name in self._paused and name not in self._started
+                self._paused.discard(name)
+                self._pulled.add(name)
+            if resume:
+                self.arm(name, "pending", again = True)
+        return None
+
+    def _expire(self, key):
+        """Report an expired deadline through the exception queue."""
+        (pod_name, kind) = key
+        self.expired.append(key)
+        logger.error("{0}: {1}".format(TIMEOUT_MESSAGES[kind], pod_name))
+        try:
+            raise RuntimeError(TIMEOUT_MESSAGES[kind], pod_name)
+        except RuntimeError:
+            self._q_exc.put(sys.exc_info())
+        if self._on_expire is None:
+            self._q_watch.put(kubejobs.DONE_EVENT)
+        else:
+            try:
+                self._on_expire(pod_name, kind)
+            except Exception as err:
+                logger.error("Failed to handle expired deadline: {0}: {1}".format(
+                    pod_name, err
+                ))
+        return None
+
+    def run(self):
+        """
+        Sleep until the earliest deadline, then report it if still armed.
+
+        Returns:
+            None
+        """
+        while True:
+            with self._cond:
+                while not self._stop:
+                    # Drop cancelled deadlines from the top of the heap
+                    while self._heap and self._active.get(self._heap[0][2]) != self._heap[0][1]:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    time_remaining = self._heap[0][0] - time.monotonic()
+                    if time_remaining <= 0:
+                        break
+                    self._cond.wait(time_remaining)
+                if self._stop:
+                    return None
+                (_, _, key) = heapq.heappop(self._heap)
+                del self._active[key]
+            self._expire(key)
+
+    def start(self, name = "thread.deadlines"):
+        """
+        Start the scheduler in a daemon thread.
+
+        Args:
+            name (str): Name of the thread.
+
+        Returns:
+            thread (Thread): Started thread.
+        """
+        self._thread = threading.Thread(target = self.run, name = name, daemon = True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Stop the scheduler thread."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        return None
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+
+"""
+This module implements an informer-style cache of Kubernetes objects.
+
+An Informer lists the objects selected by label once, then watches from
+the resourceVersion of that list and keeps an in-memory store up to date.
+Lookups are served from the store instead of the API server, so the work
+done per event no longer grows with the number of nodes in the run. The
+watch resumes from the last resourceVersion after drops and re-lists once
+after 410 Gone.
+
+Each change seen by the watch can also be put on the watch queue used by
+parse_queue, which makes the informer one more event source for the
+dispatcher.
+
+Several task groups can share one informer per namespace; each group then
+sees its own objects through an InformerView filtered by its labels.
+
+"""
+
+import collections
+import logging
+import threading
+import time
+
+import kubernetes.watch as watch
+
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+
+class Informer:
+    """
+    A class for caching Kubernetes objects selected by label.
+
+    Attributes:
+        list_fn (function): Kubernetes API list function
+            (e.g. BatchV1Api().list_namespaced_job).
+        namespace (str): Namespace of the objects, None if cluster-scoped.
+        label_selector (str): Label selector of the objects.
+        index_label (str): Label used to index the objects (e.g. job-group).
+        resource_version (str): Last resourceVersion seen.
+        thread (Thread): Thread running the watch.
+    """
+    def __init__(
+        self, list_fn, namespace = "default", label_selector = None,
+        index_label = None, q = None
+    ):
+        """
+        Init with Kubernetes list function and selector.
+
+        Args:
+            list_fn (function): Kubernetes API list function.
+            namespace (str): Namespace of the objects.
+            label_selector (str): Label selector of the objects.
+            index_label (str): Label used to index the objects.
+            q (Queue): Queue to put watch events on for the dispatcher.
+        """
+        self.list_fn = list_fn
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.index_label = index_label
+        self.resource_version = None
+        self.thread = None
+        self._q = q
+        self._store = {}
+        self._index = collections.defaultdict(set)
+        self._handlers = []
+        self._known = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._watch = watch.Watch()
+
+    def add_handler(self, fn):
+        """
+        Add a handler called on every store change.
+
+        Args:
+            fn (function): Callable taking (event_type, obj).
+
+        Returns:
+            None
+        """
+        self._handlers.append(fn)
+        return None
+
+    def get(self, name):
+        """
+        Get an object from the store.
+
+        Args:
+            name (str): Name of the object.
+
+        Returns:
+            obj (V1Job or V1Pod or None): Cached object.
+        """
+        with self._lock:
+            obj = self._store.get(name)
+        return obj
+
+    def get_by_index(self, value):
+        """
+        Get objects from the store by the value of index_label.
+
+        Args:
+            value (str): Value of index_label.
+
+        Returns:
+            objs (list): Cached objects.
+        """
+        with self._lock:
+            objs = [self._store[name] for name in sorted(self._index[value])]
+        return objs
+
+    def list(self):
+        """
+        Get all objects from the store.
+
+        Returns:
+            objs (list): Cached objects.
+        """
+        with self._lock:
+            objs = list(self._store.values())
+        return objs
+
+    def _get_index_value(self, obj):
+        labels = obj.metadata.labels or {}
+        return labels.get(self.index_label)
+
+    def _apply(self, event_type, obj):
+        """Apply a single change to the store and notify handlers."""
+        name = obj.metadata.name
+        with self._lock:
+            old = self._store.pop(name, None)
+            if old is not None and self.index_label:
+                self._index[self._get_index_value(old)].discard(name)
+            if event_type != "DELETED":
+                self._store[name] = obj
+                if self.index_label:
+                    self._index[self._get_index_value(obj)].add(name)
+        for fn in self._handlers:
+            fn(event_type, obj)
+        if self._q is not None:
+            self._q.put({"type": event_type, "object": obj})
+        return None
+
+    def _get_kw_params(self):
+        kw_params = {}
+        if self.label_selector:
+            kw_params["label_selector"] = self.label_selector
+        return kw_params
+
+    def sync(self):
+        """
+        List the objects and apply the differences to the store.
+
+        Objects missing from the list are reported as DELETED, new ones as
+        ADDED and changed ones as MODIFIED. Unchanged objects are not
+        reported again, so handlers always see each transition once.
+
+        Returns:
+            None
+
+        Raises:
+            ApiException: An error occured listing the objects.
+        """
+        (self.resource_version, events) = kubejobs.relist(
+            self.list_fn,
+            self._known,
+            self.namespace,
+            **self._get_kw_params()
+        )
+        for event in events:
+            self._apply(event["type"], event["object"])
+        return None
+
+    def run(self):
+        """
+        Watch the objects from the last resourceVersion, updating the store.
+
+        The watch resumes after drops and re-lists after 410 Gone (see
+        kubejobs.gen_resumable_watch). STOP_EVENT is put on the queue when
+        the watch ends.
+
+        Returns:
+            None
+        """
+        try:
+            for event in kubejobs.gen_resumable_watch(
+                self._watch,
+                self.list_fn,
+                self._known,
+                self.resource_version,
+                self.namespace,
+                stop = self._stopped,
+                **self._get_kw_params()
+            ):
+                obj = event["object"]
+                self.resource_version = obj.metadata.resource_version
+                self._apply(event["type"], obj)
+        finally:
+            if self._q is not None:
+                self._q.put(kubejobs.STOP_EVENT)
+        return None
+
+    def start(self, name = "thread.informer"):
+        """
+        List the objects, then start the watch thread.
+
+        Args:
+            name (str): Name of the watch thread.
+
+        Returns:
+            None
+        """
+        self.sync()
+        self.thread = threading.Thread(
+            target = self.run,
+            name = name,
+            daemon = True,
+        )
+        self.thread.start()
+        return None
+
+    def stop(self):
+        """Stop the watch."""
+        self._stopped.set()
+        self._watch.stop()
+        return None
+
+
+class InformerView:
+    """
+    A class for the objects of a shared Informer that have given labels.
+
+    Lookups and handlers see only the matching objects. The view does not
+    own the informer: it is started and stopped by its owner.
+
+    Attributes:
+        informer (Informer): Shared informer.
+        labels (dict): Labels of the objects in the view.
+    """
+    def __init__(self, informer, labels):
+        """
+        Init with shared informer and labels.
+
+        Args:
+            informer (Informer): Shared informer.
+            labels (dict): Labels of the objects in the view.
+        """
+        self.informer = informer
+        self.labels = dict(labels)
+
+    def matches(self, obj):
+        """Check if an object has the labels of the view."""
+        labels = obj.metadata.labels or {}
+        return all(labels.get(k) == v for k, v in self.labels.items())
+
+    def add_handler(self, fn):
+        """
+        Add a handler called on every change of a matching object.
+
+        Args:
+            fn (function): Callable taking (event_type, obj).
+
+        Returns:
+            None
+        """
+        def _handler(event_type, obj):
+            if self.matches(obj):
+                fn(event_type, obj)
+            return None
+
+        self.informer.add_handler(_handler)
+        return None
+
+    def get(self, name):
+        """Get a matching object from the store, see Informer.get."""
+        obj = self.informer.get(name)
+        return obj if obj is not None and self.matches(obj) else None
+
+    def get_by_index(self, value):
+        """Get matching objects by index, see Informer.get_by_index."""
+        return [obj for obj in self.informer.get_by_index(value) if self.matches(obj)]
+
+    def list(self):
+        """Get all matching objects from the store, see Informer.list."""
+        return [obj for obj in self.informer.list() if self.matches(obj)]
+
+
+class JobCache:
+    """
+    A class for caching the Jobs and Pods of a task group.
+
+    The group is selected by task and log-id labels. Job statuses are kept
+    as incremental counters, so checking a group for success/failure does
+    not list every job in the group.
+
+    Attributes:
+        jobs (Informer or InformerView): Informer of the group's jobs.
+        pods (Informer or InformerView): Informer of the group's pods,
+            indexed by job-group.
+        expected (int or None): Number of jobs expected in the group.
+        counts (Counter): Number of jobs per status.
+    """
+    def __init__(
+        self, task, log_id, q = None, expected = None, namespace = "default",
+        informers = None
+    ):
+        """
+        Init with task group labels.
+
+        Args:
+            task (str): Job task to run (e.g. runxhpl).
+            log_id (str): log_id (unique ID) of run.
+            q (Queue): Queue to put watch events on for the dispatcher.
+            expected (int): Number of jobs expected in the group.
+            namespace (str): Namespace of the group.
+            informers (tuple): Shared (job, pod) Informers of the namespace,
+                selecting at least the group's objects. If set, the cache
+                uses filtered views of them and does not start or stop them.
+        """
+        self._owned = informers is None
+        if informers is not None:
+            labels = {"task": task, "log-id": log_id}
+            self.jobs = InformerView(informers[0], labels)
+            self.pods = InformerView(informers[1], labels)
+        else:
+            label_selector = "task={0},log-id={1}".format(task, log_id)
+            self.jobs = Informer(
+                kubejobs.get_batch_api().list_namespaced_job,
+                namespace = namespace,
+                label_selector = label_selector,
+                q = q,
+            )
+            self.pods = Informer(
+                kubejobs.get_core_api().list_namespaced_pod,
+                namespace = namespace,
+                label_selector = label_selector,
+                index_label = "job-group",
+                q = q,
+            )
+        self.expected = expected
+        self.counts = collections.Counter()
+        self._status = {}
+        self._lock = threading.Lock()
+        self._pod_changed = threading.Condition()
+        self.jobs.add_handler(self._update_status)
+        self.pods.add_handler(self._notify_pod)
+
+    def _update_status(self, event_type, job):
+        """Update status counters from a job change."""
+        name = job.metadata.name
+        status = None if event_type == "DELETED" else kubejobs.get_job_status(job)
+        with self._lock:
+            old = self._status.pop(name, None)
+            if old is not None:
+                self.counts[old] -= 1
+            if status is not None:
+                self._status[name] = status
+                self.counts[status] += 1
+        return None
+
+    def _notify_pod(self, event_type, pod):
+        """Wake threads waiting on pod phases."""
+        with self._pod_changed:
+            self._pod_changed.notify_all()
+        return None
+
+    def wait_until(self, get_pending, timeout = None):
+        """
+        Wait until no pods are pending, re-checking on every pod change.
+
+        The wait is woken by pod changes from the informer, not polled.
+
+        Args:
+            get_pending (function): Callable returning the list of what is
+                still pending.
+            timeout (float): Maximum seconds to wait.
+
+        Returns:
+            pending (list): Last result of get_pending, empty if done.
+        """
+        time_deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pod_changed:
+            pending = get_pending()
+            while pending:
+                if time_deadline is None:
+                    self._pod_changed.wait()
+                else:
+                    time_remaining = time_deadline - time.monotonic()
+                    if time_remaining <= 0:
+                        break
+                    self._pod_changed.wait(time_remaining)
+                pending = get_pending()
+        return pending
+
+    def wait_for_pods(
+        self, job_names, phases = ("Running", "Succeeded", "Failed"),
+        timeout = None, check = None
+    ):
+        """
+        Wait until the pods of jobs have reached one of the phases.
+
+        Args:
+            job_names (list): Names of the jobs.
+            phases (tuple): Pod phases that pass.
+            timeout (float): Maximum seconds to wait.
+            check (function): Callable taking a V1Pod, returning whether it
+                passes. Replaces the phase check if set.
+
+        Returns:
+            pending (list): Names of the jobs whose pods have not reached
+                the phases, empty if all have.
+        """
+        def _is_passed(pod):
+            if check is not None:
+                return check(pod)
+            return pod.status is not None and pod.status.phase in phases
+
+        def _get_pending():
+            pending = []
+            for name in job_names:
+                pod = self.get_pod(name)
+                if pod is None or not _is_passed(pod):
+                    pending.append(name)
+            return pending
+
+        return self.wait_until(_get_pending, timeout)
+
+    def start(self):
+        """Start job and pod informers, unless shared."""
+        if self._owned:
+            self.jobs.start(name = "thread.informer.job")
+            self.pods.start(name = "thread.informer.pod")
+        return None
+
+    def stop(self):
+        """Stop job and pod informers, unless shared."""
+        if self._owned:
+            self.jobs.stop()
+            self.pods.stop()
+        return None
+
+    def get_job(self, name):
+        """
+        Get cached job.
+
+        Args:
+            name (str): Name of the job.
+
+        Returns:
+            job (V1Job or None): Cached job.
+        """
+        return self.jobs.get(name)
+
+    def get_pod(self, obj):
+        """
+        Get cached pod.
+
+        Args:
+            obj (str or V1Job): Name of the pod (or of its job), or its V1Job
+                parent.
+
+        Returns:
+            pod (V1Pod or None): Cached pod.
+        """
+        if isinstance(obj, str):
+            pod = self.pods.get(obj)
+            if pod is None:
+                pods = self.pods.get_by_index(obj)
+                pod = pods[0] if pods else None
+        else:
+            pods = self.pods.get_by_index(obj.metadata.name)
+            pod = pods[0] if pods else None
+        return pod
+
+    def is_completed(self):
+        """
+        Check if all jobs in the group have succeeded.
+
+        Returns:
+            completed (bool): Whether the group is completed.
+        """
+        with self._lock:
+            total = self.expected if self.expected else len(self._status)
+            completed = bool(total) and self.counts["Succeeded"] >= total
+        return completed
+
+    def is_failed(self):
+        """
+        Check if any job in the group has failed.
+
+        Returns:
+            failed (bool): Whether the group has a failed job.
+        """
+        with self._lock:
+            failed = self.counts["Failed"] > 0
+        return failed
+
+    def is_finished(self):
+        """
+        Check if all jobs in the group have succeeded or failed.
+
+        Returns:
+            finished (bool): Whether the group is finished.
+        """
+        with self._lock:
+            total = self.expected if self.expected else len(self._status)
+            finished = bool(total) and (
+                self.counts["Succeeded"] + self.counts["Failed"] >= total
+            )
+        return finished
+
+    def get_failed(self):
+        """
+        Get the failed jobs of the group.
+
+        Returns:
+            names (list): Names of the failed jobs.
+        """
+        with self._lock:
+            names = sorted(
+                name for name, status in self._status.items() if status == "Failed"
+            )
+        return names
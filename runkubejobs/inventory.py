@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""
+This module implements a cached inventory of Kubernetes nodes.
+
+The nodes are listed once and then watched (see informer.Informer), so
+readiness and cordon changes are seen without listing the nodes again.
+Readiness can be re-checked cheaply right before each spawn, and nodes can
+be selected by label and allocatable CPU/memory.
+
+"""
+
+import logging
+
+import kubernetes.utils as kubeutils
+
+from runkubejobs import informer
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+
+def get_allocatable(node):
+    """
+    Get the allocatable CPU and memory of a node.
+
+    Args:
+        node (V1Node): Query node.
+
+    Returns:
+        tuple(
+            cpu (float): Allocatable CPU cores.
+            memory (int): Allocatable memory bytes.
+        )
+    """
+    allocatable = (node.status.allocatable or {}) if node.status else {}
+    cpu = float(kubeutils.parse_quantity(allocatable.get("cpu", "0")))
+    memory = int(kubeutils.parse_quantity(allocatable.get("memory", "0")))
+    return (cpu, memory)
+
+
+class NodeInventory:
+    """
+    A class for caching Kubernetes nodes and their readiness.
+
+    Attributes:
+        label_selector (str): Node label selector (e.g. "rack=r1").
+        nodes (Informer): Informer of the selected nodes.
+    """
+    def __init__(self, label_selector = None):
+        """
+        Init with node label selector.
+
+        Args:
+            label_selector (str): Node label selector.
+        """
+        self.label_selector = label_selector
+        self.nodes = informer.Informer(
+            kubejobs.get_core_api().list_node,
+            namespace = None,
+            label_selector = label_selector,
+        )
+        self.nodes.add_handler(self._log_change)
+
+    def _log_change(self, event_type, node):
+        """Log readiness changes of nodes after the initial list."""
+        if self.nodes.thread is not None:
+            logger.debug("Node {0}: {1}, ready: {2}".format(
+                node.metadata.name, event_type, kubejobs.is_node_ready(node)
+            ))
+        return None
+
+    def start(self):
+        """List the nodes, then watch them for changes."""
+        self.nodes.start(name = "thread.informer.node")
+        return None
+
+    def stop(self):
+        """Stop watching the nodes."""
+        self.nodes.stop()
+        return None
+
+    def get(self, name):
+        """
+        Get cached node.
+
+        Args:
+            name (str): Name of the node.
+
+        Returns:
+            node (V1Node or None): Cached node.
+        """
+        return self.nodes.get(name)
+
+    def is_ready(self, name):
+        """
+        Check if a node is ready to schedule jobs, from the cache.
+
+        Args:
+            name (str): Name of the node.
+
+        Returns:
+            ready (bool): Whether the node is ready.
+        """
+        node = self.nodes.get(name)
+        return node is not None and kubejobs.is_node_ready(node)
+
+    def get_ready_nodes(self, min_cpu = None, min_memory = None):
+        """
+        Get a list of nodes ready to schedule jobs, from the cache.
+
+        Args:
+            min_cpu (float): Minimum allocatable CPU cores.
+            min_memory (int): Minimum allocatable memory bytes.
+
+        Returns:
+            ready_nodes (list): Node list.
+        """
+        ready_nodes = []
+        for node in self.nodes.list():
+            if not kubejobs.is_node_ready(node):
+                continue
+            (cpu, memory) = get_allocatable(node)
+            if min_cpu and cpu < min_cpu:
+                continue
+            if min_memory and memory < min_memory:
+                continue
+            ready_nodes.append(node.metadata.name)
+        return sorted(ready_nodes)
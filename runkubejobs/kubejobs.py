@@ -14,20 +14,54 @@ references those members and their methods.
 
 """
 
+import concurrent.futures
+import copy
 import datetime
+import functools
 import logging
+import math
+import re
 import sys
 import threading
 import time
+import urllib3
 import yaml
 
 from dateutil.tz import tzutc
 import kubernetes.client as client
 import kubernetes.utils as kubeutils
+import kubernetes.watch as watch
 from kubernetes.client.rest import ApiException
 
+from runkubejobs import metrics
+
 logger = logging.getLogger(__name__)
 
+# Sentinel put on the watch queue by an event source when it stops
+STOP_EVENT = object()
+
+# Sentinel put on the watch queue to stop the dispatcher out of band (e.g. a
+# deadline expired, see deadlines)
+DONE_EVENT = object()
+
+# Shared Kubernetes API client, see configure_api_client()
+_api_client = None
+_api_client_lock = threading.Lock()
+_request_timeout = (5, 60)  # (connect, read) seconds
+
+# Pod annotation holding the barrier release time (seconds since the epoch)
+BARRIER_ANNOTATION = "runkubejobs/release-at"
+BARRIER_CONTAINER = "barrier"
+
+# Core V1Event model, named CoreV1Event since kubernetes 12
+_V1Event = getattr(client, "CoreV1Event", None) or getattr(client, "V1Event")
+
+# Worker name of the single Job in indexed mode, see get_indexed_dict_from_yaml()
+INDEXED_WORKER = "indexed"
+
+# Maximum number of jobs named in one label selector, see sweep_jobs()
+SWEEP_BATCH_SIZE = 100
+
 
 class kubeJob:
     """
@@ -40,9 +74,14 @@ class kubeJob:
 
     Attributes:
         worker_yaml (dict): Dict of Kubernetes YAML with runtime substitutions.
+        namespace (str): Namespace of the job.
         job (V1Job): Job spawned from worker_yaml.
     """
-    def __init__(self, tmpl, task, node, log_id, image):
+    def __init__(
+        self, tmpl, task, node, log_id, image, nodes = None, replace = True,
+        namespace = "default", pull_policy = None, barrier = False,
+        propagation_policy = "Foreground"
+    ):
         """
         Init with CLI options
 
@@ -52,13 +91,37 @@ class kubeJob:
             node (str): Name of worker node.
             log_id (str): log_id (unique ID) of run.
             image (str): Docker image to run on worker node.
+            nodes (list): Names of worker nodes. If set, spawn one Indexed
+                Job across all of them instead (see
+                get_indexed_dict_from_yaml).
+            replace (bool): Look up and delete an existing job of the same
+                name first. Not needed after sweep_jobs.
+            namespace (str): Namespace of the job.
+            pull_policy (str): imagePullPolicy of all containers, None to
+                keep the template's (see get_dict_from_yaml).
+            barrier (bool): Whether to add a start barrier.
+            propagation_policy (str): Propagation policy of the delete of
+                an existing job (see delete_obj).
         """
-        self.worker_yaml = get_dict_from_yaml(task, node, tmpl, log_id, image)
-        self.job = self.spawn_job(task, node)
+        self.namespace = namespace
+        if nodes is not None:
+            self.worker_yaml = get_indexed_dict_from_yaml(
+                task, nodes, tmpl, log_id, image,
+                pull_policy = pull_policy,
+                barrier = barrier,
+            )
+        else:
+            self.worker_yaml = get_dict_from_yaml(
+                task, node, tmpl, log_id, image,
+                pull_policy = pull_policy,
+                barrier = barrier,
+            )
+        self.propagation_policy = propagation_policy
+        self.job = self.spawn_job(task, node, replace)
 
     def job_exists(self):
         """
-        Check if Kubernetes job exists in the default namespace.
+        Check if Kubernetes job exists in its namespace.
 
         Args:
             None
@@ -72,11 +135,12 @@ class kubeJob:
         Raises:
             ApiException: An error occured reading the job.
         """
-        batch = client.BatchV1Api()
+        batch = get_batch_api()
         try:
             job = batch.read_namespaced_job(
                 self.worker_yaml["metadata"]["name"],
-                "default",
+                self.namespace,
+                _request_timeout = get_request_timeout(),
             )
         except ApiException as err:
             if err.reason == "Not Found":
@@ -88,13 +152,16 @@ class kubeJob:
             exists = True
         return (exists, job)
 
-    def wait_for_delete(self):
+    def wait_for_delete(self, timeout = 300):
         """Wait for Kubernetes job deletion."""
-        while (self.job_exists())[0]:
-            time.sleep(1)
+        wait_for_delete(
+            names = [self.worker_yaml["metadata"]["name"]],
+            timeout = timeout,
+            namespace = self.namespace,
+        )
         return None
 
-    def spawn_job(self, task, node):
+    def spawn_job(self, task, node, replace = True):
         """
         Spawn a Kubernetes job on a Kubernetes node.
 
@@ -103,6 +170,7 @@ class kubeJob:
         Args:
             task (str): Type of job to run (e.g. runxhpl).
             node (str): Name of the node on which to run the job.
+            replace (bool): Look up and delete an existing job first.
 
         Returns:
             job (V1Job): Spawned job.
@@ -111,32 +179,404 @@ class kubeJob:
             FailToCreateError: An error occured creating the job.
         """
         job = None
-        kube_client = client.api_client.ApiClient()
-        (exists, job) = self.job_exists()
+        kube_client = get_api_client()
+        (exists, job) = self.job_exists() if replace else (False, None)
         if exists:
             logger.info("Found existing job: {0}".format(job.metadata.name))
-            delete_obj(job)
+            delete_obj(job, self.propagation_policy)
             self.wait_for_delete()
 
         logger.info("Creating worker: {0}-{1}".format(task, node))
         if isinstance(self.worker_yaml, dict):
             try:
-                kubeutils.create_from_dict(kube_client, self.worker_yaml)
+                kubeutils.create_from_dict(
+                    kube_client,
+                    self.worker_yaml,
+                    namespace = self.namespace,
+                    _request_timeout = get_request_timeout(),
+                )
             except kubeutils.FailToCreateError as err:  # list(ApiException)
                 raise err
             else:
                 job = get_job(
-                    self.worker_yaml["metadata"]["name"]
+                    self.worker_yaml["metadata"]["name"],
+                    self.namespace,
                 )
         return job
 
 
-def delete_obj(obj):
+class JobTemplate:
+    """
+    A class for compiled Kubernetes YAML templates.
+
+    The template is parsed once, and the path of every string containing a
+    placeholder (e.g. $WORKER) is recorded. Rendering then copies only the
+    dicts/lists along those paths and substitutes the placeholder strings;
+    all other subtrees are shared between rendered manifests, which must be
+    treated as read-only.
+
+    Only the names in PLACEHOLDERS are substituted. Other $NAME tokens (e.g.
+    $HOSTNAME in a container's shell command) are left as they are. A field
+    that is a single placeholder renders as a string.
+
+    Attributes:
+        filename (str): Filename of YAML template.
+        tree (dict): Parsed YAML template.
+        placeholders (set): Placeholder names found in the template.
+    """
+    PLACEHOLDERS = ("WORKER", "TASK", "LOGID", "IMAGE")
+    PLACEHOLDER = re.compile(r"\$({0})\b".format("|".join(PLACEHOLDERS)))
+
+    def __init__(self, filename):
+        """
+        Init with template filename.
+
+        Args:
+            filename (str): Filename of YAML template.
+        """
+        self.filename = filename
+        with open(filename) as f:
+            self.tree = yaml.safe_load(f)
+        self.placeholders = set()
+        self._plan = self._compile(self.tree)
+
+    def _compile(self, node):
+        """Return the render plan of a node, or None if it is static."""
+        if isinstance(node, str):
+            names = self.PLACEHOLDER.findall(node)
+            if not names:
+                return None
+            self.placeholders.update(names)
+            return node
+        if isinstance(node, dict):
+            items = node.items()
+        elif isinstance(node, list):
+            items = enumerate(node)
+        else:
+            return None
+        plan = {}
+        for key, child in items:
+            child_plan = self._compile(child)
+            if child_plan is not None:
+                plan[key] = child_plan
+        return plan if plan else None
+
+    def validate(self, values):
+        """
+        Check that every placeholder in the template has a value.
+
+        Args:
+            values (dict): Placeholder values, keyed by placeholder name.
+
+        Returns:
+            None
+
+        Raises:
+            RuntimeError: Template placeholder has no value.
+        """
+        missing = sorted(
+            name for name in self.placeholders if values.get(name) is None
+        )
+        if missing:
+            raise RuntimeError(
+                "Missing Template Value",
+                self.filename,
+                ["$" + name for name in missing],
+            )
+        return None
+
+    def _render(self, node, plan, values):
+        if isinstance(plan, str):
+            return self.PLACEHOLDER.sub(lambda m: str(values[m.group(1)]), plan)
+        rendered = dict(node) if isinstance(node, dict) else list(node)
+        for key, child_plan in plan.items():
+            rendered[key] = self._render(node[key], child_plan, values)
+        return rendered
+
+    def render(self, values):
+        """
+        Render the template.
+
+        Args:
+            values (dict): Placeholder values, keyed by placeholder name.
+
+        Returns:
+            d (dict): Dictionary of YAML with substituted vars.
+
+        Raises:
+            RuntimeError: Template placeholder has no value.
+        """
+        self.validate(values)
+        if self._plan is None:
+            return self.tree
+        return self._render(self.tree, self._plan, values)
+
+
+def configure_api_client(pool_maxsize = 32, request_timeout = 60, connect_timeout = 5):
+    """
+    Create the Kubernetes API client shared by all functions in the process.
+
+    All API objects are built on this one client, so its urllib3 connection
+    pool (and the keep-alive TLS connections in it) is reused across calls
+    and threads. Must be called after the kubeconfig is loaded.
+
+    Args:
+        pool_maxsize (int): Maximum connections kept in the pool per host.
+        request_timeout (int): Read timeout of each API call, seconds.
+        connect_timeout (int): Connect timeout of each API call, seconds.
+
+    Returns:
+        api_client (ApiClient): Shared Kubernetes API client.
+    """
+    global _api_client, _request_timeout
+    configuration = client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = pool_maxsize
+    with _api_client_lock:
+        _api_client = metrics.instrument_api_client(
+            client.ApiClient(configuration)
+        )
+        _request_timeout = (connect_timeout, request_timeout)
+    return _api_client
+
+
+def get_api_client():
+    """
+    Get the shared Kubernetes API client, creating it with defaults if needed.
+
+    Returns:
+        api_client (ApiClient): Shared Kubernetes API client.
+    """
+    if _api_client is None:
+        configure_api_client()
+    return _api_client
+
+
+def get_batch_api():
+    """Get Kubernetes batch API on the shared client."""
+    return client.BatchV1Api(get_api_client())
+
+
+def get_core_api():
+    """Get Kubernetes core API on the shared client."""
+    return client.CoreV1Api(get_api_client())
+
+
+def get_request_timeout(watch_timeout = None):
+    """
+    Get the (connect, read) timeout for an API call.
+
+    Args:
+        watch_timeout (int): Server-side timeout of a watch, seconds. The
+            read timeout of a watch must outlast it.
+
+    Returns:
+        request_timeout (tuple): (connect, read) timeout, seconds.
+    """
+    (connect_timeout, read_timeout) = _request_timeout
+    if watch_timeout is not None:
+        read_timeout = watch_timeout + read_timeout
+    return (connect_timeout, read_timeout)
+
+
+def spawn_workers(
+    tmpl, task, nodes, log_id, image, max_in_flight = 16, inventory = None,
+    replace = True, namespace = "default", pull_policy = None, barrier = False,
+    propagation_policy = "Foreground"
+):
+    """
+    Spawn Kubernetes jobs on worker nodes concurrently.
+
+    Each node's kubeJob (lookup, optional delete, create, get) runs in a
+    thread pool so that the last node starts close to the first. At most
+    max_in_flight nodes are being spawned at any one time.
+
+    Args:
+        tmpl (str): Filename of YAML template.
+        task (str): Job task to run (e.g. runxhpl).
+        nodes (list): Names of worker nodes.
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker nodes.
+        max_in_flight (int): Maximum number of concurrent spawns.
+        inventory (NodeInventory): Node inventory, to re-check readiness
+            right before each spawn.
+        replace (bool): Look up and delete an existing job of each node
+            first. Not needed after sweep_jobs.
+        namespace (str): Namespace of the jobs.
+        pull_policy (str): imagePullPolicy of all containers, None to keep
+            the template's.
+        barrier (bool): Whether to add a start barrier.
+        propagation_policy (str): Propagation policy of replaced jobs'
+            deletes.
+
+    Returns:
+        tuple(
+            workers (dict): kubeJob instances, keyed by node name.
+            errors (dict): Spawn exceptions, keyed by node name.
+            latencies (dict): Spawn latency in seconds, keyed by node name.
+        )
+    """
+    workers = {}
+    errors = {}
+    latencies = {}
+
+    def _spawn(node):
+        time_start = time.monotonic()
+        if inventory is not None and not inventory.is_ready(node):
+            raise RuntimeError("Node Not Ready", node)
+        kjob = kubeJob(
+            tmpl, task, node, log_id, image,
+            replace = replace,
+            namespace = namespace,
+            pull_policy = pull_policy,
+            barrier = barrier,
+            propagation_policy = propagation_policy,
+        )
+        return (kjob, time.monotonic() - time_start)
+
+    max_workers = max(1, min(max_in_flight, len(nodes)))
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers = max_workers,
+        thread_name_prefix = "thread.spawn",
+    ) as executor:
+        futures = {executor.submit(_spawn, node): node for node in nodes}
+        for future in concurrent.futures.as_completed(futures):
+            node = futures[future]
+            try:
+                (kjob, latency) = future.result()
+            except Exception as err:
+                logger.error("Failed to spawn worker: {0}-{1}: {2}".format(
+                    task, node, err
+                ))
+                errors[node] = err
+                metrics.SPAWN_ERRORS.inc()
+            else:
+                workers[node] = kjob
+                latencies[node] = latency
+                metrics.SPAWN_DURATION.observe(latency)
+    return (workers, errors, latencies)
+
+
+def spawn_indexed_job(
+    tmpl, task, nodes, log_id, image, inventory = None, replace = True,
+    namespace = "default", pull_policy = None, barrier = False,
+    propagation_policy = "Foreground"
+):
+    """
+    Spawn a single Kubernetes Indexed Job across worker nodes.
+
+    Args:
+        tmpl (str): Filename of YAML template.
+        task (str): Job task to run (e.g. runxhpl).
+        nodes (list): Names of worker nodes.
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker nodes.
+        inventory (NodeInventory): Node inventory, to re-check readiness
+            right before the spawn.
+        replace (bool): Look up and delete an existing job of the same name
+            first. Not needed after sweep_jobs.
+        namespace (str): Namespace of the job.
+        pull_policy (str): imagePullPolicy of all containers, None to keep
+            the template's.
+        barrier (bool): Whether to add a start barrier.
+        propagation_policy (str): Propagation policy of a replaced job's
+            delete.
+
+    Returns:
+        tuple(
+            workers (dict): kubeJob instance, keyed by INDEXED_WORKER.
+            errors (dict): Spawn exception, keyed by INDEXED_WORKER or by the
+                name of a node that is not ready.
+            latencies (dict): Spawn latency in seconds, keyed by
+                INDEXED_WORKER.
+        )
+    """
+    workers = {}
+    errors = {}
+    latencies = {}
+    time_start = time.monotonic()
+    if inventory is not None:
+        for node in nodes:
+            if not inventory.is_ready(node):
+                errors[node] = RuntimeError("Node Not Ready", node)
+        if errors:
+            return (workers, errors, latencies)
+    try:
+        kjob = kubeJob(
+            tmpl, task, INDEXED_WORKER, log_id, image,
+            nodes = nodes,
+            replace = replace,
+            namespace = namespace,
+            pull_policy = pull_policy,
+            barrier = barrier,
+            propagation_policy = propagation_policy,
+        )
+    except Exception as err:
+        logger.error("Failed to spawn worker: {0}-{1}: {2}".format(
+            task, INDEXED_WORKER, err
+        ))
+        errors[INDEXED_WORKER] = err
+        metrics.SPAWN_ERRORS.inc()
+    else:
+        workers[INDEXED_WORKER] = kjob
+        latencies[INDEXED_WORKER] = time.monotonic() - time_start
+        metrics.SPAWN_DURATION.observe(latencies[INDEXED_WORKER])
+    return (workers, errors, latencies)
+
+
+def get_percentile(values, pct):
     """
-    Delete Kubernetes object (job or pod) in the default namespace.
+    Get the percentile of a list of values (nearest-rank).
+
+    Args:
+        values (list): Numeric values.
+        pct (float): Percentile, 0-100.
+
+    Returns:
+        value (float or None): Percentile value, None if values is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def get_latency_summary(latencies):
+    """
+    Summarise latencies for logging.
+
+    Args:
+        latencies (dict): Latency in seconds, keyed by node name.
+
+    Returns:
+        summary (str): Count, min, p50, p90, p99 and max latency.
+    """
+    values = list(latencies.values())
+    if not values:
+        return "count: 0"
+    summary = (
+        "count: {0}, min: {1:.2f}s, p50: {2:.2f}s, p90: {3:.2f}s, "
+        "p99: {4:.2f}s, max: {5:.2f}s"
+    ).format(
+        len(values),
+        min(values),
+        get_percentile(values, 50),
+        get_percentile(values, 90),
+        get_percentile(values, 99),
+        max(values),
+    )
+    return summary
+
+
+def delete_obj(obj, propagation_policy = "Foreground"):
+    """
+    Delete Kubernetes object (job or pod) in its namespace.
 
     Args:
         obj (V1Job or V1Pod): Object to delete.
+        propagation_policy (str): Foreground (the object is gone once its
+            dependents are) or Background (it is gone at once, its
+            dependents are garbage collected after).
 
     Returns:
         None
@@ -148,15 +588,16 @@ def delete_obj(obj):
     fn = "delete_namespaced_{0}".format(obj.kind.lower())
     params = (
         obj.metadata.name,
-        "default",
+        obj.metadata.namespace or "default",
     )
     kw_params = {
-        "propagation_policy": "Foreground",
+        "propagation_policy": propagation_policy,
+        "_request_timeout": get_request_timeout(),
     }
     if obj.kind.lower() == "job":
-        api = client.BatchV1Api()
+        api = get_batch_api()
     elif obj.kind.lower() == "pod":
-        api = client.CoreV1Api()
+        api = get_core_api()
     try:
         getattr(api, fn)(*params, **kw_params)
     except ApiException as err:
@@ -164,54 +605,478 @@ def delete_obj(obj):
     return None
 
 
-def get_stream(w):
+def cancel_job(name, namespace = "default"):
+    """
+    Cancel a running Kubernetes job.
+
+    The job's activeDeadlineSeconds is cut to 1, so the job controller
+    terminates its pods and marks it failed (DeadlineExceeded). Unlike a
+    delete, the job and its failed status are kept.
+
+    Args:
+        name (str): Name of the job.
+        namespace (str): Namespace of the job.
+
+    Returns:
+        None
+
+    Raises:
+        ApiException: An error occured patching the job.
+    """
+    logger.info("Cancelling job: {0}".format(name))
+    get_batch_api().patch_namespaced_job(
+        name,
+        namespace,
+        {"spec": {"activeDeadlineSeconds": 1}},
+        _request_timeout = get_request_timeout(),
+    )
+    return None
+
+
+def get_group_selector(task, log_id = None, exclude = None, include = None):
+    """
+    Get the label selector of a task's jobs and pods.
+
+    Args:
+        task (str): Job task (e.g. runxhpl).
+        log_id (str): log_id (unique ID) of run. If None, select every run
+            of the task.
+        exclude (list): Names of jobs (job-group label) to leave out.
+        include (list): Names of jobs (job-group label) to select. If None,
+            select all of them.
+
+    Returns:
+        label_selector (str): Label selector.
+    """
+    label_selector = "task={0}".format(task)
+    if log_id:
+        label_selector += ",log-id={0}".format(log_id)
+    if include is not None:
+        label_selector += ",job-group in ({0})".format(",".join(sorted(include)))
+    if exclude:
+        label_selector += ",job-group notin ({0})".format(",".join(sorted(exclude)))
+    return label_selector
+
+
+def delete_jobs(label_selector, namespace = "default", propagation_policy = "Foreground"):
+    """
+    Delete Kubernetes jobs in a namespace by label selector.
+
+    A single collection delete, whatever the number of jobs.
+
+    Args:
+        label_selector (str): Label selector of the jobs (e.g.
+            "task=runxhpl").
+        namespace (str): Namespace of the jobs.
+        propagation_policy (str): Propagation policy, see delete_obj.
+
+    Returns:
+        None
+
+    Raises:
+        ApiException: An error occured deleting the jobs.
+    """
+    logger.info("Deleting jobs: {0}/{1}".format(namespace, label_selector))
+    get_batch_api().delete_collection_namespaced_job(
+        namespace,
+        label_selector = label_selector,
+        propagation_policy = propagation_policy,
+        _request_timeout = get_request_timeout(),
+    )
+    return None
+
+
+def sweep_jobs(
+    task, workers, timeout = 300, namespace = "default",
+    propagation_policy = "Foreground"
+):
     """
-    Get Kubernetes Watch event stream in the default namespace.
+    Delete the stale jobs of a task on worker nodes before a run, and wait
+    until they are gone.
+
+    Only the jobs the run is about to spawn (named "<task>-<worker>", any
+    log-id) are deleted: the task's jobs on other nodes are left running.
+    Collection deletes of up to SWEEP_BATCH_SIZE jobs each and one
+    list/watch cover all of them, so the jobs can then be spawned without a
+    per-node lookup (see spawn_workers(replace = False)).
+
+    Args:
+        task (str): Job task (e.g. runxhpl).
+        workers (list): Names of the worker nodes, or [INDEXED_WORKER] for
+            the single job of indexed mode.
+        timeout (int): Maximum seconds to wait.
+        namespace (str): Namespace of the jobs.
+        propagation_policy (str): Propagation policy, see delete_obj.
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: Jobs still exist after timeout.
+        ApiException: An error occured deleting, listing or watching the
+            jobs.
+    """
+    names = sorted("{0}-{1}".format(task, worker) for worker in workers)
+    if not names:
+        return None
+    for i in range(0, len(names), SWEEP_BATCH_SIZE):
+        delete_jobs(
+            get_group_selector(task, include = names[i:i + SWEEP_BATCH_SIZE]),
+            namespace,
+            propagation_policy,
+        )
+    wait_for_delete(
+        names = names,
+        label_selector = get_group_selector(task),
+        timeout = timeout,
+        namespace = namespace,
+    )
+    return None
+
+
+def wait_for_delete(names = None, label_selector = None, timeout = 300, namespace = "default"):
+    """
+    Wait for Kubernetes jobs in a namespace to be deleted.
+
+    List the jobs once, then watch from that resourceVersion and return as
+    soon as a DELETED event has been seen for every pending job. A single
+    watch covers all jobs: it is filtered by name for a single job, or by
+    label selector for a group of jobs.
+
+    Args:
+        names (list): Names of jobs to wait for. If None, wait for all jobs
+            matching label_selector.
+        label_selector (str): Label selector for the watch (e.g.
+            "task=runxhpl").
+        timeout (int): Maximum seconds to wait.
+        namespace (str): Namespace of the jobs.
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: Jobs still exist after timeout.
+        ApiException: An error occured listing or watching the jobs.
+    """
+    batch = get_batch_api()
+    kw_params = {}
+    if label_selector:
+        kw_params["label_selector"] = label_selector
+    elif names and len(names) == 1:
+        kw_params["field_selector"] = "metadata.name={0}".format(names[0])
+
+    def _list_pending():
+        list_ = batch.list_namespaced_job(
+            namespace,
+            _request_timeout = get_request_timeout(),
+            **kw_params
+        )
+        existing = set(jb.metadata.name for jb in list_.items)
+        pending = existing if names is None else existing & set(names)
+        return (pending, list_.metadata.resource_version)
+
+    time_deadline = time.monotonic() + timeout
+    (pending, resource_version) = _list_pending()
+    w = watch.Watch()
+    while pending:
+        time_remaining = time_deadline - time.monotonic()
+        if time_remaining <= 0:
+            raise RuntimeError("Delete Timeout Exceeded", sorted(pending))
+        try:
+            for event in w.stream(
+                batch.list_namespaced_job,
+                namespace,
+                resource_version = resource_version,
+                timeout_seconds = max(1, math.ceil(time_remaining)),
+                _request_timeout = get_request_timeout(math.ceil(time_remaining)),
+                **kw_params
+            ):
+                obj = event["object"]
+                resource_version = obj.metadata.resource_version
+                if event["type"] == "DELETED":
+                    pending.discard(obj.metadata.name)
+                if not pending:
+                    w.stop()
+                    break
+        except ApiException as err:
+            if err.status == 410:  # Gone, resourceVersion too old
+                (pending, resource_version) = _list_pending()
+            else:
+                raise err
+    return None
+
+
+def relist(list_fn, known, namespace = "default", **kw_params):
+    """
+    List Kubernetes objects and diff them against the known objects.
+
+    Only changes are returned, so a re-list after a 410 Gone rebuilds state
+    without replaying objects that were already seen.
+
+    Args:
+        list_fn (function): Kubernetes API list function.
+        known (dict): Known objects, keyed by name. Updated in place.
+        namespace (str): Namespace of the objects, None if cluster-scoped.
+        kw_params (dict): List parameters (e.g. label_selector).
+
+    Returns:
+        tuple(
+            resource_version (str): resourceVersion of the list.
+            events (list): Synthesised watch events (ADDED, MODIFIED,
+                DELETED) for the differences.
+        )
+
+    Raises:
+        ApiException: An error occured listing the objects.
+    """
+    args = (namespace,) if namespace else ()
+    list_ = list_fn(
+        *args,
+        _request_timeout = get_request_timeout(),
+        **kw_params
+    )
+    events = diff_objs(known, list_.items)
+    return (list_.metadata.resource_version, events)
+
+
+def get_resource_version(list_fn, namespace = "default", **kw_params):
+    """
+    Get the current resourceVersion of Kubernetes objects.
+
+    A single object is listed (limit=1), so it is cheap however many objects
+    match, e.g. the events of a busy namespace.
+
+    Args:
+        list_fn (function): Kubernetes API list function.
+        namespace (str): Namespace of the objects, None if cluster-scoped.
+        kw_params (dict): List parameters (e.g. field_selector).
+
+    Returns:
+        resource_version (str): resourceVersion of the list.
+
+    Raises:
+        ApiException: An error occured listing the objects.
+    """
+    args = (namespace,) if namespace else ()
+    list_ = list_fn(
+        *args,
+        limit = 1,
+        _request_timeout = get_request_timeout(),
+        **kw_params
+    )
+    return list_.metadata.resource_version
+
+
+def diff_objs(known, items):
+    """
+    Diff listed Kubernetes objects against the known objects.
+
+    Args:
+        known (dict): Known objects, keyed by name. Updated in place.
+        items (list): Listed objects.
+
+    Returns:
+        events (list): Synthesised watch events (ADDED, MODIFIED, DELETED)
+            for the differences.
+    """
+    events = []
+    listed = {}
+    for obj in items:
+        listed[obj.metadata.name] = obj
+    for name in list(known):
+        if name not in listed:
+            events.append({"type": "DELETED", "object": known.pop(name)})
+    for name, obj in listed.items():
+        if name not in known:
+            events.append({"type": "ADDED", "object": obj})
+        elif known[name].metadata.resource_version != obj.metadata.resource_version:
+            events.append({"type": "MODIFIED", "object": obj})
+        known[name] = obj
+    return events
+
+
+def gen_resumable_watch(
+    w, list_fn, known, resource_version, namespace = "default",
+    stop = None, timeout = 300, backoff_max = 30, **kw_params
+):
+    """
+    Generate Kubernetes watch events, resuming the watch when it drops.
+
+    The last resourceVersion is tracked from events and BOOKMARKs, and the
+    watch is reopened from it after a server timeout or a dropped
+    connection, with exponential backoff on errors. On 410 Gone the objects
+    are re-listed once and only the differences are generated, so no
+    transition is replayed or lost. Untracked objects (known is None) are
+    not re-listed: the watch resumes from a fresh resourceVersion, and the
+    changes in between are missed.
 
     Args:
         w (Kubernetes Watch object): Kubernetes Watch.
+        list_fn (function): Kubernetes API list function.
+        known (dict): Known objects, keyed by name. Updated in place. None
+            to not track them (e.g. events, which are only logged).
+        resource_version (str): resourceVersion to start the watch from.
+        namespace (str): Namespace of the objects, None if cluster-scoped.
+        stop (Event): Stop generating once set.
+        timeout (int): Server-side timeout of each watch request, seconds.
+        backoff_max (int): Maximum seconds between reconnects.
+        kw_params (dict): Watch parameters (e.g. label_selector).
+
+    Yields:
+        event (dict): Kubernetes watch event.
+
+    Raises:
+        ApiException: A non-retryable error occured watching the objects.
+    """
+    args = (namespace,) if namespace else ()
+    backoff = 1
+    while not (stop and stop.is_set()):
+        try:
+            for event in w.stream(
+                list_fn,
+                *args,
+                resource_version = resource_version,
+                allow_watch_bookmarks = True,
+                timeout_seconds = timeout,
+                _request_timeout = get_request_timeout(timeout),
+                **kw_params
+            ):
+                backoff = 1
+                if event["type"] == "BOOKMARK":
+                    resource_version = event["raw_object"]["metadata"]["resourceVersion"]
+                    continue
+                obj = event["object"]
+                resource_version = obj.metadata.resource_version
+                if known is not None and event["type"] == "DELETED":
+                    known.pop(obj.metadata.name, None)
+                elif known is not None:
+                    known[obj.metadata.name] = obj
+                yield event
+        except ApiException as err:
+            if err.status == 410 and known is None:
+                logger.info("Watch expired, resuming from now")
+                resource_version = get_resource_version(list_fn, namespace, **kw_params)
+                continue
+            elif err.status == 410:  # Gone, resourceVersion too old
+                logger.info("Watch expired, re-listing")
+                (resource_version, events) = relist(
+                    list_fn, known, namespace, **kw_params
+                )
+                for event in events:
+                    yield event
+                continue
+            elif err.status and 400 <= err.status < 500 and err.status != 429:
+                raise err
+            logger.warning("Watch error, reconnecting in {0}s: {1}".format(
+                backoff, err.reason
+            ))
+        except (urllib3.exceptions.HTTPError, OSError) as err:
+            if stop and stop.is_set():
+                break  # Watch.stop() shuts the socket down
+            logger.warning("Watch dropped, reconnecting in {0}s: {1}".format(
+                backoff, err
+            ))
+        else:
+            continue
+        if stop:
+            stop.wait(backoff)
+        else:
+            time.sleep(backoff)
+        backoff = min(backoff * 2, backoff_max)
+    return None
+
+
+def get_stream(w, field_selector = None, label_selector = None, namespace = "default", stop = None):
+    """
+    Get Kubernetes Watch event stream in a namespace.
+
+    The stream is scoped on the server with field and label selectors, e.g.
+    "involvedObject.kind=Pod". It starts from the resourceVersion of an
+    initial list (limit=1), so only events that happen after the call are
+    streamed, regardless of the client's clock. The watch resumes after
+    drops (see gen_resumable_watch). Events are not tracked: after 410 Gone
+    the stream resumes from a fresh resourceVersion rather than re-listing
+    every event in the namespace, as they are only logged and the informer
+    cache is the source of truth.
+
+    Args:
+        w (Kubernetes Watch object): Kubernetes Watch.
+        field_selector (str): Event field selector.
+        label_selector (str): Event label selector.
+        namespace (str): Namespace of the events.
+        stop (Event): End the stream once set (and w stopped).
 
     Returns:
         stream (V1EventList): event stream list.
     """
-    core = client.CoreV1Api()
+    core = get_core_api()
     fn_dict = {
         "core.list_namespaced_event": core.list_namespaced_event,
     }
     fn = "core.list_namespaced_event"
-    stream = getattr(w, "stream")(
+    kw_params = {}
+    if field_selector:
+        kw_params["field_selector"] = field_selector
+    if label_selector:
+        kw_params["label_selector"] = label_selector
+    resource_version = get_resource_version(fn_dict[fn], namespace, **kw_params)
+    stream = gen_resumable_watch(
+        w,
         fn_dict[fn],
-        "default",
+        None,
+        resource_version,
+        namespace,
+        stop = stop,
+        **kw_params
     )
     return stream
 
 
-def queue_event(q, stream):
+def queue_event(q, stream, name_prefix = None):
     """
-    Add recent events from Kubernetes event stream to Queue.
+    Add events from Kubernetes event stream to Queue.
+
+    STOP_EVENT is put on the queue when the stream ends, so the dispatcher
+    can shut down instead of waiting forever.
 
     Args:
         q (Queue): Queue that will be used to process event stream.
         stream (V1EventList): Event stream that will be processed.
+        name_prefix (str or tuple): Only queue events whose involved object
+            name starts with this prefix (e.g. "runxhpl-"), or one of these
+            prefixes.
 
     Returns:
         None
     """
-    current_time = datetime.datetime.now(tzutc())
-    for event in stream:
-        err = event["object"]
-        if err.last_timestamp:
-            if err.last_timestamp > current_time:
-                q.put(event)
+    try:
+        for event in stream:
+            ev = event["object"]
+            if event["type"] == "DELETED":  # Event expired
+                continue
+            if (
+                name_prefix
+                and not (ev.involved_object.name or "").startswith(name_prefix)
+            ):
+                continue
+            ts = ev.last_timestamp or ev.event_time or ev.first_timestamp
+            if ts:
+                metrics.EVENT_LAG.observe(
+                    max(0, (datetime.datetime.now(tzutc()) - ts).total_seconds()),
+                    kind = ev.involved_object.kind,
+                )
+            q.put(event)
+    finally:
+        q.put(STOP_EVENT)
     return None
 
 
-def get_thread(q, stream):
+def get_thread(q, stream, name_prefix = None, name = "thread.watch"):
     """
     Create and return thread for single asynchronous Kubernetes event stream.
 
     The event stream gets a dedicated thread. Each event is filtered by
-    timestamp and put on the queue to be processed. This allows mutiple
+    involved object name and put on the queue to be processed. This allows mutiple
     event streams to be processed asynchronously by the main thread (e.g.
     processing event streams from a different task or namespace).
 
@@ -228,25 +1093,29 @@ def get_thread(q, stream):
     Args:
         q (Queue): Queue for processing events by main thread.
         stream (V1EventList): Event stream to process.
+        name_prefix (str or tuple): Involved object name prefix(es) to
+            queue.
+        name (str): Name of the thread.
 
     Returns:
         t (Thread): Thread containing event stream.
     """
     t = threading.Thread(
         target = queue_event,
-        args = (q, stream),
-        name = "thread.watch",
+        args = (q, stream, name_prefix),
+        name = name,
         daemon = True,
     )
     return t
 
 
-def get_job(name):
+def get_job(name, namespace = "default"):
     """
-    Get Kubernetes job in the default namespace.
+    Get Kubernetes job in a namespace.
 
     Args:
         name (str): Name of the job.
+        namespace (str): Namespace of the job.
 
     Returns:
         job (V1Job): Queried job
@@ -254,23 +1123,25 @@ def get_job(name):
     Raises:
         ApiException: An error occured reading the job.
     """
-    batch = client.BatchV1Api()
+    batch = get_batch_api()
     try:
         job = batch.read_namespaced_job(
             name,
-            "default",
+            namespace,
+            _request_timeout = get_request_timeout(),
         )
     except ApiException as err:
         raise err
     return job
 
 
-def get_pod(obj):
+def get_pod(obj, namespace = "default"):
     """
-    Get Kubernetes pod in the default namespace.
+    Get Kubernetes pod in a namespace.
 
     Args:
         obj (str or V1Job): Name of the pod or its V1Job parent.
+        namespace (str): Namespace of the pod, if obj is a name.
 
     Returns:
         pod (V1Pod): Queried pod.
@@ -279,13 +1150,14 @@ def get_pod(obj):
         ApiException: An error occured listing the job.
         ApiException: An error occured reading the pod.
     """
-    core = client.CoreV1Api()
+    core = get_core_api()
     if isinstance(obj, client.models.v1_job.V1Job):
         job = obj
         try:
             list_ = core.list_namespaced_pod(
-                "default",
+                job.metadata.namespace or namespace,
                 label_selector = "job-group={0}".format(job.metadata.name),
+                _request_timeout = get_request_timeout(),
             )
         except ApiException as err:
             raise err
@@ -296,19 +1168,62 @@ def get_pod(obj):
         try:
             pod = core.read_namespaced_pod(
                 name,
-                "default",
+                namespace,
+                _request_timeout = get_request_timeout(),
             )
         except ApiException as err:
             raise err
     return pod
 
 
-def get_pod_log(pod_name):
+def get_pods(job):
+    """
+    Get all Kubernetes pods of a job in its namespace.
+
+    Args:
+        job (V1Job): Parent job.
+
+    Returns:
+        list_.items (list V1Pod): Pods of the job.
+
+    Raises:
+        ApiException: An error occured listing the pods.
+    """
+    core = get_core_api()
+    list_ = core.list_namespaced_pod(
+        job.metadata.namespace or "default",
+        label_selector = "job-group={0}".format(job.metadata.name),
+        _request_timeout = get_request_timeout(),
+    )
+    return list_.items
+
+
+def get_index_nodes(pods):
+    """
+    Get the node each completion index of an Indexed Job was scheduled on.
+
+    Args:
+        pods (list V1Pod): Pods of the job.
+
+    Returns:
+        index_nodes (dict): Node name, keyed by completion index (int).
+    """
+    index_nodes = {}
+    for pod in pods:
+        annotations = pod.metadata.annotations or {}
+        index = annotations.get("batch.kubernetes.io/job-completion-index")
+        if index is not None and pod.spec.node_name:
+            index_nodes[int(index)] = pod.spec.node_name
+    return index_nodes
+
+
+def get_pod_log(pod_name, namespace = "default"):
     """
     Get the log of a Kubernetes Pod.
 
     Args:
         pod_name (str): Name of the pod.
+        namespace (str): Namespace of the pod.
 
     Returns:
         str_ (str): pod log
@@ -316,9 +1231,13 @@ def get_pod_log(pod_name):
     Raises:
         ApiException: An error occured reading the pod log
     """
-    core = client.CoreV1Api()
+    core = get_core_api()
     try:
-        str_ = core.read_namespaced_pod_log(pod_name, "default")
+        str_ = core.read_namespaced_pod_log(
+            pod_name,
+            namespace,
+            _request_timeout = get_request_timeout(),
+        )
     except ApiException as err:
         raise err
     return str_
@@ -339,22 +1258,46 @@ def get_like_objs(obj):
     """
     fn = "list_namespaced_{0}".format(obj.kind.lower())
     params = (
-        "default",
+        obj.metadata.namespace or "default",
     )
     kw_params = {
         "label_selector": "task={0},log-id={1}".format(
             obj.metadata.labels["task"],
             obj.metadata.labels["log-id"]
         ),
+        "_request_timeout": get_request_timeout(),
     }
     if obj.kind.lower() == "job":
-        api = client.BatchV1Api()
+        api = get_batch_api()
     elif obj.kind.lower() == "pod":
-        api = client.CoreV1Api()
+        api = get_core_api()
     list_ = getattr(api, fn)(*params, **kw_params)
     return list_.items
 
 
+def get_job_status(job):
+    """
+    Get the status of a Kubernetes job.
+
+    A job has succeeded once all of its completions have (more than one in
+    indexed mode).
+
+    Args:
+        job (V1Job): Query job.
+
+    Returns:
+        status (str): "Failed", "Succeeded" or "" if still running.
+    """
+    status = ""
+    if job.status:
+        completions = (job.spec.completions if job.spec else None) or 1
+        if job.status.failed:
+            status = "Failed"
+        elif (job.status.succeeded or 0) >= completions:
+            status = "Succeeded"
+    return status
+
+
 def gen_like_job_status(job):
     """
     Generate the statuses of similar Kubernetes jobs.
@@ -369,16 +1312,9 @@ def gen_like_job_status(job):
     Yields:
         status (generator): Job statusues generator object.
     """
-    status = ""
     for jb in get_like_objs(job):
         if jb.status:
-            if jb.status.failed:
-                status = "Failed"
-            elif jb.status.succeeded:
-                status = "Succeeded"
-            else:
-                status = ""
-            yield status
+            yield get_job_status(jb)
 
 
 def log_event(ev):
@@ -412,7 +1348,7 @@ def log_event(ev):
     return None
 
 
-def is_failed(ev_type, job, pod, q_exc):
+def is_failed(ev_type, job, pod, q_exc, pending_timeout = 60):
     """
     Check if Kubernetes Job/Pod in Kubernetes Event has failed.
 
@@ -424,6 +1360,8 @@ def is_failed(ev_type, job, pod, q_exc):
         job (V1Job): Query job.
         pod (V1Pod): Query pod.
         q_exc (Queue): Queue to pass job/pod exceptions to main thread.
+        pending_timeout (int): Seconds a pod may be Pending, checked on
+            Warning events only. None when a DeadlineScheduler checks it.
 
     Return:
         failed (bool): Whether the job/pod in the event has failed.
@@ -434,13 +1372,13 @@ def is_failed(ev_type, job, pod, q_exc):
         RuntimeError: Job has Pods in "Failed" phase.
     """
     failed = False
-    if pod.status.start_time:
+    if pending_timeout is not None and pod.status.start_time:
         time_current = datetime.datetime.now(tzutc())
         time_elapsed = (time_current - pod.status.start_time).total_seconds()
         if (
             ev_type == "Warning"
             and pod.status.phase == "Pending"
-            and time_elapsed > 60
+            and time_elapsed > pending_timeout
         ):
             try:
                 raise RuntimeError("Pending Timeout Exceeded", pod.metadata.name)
@@ -465,7 +1403,25 @@ def is_failed(ev_type, job, pod, q_exc):
     return failed
 
 
-def is_completed(job):
+def is_finished(job, cache = None):
+    """
+    Check if all Kubernetes jobs in the group of a job have succeeded or
+    failed.
+
+    Args:
+        job (V1Job): Query job.
+        cache (JobCache): Informer cache of the group. If set, read the
+            group status counters instead of listing the group's jobs.
+
+    Returns:
+        finished (bool): Whether the group is finished.
+    """
+    if cache is not None:
+        return cache.is_finished()
+    return all(status for status in gen_like_job_status(job))
+
+
+def is_completed(job, cache = None):
     """
     Check if Kubernetes Job is completed.
 
@@ -475,24 +1431,136 @@ def is_completed(job):
 
     Args:
         job (V1Job): Query job.
+        cache (JobCache): Informer cache of the group. If set, read the
+            group status counters instead of listing the group's jobs.
 
     Returns:
         completed (bool): Whether the job is completed.
     """
     completed = False
-    like_job_status = list(gen_like_job_status(job))
-    if all(list(i == "Succeeded" for i in like_job_status)):
-        completed = True
+    if cache is not None:
+        completed = cache.is_completed()
+    else:
+        like_job_status = list(gen_like_job_status(job))
+        if all(list(i == "Succeeded" for i in like_job_status)):
+            completed = True
     return completed
 
 
-def parse_queue(q_watch, q_exc):
+def get_event_objs(w_event, cache = None):
+    """
+    Get the Kubernetes Job and Pod that generated a Watch event.
+
+    The event is either a V1Event from the event stream, or a job/pod change
+    from the informer cache.
+
+    Args:
+        w_event (dict): Kubernetes Watch event.
+        cache (JobCache): Informer cache of the group.
+
+    Returns:
+        tuple(
+            job (V1Job or None): Job of the event.
+            pod (V1Pod or None): Pod of the event.
+        )
+    """
+    job = None
+    pod = None
+    ev = w_event["object"]
+    if isinstance(ev, _V1Event):
+        kind = ev.involved_object.kind.lower()
+        name = ev.involved_object.name
+        namespace = ev.involved_object.namespace
+    elif isinstance(ev, client.V1Job):
+        kind = "job"
+        name = ev.metadata.name
+        namespace = ev.metadata.namespace
+    else:
+        kind = "pod"
+        name = ev.metadata.name
+        namespace = ev.metadata.namespace
+    namespace = namespace or "default"
+
+    if cache is not None:
+        if kind == "job":
+            job = cache.get_job(name)
+            pod = cache.get_pod(job) if job else None
+        elif kind == "pod":
+            pod = cache.get_pod(name)
+            job = cache.get_job(pod.metadata.labels["job-group"]) if pod else None
+    else:
+        if kind == "job":
+            job = get_job(name, namespace)
+            pod = get_pod(job)
+        elif kind == "pod":
+            pod = get_pod(name, namespace)
+            job = get_job(pod.metadata.labels["job-group"], namespace)
+    return (job, pod)
+
+
+def handle_event(
+    w_event, q_exc, cache = None, timeline = None, deadlines = None,
+    fail_fast = True
+):
+    """
+    Handle a single Kubernetes Watch event from the event stream.
+
+    Log the event then analyse whether the Kubernetes Job that generated it
+    has completed or failed.
+
+    Args:
+        w_event (dict): Kubernetes Watch event.
+        q_exc (Queue): Queue to pass exceptions to main thread.
+        cache (JobCache): Informer cache of the group. If set, jobs and pods
+            are read from the cache instead of the API server.
+        timeline (Timeline): Phase timeline of the run, to record events.
+        deadlines (DeadlineScheduler): Pod deadlines, to arm/cancel from
+            events. If set, it checks the pending timeout instead of
+            is_failed.
+        fail_fast (bool): Whether the group is done once any job has
+            failed. If False, it is done once every job has succeeded or
+            failed, and failures are not queued (see JobCache.get_failed).
+
+    Returns:
+        done (bool): Whether all jobs in the group have succeeded or any
+            have failed (all have finished if not fail_fast).
+    """
+    ev = w_event["object"]
+    ev_type = None
+    if isinstance(ev, _V1Event):
+        log_event(ev)
+        if timeline is not None:
+            timeline.on_event(ev)
+        if deadlines is not None:
+            deadlines.on_event(ev)
+        ev_type = ev.type
+    (job, pod) = get_event_objs(w_event, cache)
+    if job is None or pod is None:
+        return False
+
+    if not fail_fast:
+        return is_finished(job, cache)
+    done = (
+        is_completed(job, cache)
+        or is_failed(
+            ev_type, job, pod, q_exc,
+            pending_timeout = None if deadlines is not None else 60,
+        )
+    )
+    return done
+
+
+def parse_queue(q_watch, q_exc, sources = 1, handler = handle_event):
     """
-    Parse a Kubernetes event stream.
+    Parse Kubernetes event streams.
 
-    For each event in the stream, log it then analyse whether the Kubernetes
-    Job that generated it has completed or failed. Stop if either all jobs
-    in the group have succeeded or any have failed.
+    Block on the watch queue and pass each event to the handler. Stop if the
+    handler reports that all jobs in the group have succeeded or any have
+    failed, once every event source has put STOP_EVENT on the queue, or
+    when the run is done out of band (DONE_EVENT, e.g. a deadline expired
+    and its exception is already on q_exc).
+    The thread sleeps in Queue.get() between events, so it uses no CPU
+    while idle.
 
     A separate exception queue is necessary because threads have their own
     stack separate from the main thread.
@@ -500,119 +1568,373 @@ def parse_queue(q_watch, q_exc):
     Args:
         q_watch (Queue): Queue to receive async Kubernetes Watch events.
         q_exc (Queue): Queue to pass exceptions to main thread.
+        sources (int): Number of event sources feeding q_watch.
+        handler (function): Callable taking (w_event, q_exc), returning
+            whether processing is done.
 
     Return:
         None
-    """
-    while True:
-        if not q_watch.empty():
-            w_event = q_watch.get()
-            ev = w_event["object"]
-            log_event(ev)
-            obj = ev.involved_object
-            if obj.kind.lower() == "job":
-                job = get_job(obj.name)
-                pod = get_pod(job)
-            elif obj.kind.lower() == "pod":
-                pod = get_pod(obj.name)
-                job = get_job(pod.metadata.name.rsplit("-", 1)[0])
 
-            if (
-                is_completed(job)
-                or is_failed(ev.type, job, pod, q_exc)
-            ):
-                break
+    Raises:
+        RuntimeError: All event streams ended before the group finished.
+    """
+    time_start = time.monotonic()
+    sources_active = sources
+    while sources_active:
+        w_event = q_watch.get()
+        metrics.WATCH_QUEUE_DEPTH.set(q_watch.qsize())
+        if w_event is STOP_EVENT:
+            sources_active -= 1
+            continue
+        if w_event is DONE_EVENT:
+            break
+        time_handle = time.monotonic()
+        done = handler(w_event, q_exc)
+        metrics.EVENT_HANDLE_DURATION.observe(time.monotonic() - time_handle)
+        if done:
+            metrics.COMPLETION_DECISION.set(time.monotonic() - time_start)
+            break
+    else:
+        try:
+            raise RuntimeError("Event Stream Ended")
+        except RuntimeError:
+            q_exc.put(sys.exc_info())
     return None
 
 
-def get_ready_nodes():
+def is_node_ready(node):
+    """
+    Check if a node is ready to schedule jobs.
+
+    Master / control-plane nodes and nodes drained / cordoned are not ready.
+
+    Args:
+        node (V1Node): Query node.
+
+    Returns:
+        ready (bool): Whether the node is ready.
+    """
+    labels = node.metadata.labels or {}
+    if (
+        "node-role.kubernetes.io/master" in labels
+        or "node-role.kubernetes.io/control-plane" in labels
+        or node.spec.unschedulable
+    ):
+        return False
+    ready = False
+    for c in (node.status.conditions or []):
+        if c.type == "Ready":
+            ready = c.status == "True"
+    return ready
+
+
+def get_ready_nodes(label_selector = None):
     """
     Get a list of nodes ready to schedule jobs.
 
     Ignore the master node or any nodes drained / cordoned.
 
     Args:
-        None
+        label_selector (str): Node label selector (e.g. "rack=r1").
 
     Returns:
         ready_nodes (list): Node list.
     """
-    ready_nodes = []
-    core = client.CoreV1Api()
-    list_ = core.list_node()
-    for i in list_.items:
-        if not (
-            "node-role.kubernetes.io/master" in i.metadata.labels.keys()
-            or i.spec.unschedulable
-        ):
-            # Sort condition list by timestamp
-            conds = sorted(
-                i.status.conditions,
-                key = lambda condition: condition.last_transition_time
-            )
-            for c in conds:
-                if c.type == "Ready" and c.status == "True":
-                    ready_nodes.append(i.metadata.name)
+    core = get_core_api()
+    kw_params = {}
+    if label_selector:
+        kw_params["label_selector"] = label_selector
+    list_ = core.list_node(
+        _request_timeout = get_request_timeout(),
+        **kw_params
+    )
+    ready_nodes = sorted(set(
+        i.metadata.name for i in list_.items if is_node_ready(i)
+    ))
     return ready_nodes
 
 
-def get_task_nodes(requested_nodes):
+def get_task_nodes(requested_nodes, inventory = None, min_cpu = None, min_memory = None):
     """
     Get a list of nodes for task.
 
     Args:
-        None
+        requested_nodes (list): Node names, or ["all"].
+        inventory (NodeInventory): Node inventory. If None, list the nodes.
+        min_cpu (float): Minimum allocatable CPU cores (needs inventory).
+        min_memory (int): Minimum allocatable memory bytes (needs inventory).
 
     Returns:
         nodes (list): Node list.
 
     Raises:
         RuntimeError: Requested node not in ready nodes list.
+        RuntimeError: Requested node has insufficient allocatable capacity.
     """
     nodes = []
-    ready_nodes = get_ready_nodes()
+    if inventory is not None:
+        ready_nodes = inventory.get_ready_nodes()
+        capable_nodes = inventory.get_ready_nodes(min_cpu, min_memory)
+    else:
+        ready_nodes = get_ready_nodes()
+        capable_nodes = ready_nodes
     if "all" in requested_nodes:
-        nodes = ready_nodes
+        nodes = capable_nodes
     else:
         for node in requested_nodes:
             if node not in ready_nodes:
                 raise RuntimeError("Node Not Ready", node)
+            if node not in capable_nodes:
+                raise RuntimeError("Node Capacity Insufficient", node)
         nodes = requested_nodes
     return nodes
 
 
-def get_dict_from_yaml(task, worker, filename, log_id, image):
+@functools.lru_cache(maxsize = None)
+def get_template(filename):
+    """
+    Get the compiled Kubernetes YAML template of a file.
+
+    Each file is read and parsed on first use, then cached for the life of
+    the process. The daemon clears the cache before each submitted run (see
+    runner.run_submitted), so an edited template is read again.
+
+    Args:
+        filename (str): Filename of YAML template.
+
+    Returns:
+        tmpl (JobTemplate): Compiled template.
+    """
+    return JobTemplate(filename)
+
+
+def get_template_values(task, worker, log_id, image):
+    """
+    Get the values of the template placeholders for a worker node.
+
+    Args:
+        task (str): Job task to run (e.g. runxhpl).
+        worker (str): Name of worker node.
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker node. If None, use the
+            default image of the task.
+
+    Returns:
+        values (dict): Placeholder values, keyed by placeholder name.
+    """
+    image_dict = {
+        "runxhpl": "hosaka.local:5000/runxhpl:default-x86_64"
+    }
+    values = {
+        "WORKER": worker,
+        "TASK": task,
+        "LOGID": log_id,
+        "IMAGE": image if image else image_dict.get(task),
+    }
+    return values
+
+
+def check_template(filename, task, log_id, image):
+    """
+    Check that a template can be rendered before any job is spawned.
+
+    Args:
+        filename (str): Filename of YAML template.
+        task (str): Job task to run (e.g. runxhpl).
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker nodes.
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: Template placeholder has no value.
+    """
+    get_template(filename).validate(
+        get_template_values(task, "$WORKER", log_id, image)
+    )
+    return None
+
+
+def get_indexed_dict_from_yaml(
+    task, nodes, filename, log_id, image, pull_policy = None, barrier = False
+):
+    """
+    Create a dictionary of a single Indexed Job across worker nodes.
+
+    The template is rendered for INDEXED_WORKER, then the job runs
+    completions = parallelism = len(nodes) pods. The hostname node affinity
+    is widened to all of the nodes, and a pod anti-affinity on hostname
+    places each index on a different node, so every node runs exactly one
+    index. Kubernetes does not pin a given index to a given node; the
+    index/node mapping is read back from the pods (see get_index_nodes).
+
+    Args:
+        task (str): Job task to run (e.g. runxhpl).
+        nodes (list): Names of worker nodes.
+        filename (str): Filename of YAML template.
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker nodes.
+        pull_policy (str): imagePullPolicy of all containers, None to keep
+            the template's.
+        barrier (bool): Whether to add a start barrier.
+
+    Returns:
+        d (dict): Dictionary of YAML with substituted vars
+    """
+    # Rendered manifests share subtrees with the compiled template
+    dict_ = copy.deepcopy(get_dict_from_yaml(
+        task, INDEXED_WORKER, filename, log_id, image,
+        pull_policy = pull_policy,
+        barrier = barrier,
+    ))
+    spec = dict_["spec"]
+    spec["completionMode"] = "Indexed"
+    spec["completions"] = len(nodes)
+    spec["parallelism"] = len(nodes)
+
+    pod_spec = spec["template"]["spec"]
+    affinity = pod_spec.setdefault("affinity", {})
+    node_affinity = affinity.setdefault("nodeAffinity", {})
+    required = node_affinity.setdefault(
+        "requiredDuringSchedulingIgnoredDuringExecution", {}
+    )
+    terms = required.setdefault("nodeSelectorTerms", [])
+    pinned = False
+    for term in terms:
+        for expr in term.get("matchExpressions", []):
+            if expr.get("key") == "kubernetes.io/hostname":
+                expr["operator"] = "In"
+                expr["values"] = list(nodes)
+                pinned = True
+    if not pinned:
+        terms.append({
+            "matchExpressions": [{
+                "key": "kubernetes.io/hostname",
+                "operator": "In",
+                "values": list(nodes),
+            }],
+        })
+    affinity["podAntiAffinity"] = {
+        "requiredDuringSchedulingIgnoredDuringExecution": [{
+            "labelSelector": {
+                "matchLabels": {"job-group": dict_["metadata"]["name"]},
+            },
+            "topologyKey": "kubernetes.io/hostname",
+        }],
+    }
+    return dict_
+
+
+def get_pull_policy_dict(dict_, policy):
+    """
+    Copy a Job dictionary with the imagePullPolicy of all containers set.
+
+    Only the dicts/lists along the container paths are copied, as rendered
+    templates share the other subtrees with the compiled template.
+
+    Args:
+        dict_ (dict): Dictionary of Job YAML.
+        policy (str): imagePullPolicy.
+
+    Returns:
+        d (dict): Dictionary of Job YAML with the policy set.
+    """
+    dict_ = dict(dict_)
+    spec = dict_["spec"] = dict(dict_["spec"])
+    template = spec["template"] = dict(spec["template"])
+    pod_spec = template["spec"] = dict(template["spec"])
+    for key in ("initContainers", "containers"):
+        if pod_spec.get(key):
+            pod_spec[key] = [
+                dict(container, imagePullPolicy = policy)
+                for container in pod_spec[key]
+            ]
+    return dict_
+
+
+def get_barrier_dict(dict_):
+    """
+    Copy a Job dictionary with a start barrier init container.
+
+    The init container runs the image of the first container and blocks
+    until the pod's BARRIER_ANNOTATION, mounted through a downward API
+    volume, holds a release time, then sleeps until that time. The kubelet
+    refreshes the volume when the pod is patched, so all pods can be
+    released together by annotating them with a time shortly in the future
+    (see barrier.release).
+
+    Args:
+        dict_ (dict): Dictionary of Job YAML.
+
+    Returns:
+        d (dict): Dictionary of Job YAML with the barrier.
+    """
+    dict_ = dict(dict_)
+    spec = dict_["spec"] = dict(dict_["spec"])
+    template = spec["template"] = dict(spec["template"])
+    pod_spec = template["spec"] = dict(template["spec"])
+    container = pod_spec["containers"][0]
+    script = (
+        "until [ -s /barrier/release-at ]; do sleep 0.2; done; "
+        "release=$(cat /barrier/release-at); "
+        "while [ \"$(date +%s)\" -lt \"$release\" ]; do sleep 0.02; done"
+    )
+    gate = {
+        "name": BARRIER_CONTAINER,
+        "image": container["image"],
+        "command": ["/bin/sh", "-c", script],
+        "volumeMounts": [{"name": BARRIER_CONTAINER, "mountPath": "/barrier"}],
+    }
+    if container.get("imagePullPolicy"):
+        gate["imagePullPolicy"] = container["imagePullPolicy"]
+    pod_spec["initContainers"] = list(pod_spec.get("initContainers") or []) + [gate]
+    pod_spec["volumes"] = list(pod_spec.get("volumes") or []) + [{
+        "name": BARRIER_CONTAINER,
+        "downwardAPI": {
+            "items": [{
+                "path": "release-at",
+                "fieldRef": {
+                    "fieldPath": "metadata.annotations['{0}']".format(
+                        BARRIER_ANNOTATION
+                    ),
+                },
+            }],
+        },
+    }]
+    return dict_
+
+
+def get_dict_from_yaml(
+    task, worker, filename, log_id, image, pull_policy = None, barrier = False
+):
     """
     Create a dictionary from a Kubernetes YAML template that will be used to
     spawn jobs on worker nodes.
 
+    The template is compiled once per file (see JobTemplate), so only the
+    fields containing placeholders are rendered per node. The imagePullPolicy
+    is overridden if set (e.g. IfNotPresent after a pre-pull, see prepull),
+    and a start barrier is added if enabled (see get_barrier_dict).
+
     Args:
         task (str): Job task to run (e.g. runxhpl).
         worker (str): Name of worker node.
         filename (str): Filename of YAML template.
         log_id (str): log_id (unique ID) of run.
         image (str): Docker image to run on worker node.
+        pull_policy (str): imagePullPolicy of all containers, None to keep
+            the template's.
+        barrier (bool): Whether to add a start barrier.
 
     Returns:
         d (dict): Dictionary of YAML with substituted vars
     """
-    dict_ = {}
-    image_dict = {
-        "runxhpl": "hosaka.local:5000/runxhpl:default-x86_64"
-    }
-    img = image if image else image_dict[task]
-    with open(filename) as f:
-        blob = f.read()
-
-    dict_ = yaml.safe_load(
-        blob.replace(
-            "$WORKER", worker
-        ).replace(
-            "$TASK", task
-        ).replace(
-            "$LOGID", log_id
-        ).replace(
-            "$IMAGE", img
-        )
+    dict_ = get_template(filename).render(
+        get_template_values(task, worker, log_id, image)
     )
+    if pull_policy:
+        dict_ = get_pull_policy_dict(dict_, pull_policy)
+    if barrier:
+        dict_ = get_barrier_dict(dict_)
     return dict_
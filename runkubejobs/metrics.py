@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+
+"""
+This module implements Prometheus metrics of the controller hot paths.
+
+Metrics are kept in-process (counters, gauges and histograms with labels)
+and exposed in the Prometheus text format, either over a local HTTP
+endpoint (see start_http_server) or as a file for the node_exporter
+textfile collector (see write_textfile).
+
+Every Kubernetes API request made on the shared client is counted and
+timed by verb and resource (see instrument_api_client), which covers
+get_job, get_pod, get_like_objs, delete_obj and create_from_dict without
+instrumenting each call site.
+
+"""
+
+import bisect
+import http.server
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf
+)
+
+# Kubernetes API path, e.g. /apis/batch/v1/namespaces/default/jobs/name
+API_PATH = re.compile(
+    r"^/apis?/(?:[^/]+/)?v\w+/(?:namespaces/[^/]+/)?(?P<resource>[a-z]+)"
+    r"(?:/(?P<name>[^/]+))?(?:/(?P<sub>[a-z]+))?$"
+)
+
+_metrics = []
+
+
+class Metric:
+    """
+    A class for a labelled Prometheus metric.
+
+    Attributes:
+        name (str): Name of the metric.
+        doc (str): Help text of the metric.
+        label_names (tuple): Names of the labels.
+    """
+    TYPE = "untyped"
+
+    def __init__(self, name, doc, label_names = ()):
+        """
+        Init with name and labels, and register the metric.
+
+        Args:
+            name (str): Name of the metric.
+            doc (str): Help text of the metric.
+            label_names (tuple): Names of the labels.
+        """
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        if self.TYPE == "counter" and not self.label_names:
+            self._values[()] = 0
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _format_labels(self, key, extra = None):
+        pairs = list(zip(self.label_names, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(
+            '{0}="{1}"'.format(name, _escape(value)) for name, value in pairs
+        ) + "}"
+
+    def get(self, **labels):
+        """
+        Get the value of a labelled series.
+
+        Args:
+            labels (dict): Label values.
+
+        Returns:
+            value (float or None): Value of the series.
+        """
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def clear(self):
+        """Remove all series."""
+        with self._lock:
+            self._values.clear()
+        return None
+
+    def collect(self):
+        """
+        Get the metric in the Prometheus text format.
+
+        Returns:
+            lines (list): Text format lines.
+        """
+        lines = [
+            "# HELP {0} {1}".format(self.name, self.doc),
+            "# TYPE {0} {1}".format(self.name, self.TYPE),
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append("{0}{1} {2}".format(
+                    self.name, self._format_labels(key), _format_value(value)
+                ))
+        return lines
+
+
+class Counter(Metric):
+    """A class for a monotonically increasing metric."""
+    TYPE = "counter"
+
+    def inc(self, value = 1, **labels):
+        """
+        Increase a labelled series.
+
+        Args:
+            value (float): Increase.
+            labels (dict): Label values.
+
+        Returns:
+            None
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        return None
+
+
+class Gauge(Metric):
+    """A class for a metric that can go up and down."""
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        """
+        Set a labelled series.
+
+        Args:
+            value (float): Value.
+            labels (dict): Label values.
+
+        Returns:
+            None
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+        return None
+
+
+class Histogram(Metric):
+    """
+    A class for a metric of observed values in cumulative buckets.
+
+    Attributes:
+        buckets (tuple): Upper bounds of the buckets, ending with +Inf.
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name, doc, label_names = (), buckets = DEFAULT_BUCKETS):
+        """
+        Init with name, labels and buckets, and register the metric.
+
+        Args:
+            name (str): Name of the metric.
+            doc (str): Help text of the metric.
+            label_names (tuple): Names of the labels.
+            buckets (tuple): Upper bounds of the buckets.
+        """
+        super().__init__(name, doc, label_names)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value, **labels):
+        """
+        Observe a value in a labelled series.
+
+        Args:
+            value (float): Observed value.
+            labels (dict): Label values.
+
+        Returns:
+            None
+        """
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+        return None
+
+    def get(self, **labels):
+        """
+        Get the count and sum of a labelled series.
+
+        Args:
+            labels (dict): Label values.
+
+        Returns:
+            tuple(count (int), sum (float)) or None.
+        """
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            return None if series is None else (series[2], series[1])
+
+    def collect(self):
+        lines = [
+            "# HELP {0} {1}".format(self.name, self.doc),
+            "# TYPE {0} {1}".format(self.name, self.TYPE),
+        ]
+        with self._lock:
+            for key, (counts, sum_, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append("{0}_bucket{1} {2}".format(
+                        self.name,
+                        self._format_labels(key, ("le", _format_value(bound))),
+                        cumulative,
+                    ))
+                labels = self._format_labels(key)
+                lines.append("{0}_sum{1} {2}".format(self.name, labels, _format_value(sum_)))
+                lines.append("{0}_count{1} {2}".format(self.name, labels, count))
+        return lines
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+API_REQUESTS = Counter(
+    "runkubejobs_api_requests_total",
+    "Kubernetes API requests by verb, resource and HTTP status code.",
+    ("verb", "resource", "code"),
+)
+API_REQUEST_DURATION = Histogram(
+    "runkubejobs_api_request_duration_seconds",
+    "Kubernetes API request latency (to response headers for watches).",
+    ("verb", "resource"),
+)
+WATCH_QUEUE_DEPTH = Gauge(
+    "runkubejobs_watch_queue_depth",
+    "Events waiting in the watch queue when the dispatcher takes one.",
+)
+EVENT_LAG = Histogram(
+    "runkubejobs_event_lag_seconds",
+    "Delay from a Kubernetes event's timestamp to it being queued.",
+    ("kind",),
+    buckets = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300),
+)
+EVENT_HANDLE_DURATION = Histogram(
+    "runkubejobs_event_handle_duration_seconds",
+    "Time for the dispatcher to handle one watch event.",
+)
+SPAWN_DURATION = Histogram(
+    "runkubejobs_spawn_duration_seconds",
+    "Time to spawn the job of one node (lookup, delete, create, get).",
+)
+SPAWN_ERRORS = Counter(
+    "runkubejobs_spawn_errors_total",
+    "Nodes whose job failed to spawn.",
+)
+COMPLETION_DECISION = Gauge(
+    "runkubejobs_completion_decision_seconds",
+    "Time from dispatcher start to the group success/failure decision.",
+)
+
+
+def get_api_labels(method, url, query_params = None):
+    """
+    Get the verb and resource of a Kubernetes API request.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Request URL, with or without the query string.
+        query_params (list): Query parameters not in the URL.
+
+    Returns:
+        tuple(
+            verb (str): e.g. get, list, watch, create, delete.
+            resource (str): e.g. jobs, pods, pods/log.
+        )
+    """
+    url_ = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(url_.query))
+    query.update(dict(query_params or ()))
+    m = API_PATH.match(url_.path)
+    if not m:
+        return (method.lower(), "other")
+    resource = m.group("resource")
+    if m.group("sub"):
+        resource = "{0}/{1}".format(resource, m.group("sub"))
+    has_name = m.group("name") is not None
+    if method == "GET":
+        if has_name:
+            verb = "get"
+        elif str(query.get("watch")).lower() in ("true", "1"):
+            verb = "watch"
+        else:
+            verb = "list"
+    elif method == "POST":
+        verb = "create"
+    elif method == "DELETE":
+        verb = "delete" if has_name else "deletecollection"
+    elif method == "PATCH":
+        verb = "patch"
+    elif method == "PUT":
+        verb = "update"
+    else:
+        verb = method.lower()
+    return (verb, resource)
+
+
+def instrument_api_client(api_client):
+    """
+    Count and time every request made through a Kubernetes API client.
+
+    Args:
+        api_client (ApiClient): Kubernetes API client, instrumented in place.
+
+    Returns:
+        api_client (ApiClient): The same client.
+    """
+    rest_client = api_client.rest_client
+    request = rest_client.request
+
+    def _request(method, url, *args, **kw_params):
+        (verb, resource) = get_api_labels(
+            method, url, kw_params.get("query_params")
+        )
+        code = "error"
+        time_start = time.monotonic()
+        try:
+            resp = request(method, url, *args, **kw_params)
+            code = str(resp.status)
+            return resp
+        except Exception as err:
+            code = str(getattr(err, "status", None) or "error")
+            raise
+        finally:
+            API_REQUEST_DURATION.observe(
+                time.monotonic() - time_start, verb = verb, resource = resource
+            )
+            API_REQUESTS.inc(verb = verb, resource = resource, code = code)
+
+    rest_client.request = _request
+    return api_client
+
+
+def generate_text():
+    """
+    Get all metrics in the Prometheus text format.
+
+    Returns:
+        str_ (str): Text exposition of all metrics.
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(filename):
+    """
+    Write all metrics to a file for the node_exporter textfile collector.
+
+    The file is replaced atomically, so the collector never reads a
+    partial file.
+
+    Args:
+        filename (str): Filename of the .prom file.
+
+    Returns:
+        None
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(dirname, exist_ok = True)
+    (fd, tmp) = tempfile.mkstemp(dir = dirname, prefix = ".metrics.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(generate_text())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, filename)
+    except Exception:
+        os.unlink(tmp)
+        raise
+    return None
+
+
+def start_textfile_writer(filename, interval = 15):
+    """
+    Write all metrics to a file periodically, in a daemon thread.
+
+    Args:
+        filename (str): Filename of the .prom file.
+        interval (float): Seconds between writes.
+
+    Returns:
+        stop (Event): Set to stop writing.
+    """
+    stop = threading.Event()
+
+    def _run():
+        while not stop.wait(interval):
+            try:
+                write_textfile(filename)
+            except OSError as err:
+                logger.warning("Failed to write metrics: {0}".format(err))
+        return None
+
+    threading.Thread(target = _run, name = "thread.metrics", daemon = True).start()
+    return stop
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path not in ("/", "/metrics"):
+            self.send_error(404)
+            return None
+        body = generate_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+    def log_message(self, format_, *args):
+        logger.debug(format_ % args)
+
+
+def start_http_server(port, addr = "127.0.0.1"):
+    """
+    Serve all metrics over HTTP at /metrics, in a daemon thread.
+
+    Args:
+        port (int): Port to listen on.
+        addr (str): Address to listen on, localhost only by default, all
+            if empty.
+
+    Returns:
+        server (ThreadingHTTPServer): Metrics server.
+    """
+    server = http.server.ThreadingHTTPServer((addr, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target = server.serve_forever,
+        name = "thread.metrics",
+        daemon = True,
+    ).start()
+    logger.info("Serving metrics on {0}:{1}".format(*server.server_address[:2]))
+    return server
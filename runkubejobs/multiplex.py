@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+"""
+This module implements a controller for several task groups at once.
+
+A task group is the jobs of one task of a run (log-id) in one namespace,
+e.g. runxhpl in "default" and stream in "perf". All groups of a run share,
+per namespace, one job informer and one pod informer (selected by the
+run's log-id) and one event stream per involved object kind, all feeding a
+single dispatcher (kubejobs.parse_queue). Each group sees its own jobs and
+pods through filtered views of the shared informers (see
+informer.JobCache), and its completion and failures are tracked
+separately: the dispatcher routes every event to the group it belongs to,
+and the run is done once every group is.
+
+"""
+
+import logging
+import queue
+import threading
+
+import kubernetes.watch as watch
+
+from runkubejobs import informer
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGroup:
+    """
+    A class for the jobs of one task in one namespace.
+
+    Attributes:
+        task (str): Job task to run (e.g. runxhpl).
+        namespace (str): Namespace of the jobs.
+        tmpl (str): Filename of YAML template.
+        image (str): Docker image to run on worker nodes.
+        pull_policy (str): imagePullPolicy of all containers, None to keep
+            the template's.
+        barrier (bool): Whether the jobs start at a barrier.
+        propagation_policy (str): Propagation policy of the jobs' deletes.
+        name (str): Name of the group, "namespace/task".
+        cache (JobCache): Informer cache of the group.
+        q_exc (Queue): Queue of the group's exceptions (sys.exc_info).
+        timeline (Timeline): Phase timeline of the group.
+        deadlines (DeadlineScheduler): Pod deadlines of the group.
+        workers (dict): kubeJob instances, keyed by node name.
+        finished (Event): Set once the group is done.
+    """
+    def __init__(
+        self, task, namespace, tmpl, image, pull_policy = None, barrier = False,
+        propagation_policy = "Foreground"
+    ):
+        """
+        Init with task, namespace, template and job options.
+
+        Args:
+            task (str): Job task to run (e.g. runxhpl).
+            namespace (str): Namespace of the jobs.
+            tmpl (str): Filename of YAML template.
+            image (str): Docker image to run on worker nodes.
+            pull_policy (str): imagePullPolicy of all containers, None to
+                keep the template's.
+            barrier (bool): Whether the jobs start at a barrier.
+            propagation_policy (str): Propagation policy of the jobs'
+                deletes.
+        """
+        self.task = task
+        self.namespace = namespace
+        self.tmpl = tmpl
+        self.image = image
+        self.pull_policy = pull_policy
+        self.barrier = barrier
+        self.propagation_policy = propagation_policy
+        self.name = "{0}/{1}".format(namespace, task)
+        self.cache = None
+        self.q_exc = queue.Queue()
+        self.timeline = None
+        self.deadlines = None
+        self.workers = {}
+        self.finished = threading.Event()
+
+
+class Multiplexer:
+    """
+    A class for running task groups on shared watches and informers.
+
+    Attributes:
+        log_id (str): log_id (unique ID) of run.
+        groups (list): TaskGroups of the run.
+        q_done (Queue): Groups put as they finish, then None once the
+            dispatcher has stopped.
+    """
+    KINDS = ("Job", "Pod")
+
+    def __init__(self, log_id, q_watch):
+        """
+        Init with log_id and the dispatcher's watch queue.
+
+        Args:
+            log_id (str): log_id (unique ID) of run.
+            q_watch (Queue): Watch queue of the dispatcher.
+        """
+        self.log_id = log_id
+        self.groups = []
+        self.q_done = queue.Queue()
+        self._q_watch = q_watch
+        self._informers = {}  # namespace: (job Informer, pod Informer)
+        self._watches = []
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def _get_informers(self, namespace):
+        """Get the shared informers of a namespace, created on first use."""
+        informers = self._informers.get(namespace)
+        if informers is None:
+            label_selector = "log-id={0}".format(self.log_id)
+            informers = self._informers[namespace] = (
+                informer.Informer(
+                    kubejobs.get_batch_api().list_namespaced_job,
+                    namespace = namespace,
+                    label_selector = label_selector,
+                    q = self._q_watch,
+                ),
+                informer.Informer(
+                    kubejobs.get_core_api().list_namespaced_pod,
+                    namespace = namespace,
+                    label_selector = label_selector,
+                    index_label = "job-group",
+                    q = self._q_watch,
+                ),
+            )
+        return informers
+
+    def add_group(self, group, expected = None):
+        """
+        Add a task group, with a cache on the shared informers.
+
+        Args:
+            group (TaskGroup): Task group.
+            expected (int): Number of jobs expected in the group.
+
+        Returns:
+            group (TaskGroup): The group, with its cache set.
+        """
+        for other in self.groups:
+            if (other.task, other.namespace) == (group.task, group.namespace):
+                raise RuntimeError("Duplicate Task Group", group.name)
+        group.cache = informer.JobCache(
+            group.task,
+            self.log_id,
+            expected = expected,
+            namespace = group.namespace,
+            informers = self._get_informers(group.namespace),
+        )
+        self.groups.append(group)
+        return group
+
+    def start(self):
+        """
+        Start the event streams and informers of every namespace.
+
+        Returns:
+            sources (int): Number of event sources feeding the watch queue.
+        """
+        sources = 0
+        for namespace, (jobs, pods) in sorted(self._informers.items()):
+            # Jobs and pods are named after their task
+            name_prefix = tuple(
+                g.task + "-" for g in self.groups if g.namespace == namespace
+            )
+            for kind in self.KINDS:
+                w = watch.Watch()
+                self._watches.append(w)
+                stream = kubejobs.get_stream(
+                    w,
+                    field_selector = "involvedObject.kind={0}".format(kind),
+                    namespace = namespace,
+                    stop = self._stopped,
+                )
+                kubejobs.get_thread(
+                    self._q_watch,
+                    stream,
+                    name_prefix = name_prefix,
+                    name = "thread.watch.{0}.{1}".format(namespace, kind.lower()),
+                ).start()
+                sources += 1
+            jobs.start(name = "thread.informer.{0}.job".format(namespace))
+            pods.start(name = "thread.informer.{0}.pod".format(namespace))
+            sources += 2
+        return sources
+
+    def stop(self):
+        """Stop the event streams and shared informers."""
+        self._stopped.set()
+        for w in self._watches:
+            w.stop()
+        for (jobs, pods) in self._informers.values():
+            jobs.stop()
+            pods.stop()
+        return None
+
+    def get_group(self, w_event):
+        """
+        Get the task group a Watch event belongs to.
+
+        Args:
+            w_event (dict): Kubernetes Watch event, a V1Event or a job/pod
+                change from an informer.
+
+        Returns:
+            group (TaskGroup or None): Group of the event's object.
+        """
+        ev = w_event["object"]
+        if isinstance(ev, kubejobs._V1Event):
+            obj = ev.involved_object
+            namespace = obj.namespace or "default"
+            candidates = [g for g in self.groups if g.namespace == namespace]
+            for group in candidates:
+                if obj.kind == "Job" and group.cache.get_job(obj.name):
+                    return group
+                if obj.kind == "Pod" and group.cache.pods.get(obj.name):
+                    return group
+            # Not cached yet: jobs and pods are named after their task
+            candidates = [
+                g for g in candidates if (obj.name or "").startswith(g.task + "-")
+            ]
+            return max(candidates, key = lambda g: len(g.task), default = None)
+        labels = ev.metadata.labels or {}
+        namespace = ev.metadata.namespace or "default"
+        for group in self.groups:
+            if group.task == labels.get("task") and group.namespace == namespace:
+                return group
+        return None
+
+    def finish(self, group):
+        """
+        Mark a task group done, once.
+
+        The group is put on q_done. Once every group is done, DONE_EVENT
+        stops the dispatcher.
+
+        Args:
+            group (TaskGroup): Finished group.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if group.finished.is_set():
+                return None
+            group.finished.set()
+            done = all(g.finished.is_set() for g in self.groups)
+        logger.info("Task group finished: {0}".format(group.name))
+        self.q_done.put(group)
+        if done:
+            self._q_watch.put(kubejobs.DONE_EVENT)
+        return None
+
+    def handle(self, w_event, q_exc, fail_fast = True):
+        """
+        Dispatcher handler: route an event to its task group and handle it.
+
+        Args:
+            w_event (dict): Kubernetes Watch event.
+            q_exc (Queue): Queue of the dispatcher's exceptions, unused;
+                each group's go to its own queue.
+            fail_fast (bool): Whether a group is done once any of its jobs
+                has failed (see kubejobs.handle_event).
+
+        Returns:
+            done (bool): Whether every group is done.
+        """
+        group = self.get_group(w_event)
+        if group is not None and not group.finished.is_set():
+            if kubejobs.handle_event(
+                w_event,
+                group.q_exc,
+                cache = group.cache,
+                timeline = group.timeline,
+                deadlines = group.deadlines,
+                fail_fast = fail_fast,
+            ):
+                self.finish(group)
+        return all(g.finished.is_set() for g in self.groups)
+
+    def dispatch(self, q_exc, sources, fail_fast = True):
+        """
+        Run the dispatcher over the shared watch queue until every group is
+        done or the event sources have stopped, then put None on q_done.
+
+        Args:
+            q_exc (Queue): Queue of the dispatcher's exceptions.
+            sources (int): Number of event sources, from start().
+            fail_fast (bool): See handle().
+
+        Returns:
+            None
+        """
+        try:
+            kubejobs.parse_queue(
+                self._q_watch,
+                q_exc,
+                sources = sources,
+                handler = lambda w_event, q_exc: self.handle(w_event, q_exc, fail_fast),
+            )
+        finally:
+            self.q_done.put(None)
+        return None
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+
+"""
+This module implements memory-bounded collection of Kubernetes pod logs.
+
+Pod logs are streamed from the API server in chunks and written to one file
+per pod (optionally gzip compressed), so a verbose log is never held in
+memory as a whole. Only a bounded tail of each log is kept for console
+output. Logs of running pods can also be followed live (see LogFollower),
+so results are on disk as soon as a run finishes.
+
+"""
+
+import collections
+import concurrent.futures
+import datetime
+import email.utils
+import gzip
+import logging
+import math
+import os
+import threading
+import time
+
+import urllib3
+from kubernetes.client.rest import ApiException
+
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+
+class LogTail:
+    """
+    A class for keeping the tail of a byte stream.
+
+    Attributes:
+        max_lines (int): Maximum number of lines kept.
+        max_bytes (int): Maximum number of bytes kept.
+    """
+    def __init__(self, max_lines = 100, max_bytes = 65536):
+        """
+        Init with tail limits.
+
+        Args:
+            max_lines (int): Maximum number of lines kept.
+            max_bytes (int): Maximum number of bytes kept.
+        """
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self._buf = collections.deque()
+        self._size = 0
+
+    def feed(self, chunk):
+        """
+        Add a chunk of the stream, dropping the oldest bytes over max_bytes.
+
+        Args:
+            chunk (bytes): Chunk of the stream.
+
+        Returns:
+            None
+        """
+        if not chunk:
+            return None
+        chunk = chunk[-self.max_bytes:]
+        self._buf.append(chunk)
+        self._size += len(chunk)
+        while self._size - len(self._buf[0]) >= self.max_bytes:
+            self._size -= len(self._buf.popleft())
+        return None
+
+    def get(self):
+        """
+        Get the tail of the stream.
+
+        Returns:
+            str_ (str): Last max_lines lines, within max_bytes.
+        """
+        blob = b"".join(self._buf)[-self.max_bytes:]
+        lines = blob.decode("utf-8", errors = "replace").splitlines()
+        return "\n".join(lines[-self.max_lines:])
+
+
+def get_log_filename(logdir, pod_name, compress = False):
+    """
+    Get the filename of a pod log.
+
+    Args:
+        logdir (str): Directory of pod logs.
+        pod_name (str): Name of the pod.
+        compress (bool): Whether the log is gzip compressed.
+
+    Returns:
+        filename (str): Filename of the pod log.
+    """
+    filename = os.path.join(logdir, "{0}.log".format(pod_name))
+    if compress:
+        filename += ".gz"
+    return filename
+
+
+def open_log(filename, mode = "wb", compress = False):
+    """
+    Open a pod log file for writing.
+
+    Args:
+        filename (str): Filename of the pod log.
+        mode (str): File mode ("wb" or "ab").
+        compress (bool): Whether to gzip compress the log.
+
+    Returns:
+        f (file): Binary file object.
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok = True)
+    if compress:
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+
+def save_pod_log(
+    pod_name, logdir, compress = False, tail_lines = 100,
+    tail_bytes = 65536, chunk_size = 65536, namespace = "default"
+):
+    """
+    Stream the log of a Kubernetes Pod to a file.
+
+    Args:
+        pod_name (str): Name of the pod.
+        logdir (str): Directory of pod logs.
+        compress (bool): Whether to gzip compress the log.
+        tail_lines (int): Maximum number of lines returned.
+        tail_bytes (int): Maximum number of bytes returned.
+        chunk_size (int): Bytes read from the stream at a time.
+        namespace (str): Namespace of the pod.
+
+    Returns:
+        tuple(
+            filename (str): Filename of the pod log.
+            tail (str): Tail of the pod log.
+        )
+
+    Raises:
+        ApiException: An error occured reading the pod log.
+    """
+    filename = get_log_filename(logdir, pod_name, compress)
+    tail = LogTail(tail_lines, tail_bytes)
+    core = kubejobs.get_core_api()
+    resp = core.read_namespaced_pod_log(
+        pod_name,
+        namespace,
+        _preload_content = False,
+        _request_timeout = kubejobs.get_request_timeout(),
+    )
+    try:
+        with open_log(filename, "wb", compress) as f:
+            for chunk in resp.stream(chunk_size):
+                f.write(chunk)
+                tail.feed(chunk)
+    finally:
+        resp.release_conn()
+    return (filename, tail.get())
+
+
+def save_pod_logs(pod_names, logdir, max_workers = 8, **kw_params):
+    """
+    Stream the logs of Kubernetes Pods to files concurrently.
+
+    Args:
+        pod_names (list): Names of the pods.
+        logdir (str): Directory of pod logs.
+        max_workers (int): Maximum number of concurrent streams.
+        kw_params (dict): Parameters of save_pod_log (e.g. compress).
+
+    Returns:
+        results (dict): (filename, tail) or the exception raised, keyed by
+            pod name.
+    """
+    results = {}
+    if not pod_names:
+        return results
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers = max(1, min(max_workers, len(pod_names))),
+        thread_name_prefix = "thread.log",
+    ) as executor:
+        futures = {
+            executor.submit(save_pod_log, pod_name, logdir, **kw_params): pod_name
+            for pod_name in pod_names
+        }
+        for future in concurrent.futures.as_completed(futures):
+            pod_name = futures[future]
+            try:
+                results[pod_name] = future.result()
+            except Exception as err:
+                logger.error("Failed to save pod log: {0}: {1}".format(
+                    pod_name, err
+                ))
+                results[pod_name] = err
+    return results
+
+
+def get_ts_key(line):
+    """
+    Get a sortable key for the RFC3339 timestamp prefix of a log line.
+
+    Args:
+        line (bytes): Log line from a stream with timestamps=True.
+
+    Returns:
+        key (bytes): Timestamp with the fraction padded to nanoseconds.
+    """
+    ts = line.split(b" ", 1)[0].rstrip(b"Z")
+    (secs, _, frac) = ts.partition(b".")
+    return secs + b"." + frac.ljust(9, b"0")
+
+
+def get_ts(line):
+    """
+    Get the RFC3339 timestamp prefix of a log line in seconds.
+
+    Args:
+        line (bytes): Log line from a stream with timestamps=True.
+
+    Returns:
+        ts (float or None): Seconds since the epoch, None if the line has
+            no timestamp.
+    """
+    (secs, _, frac) = get_ts_key(line).decode(errors = "replace").partition(".")
+    try:
+        dt = datetime.datetime.strptime(secs, "%Y-%m-%dT%H:%M:%S")
+        frac_ = float("0." + frac)
+    except ValueError:
+        return None
+    return dt.replace(tzinfo = datetime.timezone.utc).timestamp() + frac_
+
+
+def get_clock_offset(resp):
+    """
+    Get the offset of the API server's clock from the local clock.
+
+    Args:
+        resp (HTTPResponse): Response of the API server.
+
+    Returns:
+        offset (float): Seconds to add to the local time to get the server's
+            (to within a second), 0 if the response has no Date header.
+    """
+    date = (getattr(resp, "headers", None) or {}).get("Date")
+    if not date:
+        return 0
+    try:
+        server_time = email.utils.parsedate_to_datetime(date).timestamp()
+    except (TypeError, ValueError):
+        return 0
+    return server_time - time.time()
+
+
+class LogFollower:
+    """
+    A class for following the logs of running Kubernetes Pods to files.
+
+    Each pod's log is followed (follow=True) in a bounded thread pool from
+    the moment the pod is Running, and written incrementally to its own
+    file. If the stream drops before the pod has terminated, it is resumed
+    with backoff: lines are requested again from RESUME_MARGIN seconds
+    before the last timestamp written, and the replayed lines are skipped
+    (those older than that timestamp, and as many at it as were written), so
+    none are duplicated. Lines sharing a timestamp are all kept. The window
+    is measured from the line's timestamp on the API server's clock (from
+    its Date header), so neither a skewed local clock nor a lagging stream
+    loses lines.
+
+    Pods beyond max_workers wait for a free worker, then read their log
+    from the start.
+
+    Attributes:
+        RESUME_MARGIN (int): Seconds requested again before the last
+            timestamp written when resuming a stream.
+        logdir (str): Directory of pod logs.
+        compress (bool): Whether to gzip compress the logs.
+    """
+    RESUME_MARGIN = 60
+
+    def __init__(
+        self, logdir, max_workers = 16, compress = False, tail_lines = 100,
+        tail_bytes = 65536, backoff_max = 30
+    ):
+        """
+        Init with log directory and pool size.
+
+        Args:
+            logdir (str): Directory of pod logs.
+            max_workers (int): Maximum number of concurrent streams. A
+                stream lasts until its pod terminates, so pods beyond this
+                are only followed once earlier ones have finished.
+            compress (bool): Whether to gzip compress the logs.
+            tail_lines (int): Maximum number of lines kept for console.
+            tail_bytes (int): Maximum number of bytes kept for console.
+            backoff_max (int): Maximum seconds between reconnects.
+        """
+        self.logdir = logdir
+        self.compress = compress
+        self._tail_lines = tail_lines
+        self._tail_bytes = tail_bytes
+        self._backoff_max = backoff_max
+        self._futures = {}
+        self._stops = {}
+        self._resps = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = max(1, max_workers),
+            thread_name_prefix = "thread.follow",
+        )
+
+    def on_pod(self, event_type, pod):
+        """
+        Informer handler: follow a pod's log once it is Running.
+
+        Args:
+            event_type (str): ADDED, MODIFIED or DELETED.
+            pod (V1Pod): Changed pod.
+
+        Returns:
+            None
+        """
+        if (
+            event_type != "DELETED"
+            and pod.status
+            and pod.status.phase in ("Running", "Succeeded", "Failed")
+        ):
+            self.follow(pod.metadata.name, pod.metadata.namespace or "default")
+        return None
+
+    def follow(self, pod_name, namespace = "default"):
+        """
+        Start following a pod's log, if not already followed.
+
+        Args:
+            pod_name (str): Name of the pod.
+            namespace (str): Namespace of the pod.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if pod_name not in self._futures and not self._stopped.is_set():
+                self._stops[pod_name] = threading.Event()
+                self._futures[pod_name] = self._executor.submit(
+                    self._follow, pod_name, namespace, self._stops[pod_name]
+                )
+        return None
+
+    def _follow(self, pod_name, namespace, stop):
+        """Follow a pod's log to its file until the pod terminates."""
+        if stop.is_set():
+            return None  # Queued before stop(), keep the log saved since
+        filename = get_log_filename(self.logdir, pod_name, self.compress)
+        tail = LogTail(self._tail_lines, self._tail_bytes)
+        core = kubejobs.get_core_api()
+        # Last timestamp written, and the number of lines written at it
+        last = {"key": None, "count": 0, "ts": None}
+        clock_offset = 0
+        backoff = 1
+
+        def _write(f, line, replay):
+            key = get_ts_key(line)
+            if replay["key"] is not None:
+                if key < replay["key"]:
+                    return None  # Already written
+                if key == replay["key"] and replay["count"]:
+                    replay["count"] -= 1
+                    return None  # Already written
+                replay["key"] = None  # Caught up, the rest is new
+            if key == last["key"]:
+                last["count"] += 1
+            else:
+                last["key"] = key
+                last["count"] = 1
+                last["ts"] = get_ts(line) or last["ts"]
+            msg = line.split(b" ", 1)[-1] + b"\n"
+            f.write(msg)
+            tail.feed(msg)
+            return None
+
+        with open_log(filename, "wb", self.compress) as f:
+            while not stop.is_set():
+                kw_params = {}
+                if last["ts"] is not None:
+                    kw_params["since_seconds"] = max(
+                        0, math.ceil(time.time() + clock_offset - last["ts"])
+                    ) + self.RESUME_MARGIN
+                # Lines replayed by a resumed stream, skipped
+                replay = {"key": last["key"], "count": last["count"]}
+                try:
+                    resp = core.read_namespaced_pod_log(
+                        pod_name,
+                        namespace,
+                        follow = True,
+                        timestamps = True,
+                        _preload_content = False,
+                        **kw_params
+                    )
+                    clock_offset = get_clock_offset(resp)
+                    with self._lock:
+                        self._resps[pod_name] = resp
+                    try:
+                        partial = b""
+                        for chunk in resp.stream(65536):
+                            lines = (partial + chunk).split(b"\n")
+                            partial = lines.pop()
+                            for line in lines:
+                                _write(f, line, replay)
+                            f.flush()
+                            backoff = 1
+                        if partial:
+                            _write(f, partial, replay)
+                    finally:
+                        with self._lock:
+                            self._resps.pop(pod_name, None)
+                        resp.release_conn()
+                    if stop.is_set():
+                        break
+                    pod = kubejobs.get_pod(pod_name, namespace)
+                    if pod.status.phase in ("Succeeded", "Failed"):
+                        break
+                except (ApiException, urllib3.exceptions.HTTPError, OSError) as err:
+                    if isinstance(err, ApiException) and err.status == 404:
+                        break  # Pod deleted
+                    if stop.is_set():
+                        break
+                    logger.warning("Log stream dropped: {0}: {1}".format(
+                        pod_name, err
+                    ))
+                stop.wait(backoff)
+                backoff = min(backoff * 2, self._backoff_max)
+        return (filename, tail.get())
+
+    def get_result(self, pod_name, timeout = None):
+        """
+        Get the followed log of a pod.
+
+        Args:
+            pod_name (str): Name of the pod.
+            timeout (float): Maximum seconds to wait for the pod's stream to
+                end.
+
+        Returns:
+            result (tuple or None): (filename, tail) of the pod log, or None
+                if the pod was not followed, its stream did not end or it
+                was cancelled by stop().
+        """
+        with self._lock:
+            future = self._futures.get(pod_name)
+        if future is None:
+            return None
+        try:
+            result = future.result(timeout)
+        except (concurrent.futures.CancelledError, concurrent.futures.TimeoutError):
+            result = None
+        except Exception as err:
+            logger.error("Failed to follow pod log: {0}: {1}".format(
+                pod_name, err
+            ))
+            result = None
+        return result
+
+    def _cancel(self, pod_name):
+        """Stop following a pod's log, ending its stream in progress."""
+        self._stops[pod_name].set()
+        resp = self._resps.get(pod_name)
+        if resp is not None:
+            # Unblocks a read in the follow thread (urllib3 2.3+)
+            getattr(resp, "shutdown", resp.close)()
+        self._futures[pod_name].cancel()
+        return None
+
+    def cancel(self, pod_name, timeout = None):
+        """
+        Stop following a pod's log and wait for its file to be closed.
+
+        Args:
+            pod_name (str): Name of the pod.
+            timeout (float): Maximum seconds to wait.
+
+        Returns:
+            closed (bool): Whether the pod's log file is closed (or was not
+                followed), so it can be written again.
+        """
+        with self._lock:
+            future = self._futures.get(pod_name)
+            if future is None:
+                return True
+            self._cancel(pod_name)
+        (done, _) = concurrent.futures.wait([future], timeout)
+        return bool(done)
+
+    def stop(self):
+        """Stop following, ending streams in progress, leaving partial logs on disk."""
+        with self._lock:
+            self._stopped.set()
+            for pod_name in self._futures:
+                self._cancel(pod_name)
+        self._executor.shutdown(wait = False, cancel_futures = True)
+        return None
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+"""
+This module implements an image pre-pull stage before the timed run.
+
+A short-lived pod is created on each selected node with the containers'
+images of the rendered job template (imagePullPolicy: Always) and a no-op
+command. Once the kubelet has pulled the image the pod is deleted. At most
+max_in_flight nodes pull at any one time, so the registry is not hit by
+every node at the same moment. The jobs can then run with IfNotPresent
+(see kubejobs.get_dict_from_yaml) and start from the cached image.
+
+"""
+
+import concurrent.futures
+import logging
+import time
+
+import kubernetes.watch as watch
+from kubernetes.client.rest import ApiException
+
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+# Container waiting reasons of a failed pull
+PULL_FAILED_REASONS = (
+    "ErrImagePull",
+    "ImagePullBackOff",
+    "InvalidImageName",
+    "ErrImageNeverPull",
+)
+
+# Container waiting reasons before the image is on the node
+PULL_PENDING_REASONS = (
+    "ContainerCreating",
+    "PodInitializing",
+)
+
+
+def get_prepull_pod(worker_yaml, node, log_id, command = ("/bin/sh", "-c", "exit 0")):
+    """
+    Get a pod that pulls the images of a job on a node.
+
+    The pod is bound to the node directly (nodeName), so it does not wait
+    for the scheduler, and keeps the job's image pull secrets and
+    tolerations.
+
+    Args:
+        worker_yaml (dict): Dictionary of the job YAML.
+        node (str): Name of the node.
+        log_id (str): log_id (unique ID) of run.
+        command (tuple): No-op command run once the image is pulled.
+
+    Returns:
+        pod (dict): Dictionary of the pod YAML.
+    """
+    pod_spec = worker_yaml["spec"]["template"]["spec"]
+    containers = []
+    for container in list(pod_spec.get("initContainers") or []) + list(pod_spec["containers"]):
+        containers.append({
+            "name": "pull-{0}".format(len(containers)),
+            "image": container["image"],
+            "imagePullPolicy": "Always",
+            "command": list(command),
+        })
+    spec = {
+        "nodeName": node,
+        "restartPolicy": "Never",
+        "terminationGracePeriodSeconds": 0,
+        "containers": containers,
+    }
+    for key in ("imagePullSecrets", "tolerations"):
+        if pod_spec.get(key):
+            spec[key] = pod_spec[key]
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "generateName": "prepull-{0}-".format(node),
+            "labels": {"prepull-id": log_id},
+        },
+        "spec": spec,
+    }
+
+
+def get_pull_status(pod):
+    """
+    Get the image pull status of a pre-pull pod.
+
+    Args:
+        pod (V1Pod): Pre-pull pod.
+
+    Returns:
+        tuple(
+            pulled (bool): Whether all images are on the node.
+            reason (str or None): Waiting reason of a failed pull.
+        )
+    """
+    statuses = (pod.status.container_statuses or []) if pod.status else []
+    if pod.status and pod.status.phase in ("Succeeded", "Failed") and statuses:
+        return (True, None)
+    if not statuses:
+        return (False, None)
+    pulled = True
+    for cs in statuses:
+        waiting = cs.state.waiting if cs.state else None
+        if waiting is None:
+            continue
+        if waiting.reason in PULL_FAILED_REASONS:
+            return (False, "{0}: {1}".format(waiting.reason, waiting.message))
+        if waiting.reason in PULL_PENDING_REASONS or not cs.image_id:
+            pulled = False
+    return (pulled, None)
+
+
+def prepull_node(worker_yaml, node, log_id, timeout = 600, namespace = "default"):
+    """
+    Pull the images of a job on a node, and wait until they are there.
+
+    Args:
+        worker_yaml (dict): Dictionary of the job YAML.
+        node (str): Name of the node.
+        log_id (str): log_id (unique ID) of run.
+        timeout (int): Maximum seconds to wait for the pull.
+        namespace (str): Namespace of the pre-pull pod.
+
+    Returns:
+        seconds (float): Duration of the pull.
+
+    Raises:
+        RuntimeError: Image pull failed on the node.
+        RuntimeError: Image not pulled on the node within timeout.
+        ApiException: An error occured creating or watching the pod.
+    """
+    core = kubejobs.get_core_api()
+    time_start = time.monotonic()
+    pod = core.create_namespaced_pod(
+        namespace,
+        get_prepull_pod(worker_yaml, node, log_id),
+        _request_timeout = kubejobs.get_request_timeout(),
+    )
+    name = pod.metadata.name
+    try:
+        (pulled, reason) = get_pull_status(pod)
+        resource_version = pod.metadata.resource_version
+        w = watch.Watch()
+        while not pulled and not reason:
+            time_remaining = timeout - (time.monotonic() - time_start)
+            if time_remaining <= 0:
+                raise RuntimeError("Image Pre-pull Timeout", node)
+            for event in w.stream(
+                core.list_namespaced_pod,
+                namespace,
+                field_selector = "metadata.name={0}".format(name),
+                resource_version = resource_version,
+                timeout_seconds = max(1, int(time_remaining)),
+                _request_timeout = kubejobs.get_request_timeout(int(time_remaining)),
+            ):
+                pod = event["object"]
+                resource_version = pod.metadata.resource_version
+                (pulled, reason) = get_pull_status(pod)
+                if pulled or reason:
+                    w.stop()
+                    break
+        if reason:
+            raise RuntimeError("Image Pre-pull Failed", node, reason)
+    finally:
+        try:
+            core.delete_namespaced_pod(
+                name,
+                namespace,
+                grace_period_seconds = 0,
+                _request_timeout = kubejobs.get_request_timeout(),
+            )
+        except ApiException as err:
+            if err.status != 404:
+                logger.warning("Failed to delete pre-pull pod: {0}: {1}".format(
+                    name, err.reason
+                ))
+    return time.monotonic() - time_start
+
+
+def prepull(
+    tmpl, task, nodes, log_id, image, max_in_flight = 16, timeout = 600,
+    namespace = "default"
+):
+    """
+    Pull the images of a task on worker nodes before the run.
+
+    Args:
+        tmpl (str): Filename of YAML template.
+        task (str): Job task to run (e.g. runxhpl).
+        nodes (list): Names of worker nodes.
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker nodes.
+        max_in_flight (int): Maximum number of nodes pulling at once.
+        timeout (int): Maximum seconds to wait for each node's pull.
+        namespace (str): Namespace of the pre-pull pods.
+
+    Returns:
+        tuple(
+            durations (dict): Pull seconds, keyed by node name.
+            errors (dict): Pull exceptions, keyed by node name.
+        )
+    """
+    durations = {}
+    errors = {}
+    if not nodes:
+        return (durations, errors)
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers = max(1, min(max_in_flight, len(nodes))),
+        thread_name_prefix = "thread.prepull",
+    ) as executor:
+        futures = {
+            executor.submit(
+                prepull_node,
+                kubejobs.get_dict_from_yaml(task, node, tmpl, log_id, image),
+                node,
+                log_id,
+                timeout,
+                namespace,
+            ): node
+            for node in nodes
+        }
+        for future in concurrent.futures.as_completed(futures):
+            node = futures[future]
+            try:
+                durations[node] = future.result()
+            except Exception as err:
+                logger.error("Failed to pre-pull image: {0}: {1}".format(node, err))
+                errors[node] = err
+    return (durations, errors)
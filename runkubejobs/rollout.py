@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""
+This module implements a wave-based rollout scheduler for worker jobs.
+
+Instead of sending every create to the API server and scheduler in one
+burst, the nodes are split into waves: a fixed number of nodes, a
+percentage of the nodes, or one wave per value of a node label (e.g. a rack
+or zone). Each wave is spawned concurrently (see kubejobs.spawn_workers),
+then the scheduler waits on a readiness gate, until every pod of the wave
+is Running, before the next wave starts.
+
+"""
+
+import collections
+import logging
+import math
+import time
+
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+
+def get_waves(nodes, size = None, percent = None, label = None, inventory = None):
+    """
+    Split nodes into rollout waves.
+
+    Args:
+        nodes (list): Names of worker nodes.
+        size (int): Number of nodes per wave.
+        percent (float): Percentage of nodes per wave.
+        label (str): Node label to group waves by (e.g.
+            topology.kubernetes.io/zone). Needs inventory.
+        inventory (NodeInventory): Node inventory, for node labels.
+
+    Returns:
+        waves (list): List of node lists. A single wave if no option is set.
+    """
+    if label:
+        groups = collections.OrderedDict()
+        for node in nodes:
+            obj = inventory.get(node) if inventory is not None else None
+            labels = (obj.metadata.labels or {}) if obj is not None else {}
+            groups.setdefault(labels.get(label, ""), []).append(node)
+        return [groups[key] for key in sorted(groups)]
+    if percent:
+        size = max(1, math.ceil(len(nodes) * percent / 100))
+    if not size:
+        return [list(nodes)] if nodes else []
+    return [list(nodes[i:i + size]) for i in range(0, len(nodes), size)]
+
+
+def rollout(
+    tmpl, task, waves, log_id, image, max_in_flight = 16, inventory = None,
+    cache = None, gate_timeout = 300, gate_check = None, replace = True,
+    namespace = "default", pull_policy = None, barrier = False,
+    propagation_policy = "Foreground"
+):
+    """
+    Spawn Kubernetes jobs on worker nodes, wave by wave.
+
+    After each wave is spawned, wait for all of its pods to be Running
+    before starting the next wave. The last wave is not gated. If a wave
+    fails its gate, the remaining waves are not started and their nodes are
+    reported as errors.
+
+    Args:
+        tmpl (str): Filename of YAML template.
+        task (str): Job task to run (e.g. runxhpl).
+        waves (list): List of node lists, see get_waves.
+        log_id (str): log_id (unique ID) of run.
+        image (str): Docker image to run on worker nodes.
+        max_in_flight (int): Maximum number of concurrent spawns.
+        inventory (NodeInventory): Node inventory, to re-check readiness.
+        cache (JobCache): Informer cache of the group, for the gate.
+        gate_timeout (int): Maximum seconds to wait for a wave's pods.
+        gate_check (function): Callable taking a V1Pod, returning whether it
+            passes the gate. If None, the pod must be Running (or done).
+        replace (bool): Look up and delete an existing job of each node
+            first. Not needed after kubejobs.sweep_jobs.
+        namespace (str): Namespace of the jobs.
+        pull_policy (str): imagePullPolicy of all containers, None to keep
+            the template's.
+        barrier (bool): Whether to add a start barrier.
+        propagation_policy (str): Propagation policy of replaced jobs'
+            deletes.
+
+    Returns:
+        tuple(
+            workers (dict): kubeJob instances, keyed by node name.
+            errors (dict): Spawn exceptions, keyed by node name.
+            latencies (dict): Spawn latency in seconds, keyed by node name.
+            wave_stats (list): Per-wave dict of nodes, spawn and gate
+                seconds.
+        )
+    """
+    workers = {}
+    errors = {}
+    latencies = {}
+    wave_stats = []
+    for i, wave in enumerate(waves):
+        logger.info("Starting wave {0}/{1}: {2} nodes".format(
+            i + 1, len(waves), len(wave)
+        ))
+        time_start = time.monotonic()
+        (wave_workers, wave_errors, wave_latencies) = kubejobs.spawn_workers(
+            tmpl, task, wave, log_id, image, max_in_flight, inventory,
+            replace = replace,
+            namespace = namespace,
+            pull_policy = pull_policy,
+            barrier = barrier,
+            propagation_policy = propagation_policy,
+        )
+        workers.update(wave_workers)
+        errors.update(wave_errors)
+        latencies.update(wave_latencies)
+        time_spawn = time.monotonic() - time_start
+
+        pending = []
+        if cache is not None and i < len(waves) - 1 and not wave_errors:
+            pending = cache.wait_for_pods(
+                ["{0}-{1}".format(task, node) for node in wave_workers],
+                timeout = gate_timeout,
+                check = gate_check,
+            )
+        wave_stats.append({
+            "wave": i + 1,
+            "nodes": len(wave),
+            "spawn": time_spawn,
+            "gate": time.monotonic() - time_start - time_spawn,
+        })
+        if wave_errors or pending:
+            if pending:
+                err = RuntimeError("Wave Gate Timeout", sorted(pending))
+                logger.error(err)
+            for wave_ in waves[i + 1:]:
+                for node in wave_:
+                    errors[node] = RuntimeError("Wave Not Started", node)
+            break
+    return (workers, errors, latencies, wave_stats)
+
+
+def get_wave_summary(wave_stats):
+    """
+    Summarise per-wave latency for logging.
+
+    Args:
+        wave_stats (list): Per-wave stats from rollout.
+
+    Returns:
+        lines (list): One summary line per wave.
+    """
+    lines = []
+    for stats in wave_stats:
+        lines.append(
+            "wave {wave}: nodes: {nodes}, spawn: {spawn:.2f}s, "
+            "gate: {gate:.2f}s".format(**stats)
+        )
+    return lines
@@ -0,0 +1,983 @@
+#!/usr/bin/env python3
+
+"""
+This module implements the runs of the command-line interface.
+
+It is imported once the command line has been parsed (see cli.main), so
+--help, --version and submitting a run to the daemon do not load the
+Kubernetes client.
+
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import datetime
+import functools
+import importlib.resources
+import io
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+import kubernetes.config as config
+import kubernetes.client as client
+
+from engcommon import clihelper
+from engcommon import ini
+from engcommon.constants import _const as CONSTANTS
+from runkubejobs import barrier
+from runkubejobs import cli
+from runkubejobs import confcache
+from runkubejobs import daemon
+from runkubejobs import deadlines
+from runkubejobs import inventory
+from runkubejobs import kubejobs
+from runkubejobs import metrics
+from runkubejobs import multiplex
+from runkubejobs import podlogs
+from runkubejobs import prepull
+from runkubejobs import rollout
+from runkubejobs import timeline
+
+# Messages of the RuntimeErrors of a node failure, as opposed to an error
+NODE_FAILURES = frozenset([
+    "Pod Failed",
+    "Job Failed",
+]) | frozenset(deadlines.TIMEOUT_MESSAGES.values())
+
+
+def get_pod_logger(my_cli):
+    """
+    Get logger for writing pod logs to the console without timestamps.
+
+    Args:
+        my_cli (CLI): CLI helper with default and "noformat" loggers.
+
+    Returns:
+        logger_noformat (Logger): Logger with no timestamp prefixes.
+    """
+    logger = my_cli.logger
+    logger_noformat = my_cli.logger_noformat
+    if any(h.get_name() == "console" for h in logger_noformat.handlers):
+        return logger_noformat
+    # Add handler to write failed pod logs to "console" with "noformat"
+    kh = logging.StreamHandler(logger.handlers[1].stream)  # console
+    kh.setFormatter(logger_noformat.handlers[0].formatter)  # noformat
+    kh.setLevel(logging.DEBUG)
+    kh.set_name("console")
+    logger_noformat.addHandler(kh)
+    return logger_noformat
+
+
+def log_failed_pod(logger_noformat, pod_name, result):
+    """
+    Log the tail of the log of a failed pod with a banner.
+
+    Args:
+        logger_noformat (Logger): Logger with no timestamp prefixes.
+        pod_name (str): Name of the pod.
+        result (tuple or Exception): (filename, tail) of the saved pod log,
+            or the exception raised saving it.
+
+    Returns:
+        None
+    """
+    logger_noformat.debug("\n{0}".format(
+        (
+            " Failed pod log: "
+            + pod_name
+            + " "
+        ).center(80, "*")
+    ))
+    if isinstance(result, Exception):
+        logger_noformat.debug("Failed to save pod log: {0}".format(result))
+    else:
+        (filename, tail) = result
+        logger_noformat.debug(tail)
+        logger_noformat.debug("Full pod log: {0}".format(filename))
+    return None
+
+
+def raise_queued_exc(q_exc, logger):
+    """
+    Re-raise the first exception passed from a child thread or coroutine.
+
+    Args:
+        q_exc (Queue): Queue of exceptions (sys.exc_info).
+        logger (Logger): Logger default.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: The queued exception, with its original traceback.
+    """
+    if not q_exc.empty():
+        exc_type, exc_obj, exc_tb = q_exc.get()
+        exc = "".join(traceback.format_exception(exc_type, exc_obj, exc_tb))
+        try:
+            raise exc_type(exc)
+        except exc_type:
+            logger.error(exc)
+            raise
+    return None
+
+
+def get_exit_code(q_exc, failed_jobs, failure_policy):
+    """
+    Get the exit code of a finished run.
+
+    The queued exceptions are left on the queue.
+
+    Args:
+        q_exc (Queue): Queue of exceptions (sys.exc_info).
+        failed_jobs (list): Names of the failed jobs of the group.
+        failure_policy (str): fail-fast or continue.
+
+    Returns:
+        exit_code (int): cli.EXIT_OK if nothing failed, cli.EXIT_ERROR on any
+            error other than a node failure, else cli.EXIT_FAIL_FAST or
+            cli.EXIT_NODES_FAILED by failure policy.
+    """
+    exc_infos = []
+    while not q_exc.empty():
+        exc_infos.append(q_exc.get())
+    for exc_info in exc_infos:
+        q_exc.put(exc_info)
+    for (exc_type, exc_obj, exc_tb) in exc_infos:
+        if not (
+            isinstance(exc_obj, RuntimeError)
+            and exc_obj.args
+            and exc_obj.args[0] in NODE_FAILURES
+        ):
+            return cli.EXIT_ERROR
+    if not exc_infos and not failed_jobs:
+        return cli.EXIT_OK
+    return cli.EXIT_NODES_FAILED if failure_policy == "continue" else cli.EXIT_FAIL_FAST
+
+
+def run_async(d, my_cli, kubeconfig, group, nodes):
+    """
+    Run package with the asyncio engine.
+
+    Args:
+        d (dict): Dict of command-line options.
+        my_cli (CLI): CLI helper.
+        kubeconfig (str): Filename of kubeconfig.
+        group (TaskGroup): Task group, the only one of the run.
+        nodes (list): Names of worker nodes.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: An error occured in the run.
+    """
+    from runkubejobs import aiokubejobs
+
+    logger = my_cli.logger
+    logger_noformat = get_pod_logger(my_cli)
+    if d["follow_logs"]:
+        logger.warning("--follow-logs is not supported by the async engine")
+    if d["indexed"]:
+        logger.warning("--indexed is not supported by the async engine")
+    if d["barrier"]:
+        logger.warning("--barrier is not supported by the async engine")
+    if d["failure_policy"] != "fail-fast":
+        logger.warning("--failure-policy is not supported by the async engine")
+    timeouts = deadlines.get_timeouts(
+        group.task,
+        task_overrides = get_task_timeouts(d, group),
+        pending = d["pending_timeout"],
+    )
+    try:
+        q_exc = asyncio.run(aiokubejobs.run(
+            kubeconfig,
+            group.tmpl,
+            group.task,
+            nodes,
+            my_cli.log_id,
+            group.image,
+            max_in_flight = d["max_in_flight"],
+            pool_maxsize = max(d["api_pool_size"], d["max_in_flight"]),
+            log_opts = get_log_opts(d, my_cli.log_id),
+            log_pod = functools.partial(log_failed_pod, logger_noformat),
+            pull_policy = group.pull_policy,
+            propagation_policy = group.propagation_policy,
+            pending_timeout = timeouts["pending"],
+        ))
+    except KeyboardInterrupt:
+        logger.info("CTRL-C receved")
+        sys.exit(cli.EXIT_ERROR)
+    my_cli.print_logdir()
+    raise_queued_exc(q_exc, logger)
+    return None
+
+
+def get_log_opts(d, log_id):
+    """
+    Get pod log collection options.
+
+    Args:
+        d (dict): Dict of command-line options.
+        log_id (str): log_id (unique ID) of run.
+
+    Returns:
+        log_opts (dict): Parameters of podlogs.save_pod_log.
+    """
+    log_opts = {
+        "logdir": os.path.join(d["prefix"], log_id, "pods"),
+        "compress": d["log_compress"],
+        "tail_lines": d["log_tail_lines"],
+        "tail_bytes": d["log_tail_bytes"],
+    }
+    return log_opts
+
+
+def clean_up(group, my_cli, d, follower = None, trace_name = "trace.json"):
+    """
+    Clean up the Kubernetes jobs of a task group on worker nodes.
+
+    The group's jobs, except failed ones, are deleted with one collection
+    delete by task/log-id labels. Jobs still running (e.g. after a fail-fast
+    failure), neither succeeded nor failed, are cancelled by this delete;
+    the partial logs of their pods are saved first. Logs of failed pods are
+    streamed concurrently to files under the prefix directory, and their
+    tails are written to the console. Logs already followed live are not
+    fetched again; a follow whose stream has not ended is cancelled first,
+    so its file is fetched again once closed.
+
+    Args:
+        group (TaskGroup): Task group, with its KubeJob instances (keyed by
+            node name), informer cache and phase timeline. The timeline is
+            written as a Chrome trace to PREFIX/LOGID/trace_name.
+        my_cli (CLI): CLI helper with default and "noformat" loggers.
+        d (dict): Dict of command-line options.
+        follower (LogFollower): Live log follower of the group's pods.
+        trace_name (str): Filename of the trace.
+
+    Returns:
+        None
+    """
+    logger = my_cli.logger
+    logger_noformat = get_pod_logger(my_cli)
+    logger.info("Cleaning up: {0}".format(group.name))
+    group.cleaned = True
+    workers = group.workers
+    cache = group.cache
+
+    failed_pods = []
+    failed_jobs = []
+    running_pods = []
+    for node, kjobs in workers.items():
+        j = kjobs.job
+        pods = []
+        if cache is not None:
+            j = cache.get_job(j.metadata.name) or j
+            pods = cache.pods.get_by_index(j.metadata.name)
+        if not pods:
+            pods = kubejobs.get_pods(j)
+        if j.spec and j.spec.completion_mode == "Indexed":
+            index_nodes = kubejobs.get_index_nodes(pods)
+            for index, node_name in sorted(index_nodes.items()):
+                logger.info("Index {0} ran on node {1}".format(index, node_name))
+        if j.status:
+            failed = [
+                p.metadata.name for p in pods
+                if p.status and p.status.phase == "Failed"
+            ]
+            if j.status.failed and not failed:
+                failed = [p.metadata.name for p in pods]
+            if failed:
+                failed_pods.extend(failed)
+                failed_jobs.append(j.metadata.name)
+                continue
+        if kubejobs.get_job_status(j) == "Succeeded":
+            continue  # Finished, though the cache may still show it Running
+        running_pods.extend(
+            p.metadata.name for p in pods
+            if p.status and p.status.phase == "Running"
+        )
+
+    log_opts = dict(get_log_opts(d, my_cli.log_id), namespace = group.namespace)
+    if running_pods:
+        logger.info("Cancelling {0} running pods".format(len(running_pods)))
+        if follower is None:
+            saved = podlogs.save_pod_logs(
+                running_pods,
+                max_workers = d["max_in_flight"],
+                **log_opts
+            )
+            failed_saves = sorted(
+                pod_name for pod_name, result in saved.items()
+                if isinstance(result, Exception)
+            )
+            logger.info("Saved partial logs of {0}/{1} running pods".format(
+                len(running_pods) - len(failed_saves), len(running_pods)
+            ))
+            if failed_saves:
+                logger.error("Failed to save partial logs of pods: {0}".format(
+                    ", ".join(failed_saves)
+                ))
+    if len(failed_jobs) < len(workers):
+        kubejobs.delete_jobs(
+            kubejobs.get_group_selector(
+                group.task,
+                my_cli.log_id,
+                exclude = failed_jobs,
+            ),
+            group.namespace,
+            group.propagation_policy,
+        )
+
+    results = {}
+    if follower is not None:
+        for pod_name in failed_pods:
+            result = follower.get_result(pod_name, timeout = 30)
+            if result is not None:
+                results[pod_name] = result
+            elif not follower.cancel(pod_name, timeout = 10):
+                # Still writing its file, not fetched again into it
+                results[pod_name] = RuntimeError("Log Follow Not Stopped", pod_name)
+
+    results.update(podlogs.save_pod_logs(
+        [pod_name for pod_name in failed_pods if pod_name not in results],
+        max_workers = d["max_in_flight"],
+        **log_opts
+    ))
+    for pod_name in failed_pods:
+        log_failed_pod(logger_noformat, pod_name, results[pod_name])
+
+    if group.timeline is not None:
+        skew = group.timeline.get_start_skew()
+        if skew:
+            logger.info(
+                "Start skew across {nodes} nodes: p50: {p50:.2f}s, "
+                "p95: {p95:.2f}s, p99: {p99:.2f}s, max: {max:.2f}s".format(**skew)
+            )
+        filename = os.path.join(d["prefix"], my_cli.log_id, trace_name)
+        group.timeline.write_trace(filename)
+        logger.info("Timeline trace: {0}".format(filename))
+    return None
+
+
+def clean_up_groups(mux, my_cli, d, follower = None):
+    """
+    Clean up the task groups not cleaned up yet, at exit.
+
+    Args:
+        mux (Multiplexer): Multiplexer of the run's task groups.
+        my_cli (CLI): CLI helper.
+        d (dict): Dict of command-line options.
+        follower (LogFollower): Live log follower of the groups' pods.
+
+    Returns:
+        None
+    """
+    for group in mux.groups:
+        if group.deadlines is not None:
+            group.deadlines.stop()
+        if not getattr(group, "cleaned", False):
+            clean_up(group, my_cli, d, follower, get_trace_name(mux, group))
+    if follower is not None:
+        follower.stop()
+    my_cli.print_logdir()
+    return None
+
+
+def get_trace_name(mux, group):
+    """Get the trace filename of a task group: one per group if several."""
+    if len(mux.groups) == 1:
+        return "trace.json"
+    return "trace.{0}.{1}.json".format(group.namespace, group.task)
+
+
+def get_tmpl(task):
+    """Get the filename of the packaged YAML template of a task."""
+    return str(
+        importlib.resources.files(__package__) / "kube-job-tmpl-{0}.yaml".format(task)
+    )
+
+
+def get_task_timeouts(d, group):
+    """
+    Get the pod timeouts set for a task group (--task-timeout).
+
+    Timeouts set for the group's namespace override those set for its task
+    in all namespaces.
+
+    Args:
+        d (dict): Dict of command-line options.
+        group (TaskGroup): Task group.
+
+    Returns:
+        task_timeouts (dict): Seconds, keyed by pending, pull or run (see
+            deadlines.get_timeouts).
+    """
+    task_timeouts = {}
+    for namespace in (None, group.namespace):
+        for timeout in d["task_timeout"]:
+            if (timeout["task"], timeout["namespace"]) == (group.task, namespace):
+                task_timeouts[timeout["kind"]] = timeout["seconds"]
+    return task_timeouts
+
+
+def get_groups(d):
+    """
+    Get the task groups of a run.
+
+    The first group is the task (-t) in --namespace, with --tmpl and -i.
+    Each --group adds a task with its packaged template. All groups share
+    the run's job options: pre-pulled images are not pulled again, and the
+    barrier and propagation policy apply to every group.
+
+    Args:
+        d (dict): Dict of command-line options.
+
+    Returns:
+        groups (list): TaskGroups of the run.
+    """
+    job_opts = {
+        "pull_policy": "IfNotPresent" if d["prepull"] else None,
+        "barrier": d["barrier"],
+        "propagation_policy": d["propagation_policy"],
+    }
+    groups = [multiplex.TaskGroup(
+        d["task"],
+        d["namespace"],
+        d["tmpl"] or get_tmpl(d["task"]),
+        d["image"],
+        **job_opts
+    )]
+    for spec in d["group"]:
+        groups.append(multiplex.TaskGroup(
+            spec["task"],
+            spec["namespace"] or d["namespace"],
+            get_tmpl(spec["task"]),
+            spec["image"],
+            **job_opts
+        ))
+    return groups
+
+
+def start_group(group, d, log_id, nodes, node_inventory, logger):
+    """
+    Spawn the jobs of a task group, then release its start barrier.
+
+    Args:
+        group (TaskGroup): Task group.
+        d (dict): Dict of command-line options.
+        log_id (str): log_id (unique ID) of run.
+        nodes (list): Names of worker nodes.
+        node_inventory (NodeInventory): Node inventory.
+        logger (Logger): Logger default.
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: Spawn failed on some nodes.
+        RuntimeError: Pods did not reach the barrier (see barrier.wait).
+    """
+    time_start = time.monotonic()
+    wave_stats = []
+    if d["indexed"]:
+        (workers, errors, latencies) = kubejobs.spawn_indexed_job(
+            group.tmpl, group.task, nodes, log_id, group.image,
+            inventory = node_inventory,
+            replace = False,
+            namespace = group.namespace,
+            pull_policy = group.pull_policy,
+            barrier = group.barrier,
+            propagation_policy = group.propagation_policy,
+        )
+    else:
+        waves = rollout.get_waves(
+            nodes,
+            size = d["wave_size"],
+            percent = d["wave_percent"],
+            label = d["wave_label"],
+            inventory = node_inventory,
+        )
+        (workers, errors, latencies, wave_stats) = rollout.rollout(
+            group.tmpl, group.task, waves, log_id, group.image, d["max_in_flight"],
+            inventory = node_inventory,
+            cache = group.cache,
+            gate_timeout = d["wave_gate_timeout"],
+            gate_check = barrier.is_at_barrier if group.barrier else None,
+            replace = False,
+            namespace = group.namespace,
+            pull_policy = group.pull_policy,
+            barrier = group.barrier,
+            propagation_policy = group.propagation_policy,
+        )
+    group.workers = workers
+    logger.info("Spawned {0}/{1} workers of {2} in {3:.2f}s".format(
+        len(nodes) if d["indexed"] and workers else len(workers),
+        len(nodes),
+        group.name,
+        time.monotonic() - time_start,
+    ))
+    logger.info("Spawn latency: {0}".format(
+        kubejobs.get_latency_summary(latencies)
+    ))
+    if len(wave_stats) > 1:
+        for line in rollout.get_wave_summary(wave_stats):
+            logger.info("Rollout {0}".format(line))
+    if errors:
+        for node, err in sorted(errors.items()):
+            logger.error("Spawn failed on node {0}: {1}".format(node, err))
+        raise RuntimeError("Spawn Failed", group.name, sorted(errors))
+
+    if group.barrier:
+        pods = barrier.wait(group.cache, len(nodes), d["barrier_timeout"])
+        release_at = barrier.release(pods, d["barrier_lead"], d["max_in_flight"])
+        logger.info("Released barrier of {0} pods of {1} at {2}".format(
+            len(pods),
+            group.name,
+            datetime.datetime.fromtimestamp(release_at).isoformat(),
+        ))
+        pending = barrier.wait_for_start(group.cache, timeout = d["barrier_lead"] + 60)
+        if pending:
+            logger.warning("Pods not started after barrier: {0}".format(pending))
+        skew = group.timeline.get_start_skew()
+        if skew:
+            logger.info(
+                "Barrier start skew across {nodes} nodes: p50: {p50:.2f}s, "
+                "p95: {p95:.2f}s, p99: {p99:.2f}s, max: {max:.2f}s".format(**skew)
+            )
+    return None
+
+
+def finish_group(group, mux, my_cli, d, follower = None):
+    """
+    Report a finished task group and clean it up.
+
+    Args:
+        group (TaskGroup): Finished task group.
+        mux (Multiplexer): Multiplexer of the run's task groups.
+        my_cli (CLI): CLI helper.
+        d (dict): Dict of command-line options.
+        follower (LogFollower): Live log follower of the groups' pods.
+
+    Returns:
+        exit_code (int): Exit code of the group, see get_exit_code.
+    """
+    logger = my_cli.logger
+    group.deadlines.stop()
+    failed_jobs = group.cache.get_failed()
+    if d["failure_policy"] == "continue" and failed_jobs:
+        for name in failed_jobs:
+            logger.error("Job failed: {0}".format(name))
+        logger.error("{0}/{1} jobs of {2} failed".format(
+            len(failed_jobs), len(group.workers), group.name
+        ))
+    exit_code = get_exit_code(group.q_exc, failed_jobs, d["failure_policy"])
+    if exit_code != cli.EXIT_OK:
+        try:
+            raise_queued_exc(group.q_exc, logger)
+        except Exception:
+            pass  # Already logged, the group's exit code reports it
+    clean_up(group, my_cli, d, follower, get_trace_name(mux, group))
+    return exit_code
+
+
+class Session:
+    """
+    A class for the state shared by the runs of a process.
+
+    A single run sets it up once. The daemon (see daemon) keeps it warm
+    across runs, so they skip fetching the INI config, loading the
+    kubeconfig, opening API connections and listing the nodes. The INI
+    config's kubeconfig is also cached on disk across processes (see
+    confcache). The informers and event streams of a run's task groups are
+    not part of it (see multiplex.Multiplexer).
+
+    Attributes:
+        kubeconfig (str): Filename of kubeconfig.
+    """
+    def __init__(self, d):
+        """
+        Init with Kubernetes config and API client.
+
+        Args:
+            d (dict): Dict of command-line options (API pool size and
+                timeout, config TTL).
+        """
+        ini_url = CONSTANTS().INI_URL
+        self.kubeconfig = confcache.get_kubeconfig(
+            ini_url,
+            lambda: ini.INIConfig(ini_url).kubeconfig,
+            ttl = d["config_ttl"],
+        )
+        config.load_kube_config(self.kubeconfig)
+        kubejobs.configure_api_client(
+            pool_maxsize = max(d["api_pool_size"], d["max_in_flight"]),
+            request_timeout = d["api_timeout"],
+        )
+        self._inventories = {}  # label selector: NodeInventory
+        self._metrics_ports = set()
+        self._lock = threading.Lock()
+
+    def get_inventory(self, label_selector = None):
+        """
+        Get the node inventory of a label selector, started on first use.
+
+        Args:
+            label_selector (str): Node label selector.
+
+        Returns:
+            node_inventory (NodeInventory): Started node inventory.
+        """
+        with self._lock:
+            node_inventory = self._inventories.get(label_selector)
+            if node_inventory is None:
+                node_inventory = inventory.NodeInventory(label_selector)
+                node_inventory.start()
+                self._inventories[label_selector] = node_inventory
+        return node_inventory
+
+    def start_metrics_server(self, port):
+        """Serve metrics on a port, once per port."""
+        with self._lock:
+            if port not in self._metrics_ports:
+                metrics.start_http_server(port)
+                self._metrics_ports.add(port)
+        return None
+
+
+def close_loggers(my_cli):
+    """
+    Close and remove the handlers of a run's loggers (e.g. its log file), so
+    the next run in the process starts with its own.
+
+    Args:
+        my_cli (CLI): CLI helper with default and "noformat" loggers.
+
+    Returns:
+        None
+    """
+    for logger_ in (my_cli.logger, my_cli.logger_noformat):
+        for h in list(logger_.handlers):
+            logger_.removeHandler(h)
+            h.close()
+    return None
+
+
+def run(d, session = None, log_handler = None):
+    """
+    Run package.
+
+    Args:
+        d (dict): Dict of command-line options.
+        session (Session): State kept warm across runs (see daemon). A new
+            one for this run if None.
+        log_handler (Handler): Extra handler of the run's log records (e.g.
+            streaming them to a daemon client).
+
+    Returns:
+        None
+
+    Raises:
+        Exception: An error occured in the child event stream processing thread.
+    """
+    with contextlib.ExitStack() as cleanup:
+        run_session(d, session, cleanup, log_handler)
+    return None
+
+
+def run_session(d, session, cleanup, log_handler = None):
+    """
+    Run package in a session.
+
+    Args:
+        d (dict): Dict of command-line options.
+        session (Session): State kept warm across runs, None for a new one.
+        cleanup (ExitStack): Clean-up callbacks, called when the run exits
+            (including sys.exit).
+        log_handler (Handler): Extra handler of the run's log records.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: An error occured in the child event stream processing thread.
+    """
+    project_name = (os.path.dirname(__file__).split("/")[-1])
+    if d["debug_api"]:
+        d["debug"] = True
+        logging.getLogger(client.rest.__name__).setLevel(logging.DEBUG)
+    elif not d["debug_api"]:
+        logging.getLogger(client.rest.__name__).setLevel(logging.WARNING)
+
+    my_cli = clihelper.CLI(project_name, d)
+    log_id = my_cli.log_id
+    logger = my_cli.logger
+    if session is not None:
+        cleanup.callback(close_loggers, my_cli)
+    if log_handler is not None:
+        for logger_ in (logger, my_cli.logger_noformat):
+            logger_.addHandler(log_handler)
+            cleanup.callback(logger_.removeHandler, log_handler)
+    my_cli.print_versions()
+
+    # Setup Kubernetes config and API, unless kept warm
+    if session is None:
+        session = Session(d)
+
+    if d["metrics_port"] is not None:
+        session.start_metrics_server(d["metrics_port"])
+    if d["metrics_file"]:
+        stop_metrics = metrics.start_textfile_writer(d["metrics_file"])
+        cleanup.callback(metrics.write_textfile, d["metrics_file"])
+        cleanup.callback(stop_metrics.set)
+    q_watch = queue.Queue()  # Queue for event stream
+    q_exc = queue.Queue()  # Queue for thread exceptions
+
+    # Task groups of the run, all on the same nodes
+    requested_nodes = d["nodes"]
+    groups = get_groups(d)
+    if d["engine"] == "async" and (len(groups) > 1 or d["namespace"] != "default"):
+        logger.error("--group and --namespace are not supported by the async engine")
+        logger.info("Exiting.")
+        sys.exit(cli.EXIT_ERROR)
+    if d["engine"] == "async" and (
+        d["pull_timeout"] is not None
+        or d["run_timeout"] is not None
+        or any(timeout["kind"] != "pending" for timeout in d["task_timeout"])
+    ):
+        logger.error("Pull and run timeouts are not supported by the async engine")
+        logger.info("Exiting.")
+        sys.exit(cli.EXIT_ERROR)
+
+    try:
+        for group in groups:
+            kubejobs.check_template(group.tmpl, group.task, log_id, group.image)
+        node_inventory = session.get_inventory(d["node_selector"])
+        nodes = kubejobs.get_task_nodes(
+            requested_nodes,
+            node_inventory,
+            d["min_cpu"],
+            d["min_memory"],
+        )
+    except RuntimeError as err:
+        logger.exception(err)
+        logger.info("Exiting.")
+        sys.exit(cli.EXIT_ERROR)
+
+    if d["prepull"]:
+        for group in groups:
+            logger.info("Pre-pulling image of {0} on {1} nodes".format(
+                group.name, len(nodes)
+            ))
+            time_start = time.monotonic()
+            (durations, errors) = prepull.prepull(
+                group.tmpl, group.task, nodes, log_id, group.image, d["max_in_flight"],
+                timeout = d["prepull_timeout"],
+                namespace = group.namespace,
+            )
+            if errors:
+                for node, err in sorted(errors.items()):
+                    logger.error("Pre-pull failed on node {0}: {1}".format(node, err))
+                logger.info("Exiting.")
+                sys.exit(cli.EXIT_ERROR)
+            logger.info("Pre-pulled image in {0:.2f}s, pull: {1}".format(
+                time.monotonic() - time_start,
+                kubejobs.get_latency_summary(durations),
+            ))
+
+    # Stale jobs of the tasks on these nodes, removed in batches instead of
+    # node by node (the async engine has no indexed mode)
+    workers = nodes
+    if d["indexed"] and d["engine"] != "async":
+        workers = [kubejobs.INDEXED_WORKER]
+    try:
+        for group in groups:
+            kubejobs.sweep_jobs(
+                group.task,
+                workers,
+                namespace = group.namespace,
+                propagation_policy = group.propagation_policy,
+            )
+    except RuntimeError as err:
+        logger.exception(err)
+        logger.info("Exiting.")
+        sys.exit(cli.EXIT_ERROR)
+
+    if d["engine"] == "async":
+        run_async(d, my_cli, session.kubeconfig, groups[0], nodes)
+        return None
+
+    # Shared per-namespace event streams and informers feed the main thread
+    logger.info("Creating informer cache and Watch() threads")
+    fail_fast = d["failure_policy"] == "fail-fast"
+    mux = multiplex.Multiplexer(log_id, q_watch)
+    follower = None
+    if d["follow_logs"]:
+        # A follow lasts the whole run: one stream per pod keeps all live
+        follower = podlogs.LogFollower(
+            max_workers = d["max_follows"] or len(nodes) * len(groups),
+            **get_log_opts(d, log_id)
+        )
+
+    def _on_expire(group, pod_name, kind):
+        # Fail-fast: the group is done, the other groups carry on
+        if fail_fast:
+            mux.finish(group)
+            return None
+        # Continue: fail the timed out pod's job, keeping its partial log
+        pod = group.cache.pods.get(pod_name)
+        if pod is None:
+            return None
+        if kind == "run" and follower is None:
+            podlogs.save_pod_logs(
+                [pod_name],
+                namespace = group.namespace,
+                **get_log_opts(d, log_id)
+            )
+        kubejobs.cancel_job(pod.metadata.labels["job-group"], group.namespace)
+        return None
+
+    for group in groups:
+        mux.add_group(group, expected = 1 if d["indexed"] else len(nodes))
+        group.timeline = timeline.Timeline()
+        group.cache.jobs.add_handler(group.timeline.on_job)
+        group.cache.pods.add_handler(group.timeline.on_pod)
+        group.deadlines = deadlines.DeadlineScheduler(
+            q_watch,
+            group.q_exc,
+            deadlines.get_timeouts(
+                group.task,
+                task_overrides = get_task_timeouts(d, group),
+                pending = d["pending_timeout"],
+                pull = d["pull_timeout"],
+                run = d["run_timeout"],
+            ),
+            on_expire = functools.partial(_on_expire, group),
+        )
+        group.cache.pods.add_handler(group.deadlines.on_pod)
+        if follower is not None:
+            group.cache.pods.add_handler(follower.on_pod)
+        group.deadlines.start(name = "thread.deadlines.{0}.{1}".format(
+            group.namespace, group.task
+        ))
+    sources = mux.start()
+    cleanup.callback(mux.stop)
+
+    # Start main thread
+    m = threading.Thread(
+        target = mux.dispatch,
+        args = (q_exc, sources, fail_fast),
+        name = "thread.main",
+        daemon = True,
+    )
+    m.start()
+
+    # Register cleanup, then spawn the groups side by side
+    cleanup.callback(clean_up_groups, mux, my_cli, d, follower)
+    logger.info("Creating workers")
+    if d["indexed"] and (d["wave_size"] or d["wave_percent"] or d["wave_label"]):
+        logger.warning("Rollout waves are not supported with --indexed")
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers = len(groups),
+        thread_name_prefix = "thread.group",
+    ) as executor:
+        futures = [
+            executor.submit(start_group, group, d, log_id, nodes, node_inventory, logger)
+            for group in groups
+        ]
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as err:
+                logger.error(err)
+                errors.append(err)
+    if errors:
+        logger.info("Exiting.")
+        sys.exit(cli.EXIT_ERROR)
+
+    # Report and clean up each group as it finishes
+    exit_codes = []
+    try:
+        group = mux.q_done.get()
+        while group is not None:
+            exit_codes.append(finish_group(group, mux, my_cli, d, follower))
+            group = mux.q_done.get()
+        m.join()
+    except KeyboardInterrupt:
+        logger.info("CTRL-C receved")
+        sys.exit(cli.EXIT_ERROR)
+    mux.stop()
+    raise_queued_exc(q_exc, logger)
+    exit_code = cli.EXIT_ERROR if cli.EXIT_ERROR in exit_codes else max(exit_codes + [cli.EXIT_OK])
+    if exit_code != cli.EXIT_OK:
+        logger.info("Exiting.")
+        sys.exit(exit_code)
+    return None
+
+
+def run_submitted(session, args, log_handler):
+    """
+    Run a run submitted to the daemon.
+
+    Args:
+        session (Session): State kept warm across runs.
+        args (list): Command-line arguments of the run.
+        log_handler (Handler): Handler streaming the run's log records to
+            its client, and its usage errors (see daemon._StreamHandler).
+
+    Returns:
+        exit_code (int): Exit code of the run.
+    """
+    # Usage errors go to the client, not to the daemon's stderr
+    usage = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(usage), contextlib.redirect_stdout(usage):
+            d = cli.get_command(args)
+    except SystemExit as err:
+        log_handler.write({"log": usage.getvalue().rstrip("\n")})
+        return err.code if isinstance(err.code, int) else cli.EXIT_ERROR
+    if d["daemon"]:
+        logging.error("Run not submitted: --daemon")
+        return cli.EXIT_ERROR
+    kubejobs.get_template.cache_clear()  # Read edited templates again
+    try:
+        run(d, session, log_handler)
+    except SystemExit as err:
+        if err.code is None:
+            return cli.EXIT_OK
+        return err.code if isinstance(err.code, int) else cli.EXIT_ERROR
+    except Exception:
+        logging.exception("Exceptions Found")
+        return cli.EXIT_ERROR
+    return cli.EXIT_OK
+
+
+def serve(d):
+    """
+    Run package as a daemon, serving run submissions until interrupted.
+
+    Args:
+        d (dict): Dict of command-line options.
+
+    Returns:
+        None
+    """
+    logging.basicConfig(
+        level = logging.DEBUG if d["debug"] else logging.INFO,
+        format = "%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+    session = Session(d)
+    if d["metrics_port"] is not None:
+        session.start_metrics_server(d["metrics_port"])
+    try:
+        daemon.serve(functools.partial(run_submitted, session), d["daemon_socket"])
+    except KeyboardInterrupt:
+        logging.info("CTRL-C receved")
+    return None
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+"""
+This module implements a per-node phase timeline of a run.
+
+Kubernetes events (Scheduled, Pulling, Pulled, Started, ...) and pod/job
+status transitions are turned into timestamped marks per pod. Consecutive
+marks make the phases of each node: scheduling, image pull, container
+start, run and completion. The phases can be written as a Chrome trace
+(also readable by Perfetto), with one track per node, and the spread of
+container start times across nodes is summarised as start skew.
+
+Timestamps come from the API server where the objects carry them, so all
+nodes are on one clock.
+
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+
+from dateutil.tz import tzutc
+
+from runkubejobs import kubejobs
+
+logger = logging.getLogger(__name__)
+
+
+class Timeline:
+    """
+    A class for recording the phase timeline of a run's pods.
+
+    Attributes:
+        MARKS (tuple): Marks of a pod, in lifecycle order.
+        PHASES (tuple): (phase, start marks, end mark); the first start mark
+            present is used.
+    """
+    MARKS = (
+        "created", "scheduled", "pull_start", "pull_end", "started",
+        "finished", "completed",
+    )
+    PHASES = (
+        ("scheduling", ("created",), "scheduled"),
+        ("image pull", ("pull_start",), "pull_end"),
+        ("container start", ("pull_end", "scheduled"), "started"),
+        ("run", ("started",), "finished"),
+        ("completion", ("finished",), "completed"),
+    )
+    EVENT_MARKS = {
+        "Scheduled": "scheduled",
+        "Pulling": "pull_start",
+        "Pulled": "pull_end",
+        "Started": "started",
+    }
+    JOB_DONE_REASONS = ("Completed", "BackoffLimitExceeded", "DeadlineExceeded")
+
+    def __init__(self):
+        """Init with an empty timeline."""
+        self._pods = {}
+        self._lock = threading.Lock()
+
+    def _get_pod(self, pod_name):
+        """Get the record of a pod. Needs the lock."""
+        rec = self._pods.get(pod_name)
+        if rec is None:
+            rec = self._pods[pod_name] = {"node": None, "job": None, "marks": {}}
+        return rec
+
+    def mark(self, pod_name, mark, ts = None):
+        """
+        Record a mark of a pod, keeping the earliest time of each mark.
+
+        Args:
+            pod_name (str): Name of the pod.
+            mark (str): One of MARKS.
+            ts (datetime): Time of the mark, now if None.
+
+        Returns:
+            None
+        """
+        if ts is None:
+            ts = datetime.datetime.now(tzutc())
+        t = ts.timestamp()
+        with self._lock:
+            marks = self._get_pod(pod_name)["marks"]
+            if mark not in marks or t < marks[mark]:
+                marks[mark] = t
+        return None
+
+    def _mark_job(self, job_name, ts):
+        """Mark all pods of a job completed."""
+        with self._lock:
+            pod_names = [
+                name for name, rec in self._pods.items() if rec["job"] == job_name
+            ]
+        for pod_name in pod_names:
+            self.mark(pod_name, "completed", ts)
+        return None
+
+    def on_event(self, ev):
+        """
+        Record a mark from a Kubernetes event.
+
+        Args:
+            ev (V1Event): Kubernetes event.
+
+        Returns:
+            None
+        """
+        obj = ev.involved_object
+        ts = ev.event_time or ev.last_timestamp or ev.first_timestamp
+        if (obj.field_path or "").startswith("spec.initContainers"):
+            return None  # e.g. start barrier, not the task's containers
+        if obj.kind == "Pod" and ev.reason in self.EVENT_MARKS:
+            self.mark(obj.name, self.EVENT_MARKS[ev.reason], ts)
+        elif obj.kind == "Job" and ev.reason in self.JOB_DONE_REASONS:
+            self._mark_job(obj.name, ts)
+        return None
+
+    def on_pod(self, event_type, pod):
+        """
+        Informer handler: record marks from a pod's status.
+
+        Args:
+            event_type (str): ADDED, MODIFIED or DELETED.
+            pod (V1Pod): Changed pod.
+
+        Returns:
+            None
+        """
+        name = pod.metadata.name
+        with self._lock:
+            rec = self._get_pod(name)
+            rec["node"] = (pod.spec.node_name if pod.spec else None) or rec["node"]
+            rec["job"] = (pod.metadata.labels or {}).get("job-group") or rec["job"]
+        if pod.metadata.creation_timestamp:
+            self.mark(name, "created", pod.metadata.creation_timestamp)
+        status = pod.status
+        if status is None:
+            return None
+        for cond in status.conditions or []:
+            if cond.type == "PodScheduled" and cond.status == "True" and cond.last_transition_time:
+                self.mark(name, "scheduled", cond.last_transition_time)
+        for cs in status.container_statuses or []:
+            state = cs.state
+            if state is None:
+                continue
+            if state.running and state.running.started_at:
+                self.mark(name, "started", state.running.started_at)
+            if state.terminated:
+                if state.terminated.started_at:
+                    self.mark(name, "started", state.terminated.started_at)
+                if state.terminated.finished_at:
+                    self.mark(name, "finished", state.terminated.finished_at)
+        # Without container timestamps, fall back to when the phase was seen
+        if not status.container_statuses:
+            if status.phase == "Running":
+                self.mark(name, "started")
+            elif status.phase in ("Succeeded", "Failed"):
+                self.mark(name, "finished")
+        return None
+
+    def on_job(self, event_type, job):
+        """
+        Informer handler: mark a job's pods completed once it has finished.
+
+        Args:
+            event_type (str): ADDED, MODIFIED or DELETED.
+            job (V1Job): Changed job.
+
+        Returns:
+            None
+        """
+        if event_type != "DELETED" and kubejobs.get_job_status(job):
+            self._mark_job(
+                job.metadata.name,
+                job.status.completion_time if job.status else None,
+            )
+        return None
+
+    def get_spans(self):
+        """
+        Get the phases of every pod.
+
+        Returns:
+            spans (list): Dicts of node, pod, phase, start and end (seconds
+                since the epoch), sorted by node and start.
+        """
+        spans = []
+        with self._lock:
+            pods = [(name, dict(rec, marks = dict(rec["marks"]))) for name, rec in self._pods.items()]
+        for name, rec in pods:
+            marks = rec["marks"]
+            for (phase, start_marks, end_mark) in self.PHASES:
+                start = next((marks[m] for m in start_marks if m in marks), None)
+                end = marks.get(end_mark)
+                if start is None or end is None:
+                    continue
+                spans.append({
+                    "node": rec["node"] or name,
+                    "pod": name,
+                    "phase": phase,
+                    "start": start,
+                    "end": max(start, end),
+                })
+        spans.sort(key = lambda span: (span["node"], span["start"]))
+        return spans
+
+    def get_start_skew(self):
+        """
+        Get the spread of container start times across nodes.
+
+        Returns:
+            skew (dict or None): p50, p95, p99 and max seconds after the
+                first container start, and the number of nodes; None if no
+                container has started.
+        """
+        with self._lock:
+            starts = [
+                rec["marks"]["started"] for rec in self._pods.values()
+                if "started" in rec["marks"]
+            ]
+        if not starts:
+            return None
+        first = min(starts)
+        skews = [t - first for t in starts]
+        return {
+            "nodes": len(skews),
+            "p50": kubejobs.get_percentile(skews, 50),
+            "p95": kubejobs.get_percentile(skews, 95),
+            "p99": kubejobs.get_percentile(skews, 99),
+            "max": max(skews),
+        }
+
+    def get_trace(self):
+        """
+        Get the timeline in the Chrome trace event format.
+
+        Returns:
+            trace (dict): Chrome trace, one thread (track) per node.
+        """
+        spans = self.get_spans()
+        events = []
+        if not spans:
+            return {"traceEvents": events, "displayTimeUnit": "ms"}
+        origin = min(span["start"] for span in spans)
+        tids = {}
+        for span in spans:
+            tid = tids.get(span["node"])
+            if tid is None:
+                tid = tids[span["node"]] = len(tids) + 1
+                events.append({
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": span["node"]},
+                })
+            events.append({
+                "name": span["phase"],
+                "cat": "pod",
+                "ph": "X",
+                "pid": 1,
+                "tid": tid,
+                "ts": round((span["start"] - origin) * 1e6),
+                "dur": round((span["end"] - span["start"]) * 1e6),
+                "args": {"pod": span["pod"]},
+            })
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "origin": datetime.datetime.fromtimestamp(origin, tzutc()).isoformat(),
+            },
+        }
+
+    def write_trace(self, filename):
+        """
+        Write the timeline as a Chrome trace / Perfetto JSON file.
+
+        Args:
+            filename (str): Filename of the trace.
+
+        Returns:
+            None
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok = True)
+        with open(filename, "w") as f:
+            json.dump(self.get_trace(), f)
+        return None
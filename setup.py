@@ -25,7 +25,7 @@ setup(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)"
     ],
-    python_requires=">=3",
+    python_requires=">=3.9",
     packages = [
         "runkubejobs",
     ],
@@ -40,6 +40,11 @@ setup(
         "python-dateutil",
         "engcommon @ git+https://github.com/JustAddRobots/engcommon.git",
     ],
+    extras_require = {
+        "async": [
+            "kubernetes_asyncio",
+        ],
+    },
     entry_points = {
         "console_scripts": [
             "runkubejobs = runkubejobs.cli:main"
@@ -0,0 +1,31 @@
+"""
+Test setup: engcommon is a git-only dependency, stubbed if not installed.
+
+runner imports engcommon's CLI helper, INI config and constants at module
+level. Tests replace the CLI helper and never fetch the INI config, so empty
+stand-ins are enough to import runner without it.
+"""
+
+import sys
+import types
+
+try:
+    import engcommon  # noqa: F401
+except ImportError:
+    def _get_module(name, **attrs):
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+        return module
+
+    class _Stub:
+        """Stand-in for an engcommon class, unusable outside of tests."""
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError("engcommon Not Installed")
+
+    _get_module(
+        "engcommon",
+        clihelper = _get_module("engcommon.clihelper", CLI = _Stub),
+        ini = _get_module("engcommon.ini", INIConfig = _Stub),
+        constants = _get_module("engcommon.constants", _const = _Stub),
+    )
@@ -0,0 +1,228 @@
+"""
+Tests of the asyncio engine (see aiokubejobs) against a fake API client.
+
+kubernetes_asyncio and aiohttp are optional (the async extra) and stubbed if
+not installed. The stub client serves the models of the kubernetes client,
+and the API classes used are replaced by fakes in each test.
+"""
+
+import asyncio
+import datetime
+import gzip
+import queue
+import sys
+import types
+
+import pytest
+from dateutil.tz import tzutc
+
+try:
+    import kubernetes_asyncio  # noqa: F401
+except ImportError:
+    import kubernetes.client
+
+    def _get_module(name, **attrs):
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+        return module
+
+    class _ApiException(Exception):
+        def __init__(self, status = None, reason = None):
+            super().__init__(status, reason)
+            self.status = status
+            self.reason = reason
+
+    _client = _get_module(
+        "kubernetes_asyncio.client",
+        rest = _get_module("kubernetes_asyncio.client.rest", ApiException = _ApiException),
+        **{
+            name: getattr(kubernetes.client, name)
+            for name in dir(kubernetes.client) if name.startswith(("V1", "CoreV1Event"))
+        },
+    )
+    _get_module(
+        "kubernetes_asyncio",
+        client = _client,
+        config = _get_module("kubernetes_asyncio.config"),
+        utils = _get_module("kubernetes_asyncio.utils"),
+        watch = _get_module("kubernetes_asyncio.watch"),
+    )
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        _get_module("aiohttp")
+
+from runkubejobs import aiokubejobs  # noqa: E402
+from runkubejobs import kubejobs  # noqa: E402
+
+client = aiokubejobs.client
+TASK = "runxhpl"
+
+
+def get_job(node, succeeded = None, failed = None):
+    return client.V1Job(
+        metadata = client.V1ObjectMeta(name = "{0}-{1}".format(TASK, node)),
+        status = client.V1JobStatus(succeeded = succeeded, failed = failed),
+    )
+
+
+def get_pod(node, phase, start_time = None):
+    job_name = "{0}-{1}".format(TASK, node)
+    return client.V1Pod(
+        metadata = client.V1ObjectMeta(
+            name = "{0}-abcde".format(job_name),
+            labels = {"job-group": job_name},
+        ),
+        status = client.V1PodStatus(phase = phase, start_time = start_time),
+    )
+
+
+def get_warning(pod):
+    return client.CoreV1Event(
+        metadata = client.V1ObjectMeta(name = "{0}.FailedScheduling".format(pod.metadata.name)),
+        involved_object = client.V1ObjectReference(kind = "Pod", name = pod.metadata.name),
+        reason = "FailedScheduling",
+        type = "Warning",
+    )
+
+
+def parse(items, expected = 2, **kwargs):
+    """Parse queued (kind, event) items, returning the messages of q_exc."""
+    async def _parse():
+        q = asyncio.Queue()
+        for item in items:
+            q.put_nowait(item)
+        await aiokubejobs.parse_queue(
+            q, aiokubejobs.GroupStore(expected), TASK, q_exc, **kwargs
+        )
+
+    q_exc = queue.Queue()
+    asyncio.run(_parse())
+    messages = []
+    while not q_exc.empty():
+        messages.append(q_exc.get()[1].args[0])
+    return messages
+
+
+def added(kind, obj):
+    return (kind, {"type": "ADDED", "object": obj})
+
+
+def test_parse_queue_completed():
+    items = []
+    for node in ("node-1", "node-2"):
+        items.append(added("job", get_job(node, succeeded = 1)))
+        items.append(added("pod", get_pod(node, "Succeeded")))
+    items.append(kubejobs.STOP_EVENT)  # Not reached
+    assert parse(items) == []
+
+
+def test_parse_queue_pod_failed():
+    items = [
+        added("job", get_job("node-1")),
+        added("pod", get_pod("node-1", "Failed")),
+    ]
+    assert parse(items) == ["Pod Failed"]
+
+
+def test_parse_queue_stream_ended():
+    items = [added("job", get_job("node-1")), kubejobs.STOP_EVENT]
+    assert parse(items) == ["Event Stream Ended"]
+
+
+@pytest.mark.parametrize("pending_timeout, expected", [
+    (60, ["Pending Timeout Exceeded"]),
+    (300, ["Event Stream Ended"]),
+    (None, ["Event Stream Ended"]),
+])
+def test_parse_queue_pending_timeout(pending_timeout, expected):
+    start_time = datetime.datetime.now(tzutc()) - datetime.timedelta(seconds = 120)
+    pod = get_pod("node-1", "Pending", start_time)
+    items = [
+        added("job", get_job("node-1")),
+        added("pod", pod),
+        ("event", {"type": "ADDED", "object": get_warning(pod)}),
+        kubejobs.STOP_EVENT,
+    ]
+    assert parse(items, pending_timeout = pending_timeout) == expected
+
+
+class FakeContent:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_chunked(self, chunk_size):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeResp:
+    def __init__(self, chunks):
+        self.content = FakeContent(chunks)
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+class FakeCoreApi:
+    """Pod log API serving the same log for every pod."""
+    resps = []
+
+    def __init__(self, api_client):
+        return None
+
+    async def read_namespaced_pod_log(self, pod_name, namespace, **kw_params):
+        resp = FakeResp([b"line 1\n", b"line 2\n"])
+        self.resps.append(resp)
+        return resp
+
+
+class FakeBatchApi:
+    """Job API recording collection deletes."""
+    deletes = []
+
+    def __init__(self, api_client):
+        return None
+
+    async def delete_collection_namespaced_job(self, namespace, **kw_params):
+        self.deletes.append((namespace, kw_params))
+        return None
+
+
+def test_clean_up(monkeypatch, tmp_path):
+    monkeypatch.setattr(FakeCoreApi, "resps", [])
+    monkeypatch.setattr(FakeBatchApi, "deletes", [])
+    monkeypatch.setattr(client, "CoreV1Api", FakeCoreApi, raising = False)
+    monkeypatch.setattr(client, "BatchV1Api", FakeBatchApi, raising = False)
+    store = aiokubejobs.GroupStore(2)
+    workers = {}
+    for node, phase in (("node-1", "Failed"), ("node-2", "Succeeded")):
+        workers[node] = get_job(node)
+        store.apply("ADDED", get_job(node, failed = 1 if phase == "Failed" else None))
+        store.apply("ADDED", get_pod(node, phase))
+    logged = []
+
+    asyncio.run(aiokubejobs.clean_up(
+        None, workers, store,
+        {"logdir": str(tmp_path), "compress": True},
+        log_pod = lambda pod_name, result: logged.append((pod_name, result)),
+        task = TASK,
+        log_id = "test",
+        propagation_policy = "Background",
+    ))
+
+    # Only the failed pod's log is saved, and its job kept
+    [(pod_name, (filename, tail))] = logged
+    assert pod_name == "runxhpl-node-1-abcde"
+    assert tail == "line 1\nline 2"
+    with gzip.open(filename, "rb") as f:
+        assert f.read() == b"line 1\nline 2\n"
+    assert [resp.released for resp in FakeCoreApi.resps] == [True]
+    assert FakeBatchApi.deletes == [("default", {
+        "label_selector": kubejobs.get_group_selector(
+            TASK, "test", exclude = ["runxhpl-node-1"]
+        ),
+        "propagation_policy": "Background",
+    })]
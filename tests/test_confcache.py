@@ -0,0 +1,82 @@
+"""
+Tests of the kubeconfig cache (see confcache.get_kubeconfig).
+"""
+
+import os
+
+import yaml
+
+from runkubejobs import confcache
+
+URL = "https://config.example.com/runkubejobs.ini"
+
+KUBECONFIG = """\
+apiVersion: v1
+kind: Config
+clusters:
+- name: cluster-1
+  cluster:
+    server: https://cluster-1.example.com:6443
+    certificate-authority: certs/ca.crt
+- name: cluster-2
+  cluster:
+    server: https://cluster-2.example.com:6443
+    certificate-authority: /etc/kubernetes/ca.crt
+users:
+- name: user-1
+  user:
+    client-certificate: certs/client.crt
+    client-key: ../keys/client.key
+- name: user-2
+  user:
+    token: secret
+"""
+
+
+def write_source(tmp_path):
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    source = source_dir / "kubeconfig"
+    source.write_text(KUBECONFIG)
+    return str(source)
+
+
+def test_get_kubeconfig_cached(tmp_path):
+    source = write_source(tmp_path)
+    fetched = []
+
+    def _fetch():
+        fetched.append(source)
+        return source
+
+    cache_dir = str(tmp_path / "cache")
+    kubeconfig = confcache.get_kubeconfig(URL, _fetch, 60, cache_dir)
+    assert kubeconfig == confcache.get_kubeconfig(URL, _fetch, 60, cache_dir)
+    assert len(fetched) == 1
+    assert os.path.dirname(kubeconfig) == confcache.get_cache_path(URL, cache_dir)
+    assert os.stat(kubeconfig).st_mode & 0o077 == 0
+
+
+def test_get_kubeconfig_not_cached(tmp_path):
+    source = write_source(tmp_path)
+    assert confcache.get_kubeconfig(URL, lambda: source, 0, str(tmp_path / "cache")) == source
+    assert not (tmp_path / "cache").exists()
+
+
+def test_get_kubeconfig_absolute_paths(tmp_path):
+    source = write_source(tmp_path)
+    kubeconfig = confcache.get_kubeconfig(URL, lambda: source, 60, str(tmp_path / "cache"))
+    with open(kubeconfig) as f:
+        tree = yaml.safe_load(f)
+
+    base = os.path.dirname(source)
+    (cluster_1, cluster_2) = [c["cluster"] for c in tree["clusters"]]
+    (user_1, user_2) = [u["user"] for u in tree["users"]]
+    assert cluster_1["certificate-authority"] == os.path.join(base, "certs/ca.crt")
+    assert cluster_1["server"] == "https://cluster-1.example.com:6443"
+    assert cluster_2["certificate-authority"] == "/etc/kubernetes/ca.crt"
+    assert user_1 == {
+        "client-certificate": os.path.join(base, "certs/client.crt"),
+        "client-key": os.path.join(base, "../keys/client.key"),
+    }
+    assert user_2 == {"token": "secret"}
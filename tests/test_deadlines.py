@@ -0,0 +1,152 @@
+"""
+Tests of pod phase deadlines (see deadlines.DeadlineScheduler).
+"""
+
+import queue
+import time
+
+import pytest
+from kubernetes import client
+
+from runkubejobs import deadlines
+from runkubejobs import kubejobs
+
+
+def get_pod(name, phase, running = False):
+    state = client.V1ContainerState(
+        running = client.V1ContainerStateRunning() if running else None,
+    )
+    return client.V1Pod(
+        metadata = client.V1ObjectMeta(name = name),
+        status = client.V1PodStatus(
+            phase = phase,
+            container_statuses = [client.V1ContainerStatus(
+                name = "main",
+                image = "image",
+                image_id = "",
+                ready = running,
+                restart_count = 0,
+                state = state,
+            )],
+        ),
+    )
+
+
+def get_event(name, reason):
+    return client.CoreV1Event(
+        metadata = client.V1ObjectMeta(name = "{0}.{1}".format(name, reason)),
+        involved_object = client.V1ObjectReference(kind = "Pod", name = name),
+        reason = reason,
+    )
+
+
+@pytest.fixture
+def scheduler():
+    """Started scheduler, with its queues as attributes."""
+    schedulers = []
+
+    def _scheduler(on_expire = None, **timeouts):
+        q_watch = queue.Queue()
+        q_exc = queue.Queue()
+        s = deadlines.DeadlineScheduler(
+            q_watch,
+            q_exc,
+            dict({"pending": None, "pull": None, "run": None}, **timeouts),
+            on_expire = on_expire,
+        )
+        s.q_watch = q_watch
+        s.q_exc = q_exc
+        s.start()
+        schedulers.append(s)
+        return s
+
+    yield _scheduler
+    for s in schedulers:
+        s.stop()
+
+
+def get_error(s, timeout = 5):
+    (_, err, _) = s.q_exc.get(timeout = timeout)
+    return err.args
+
+
+def test_get_timeouts():
+    assert deadlines.get_timeouts("runxhpl") == deadlines.DEFAULT_TIMEOUTS
+    timeouts = deadlines.get_timeouts(
+        "runxhpl",
+        task_overrides = {"run": 60},
+        pending = 0,
+        pull = None,
+        run = 30,
+    )
+    assert timeouts == {"pending": None, "pull": 600, "run": 60}
+
+
+def test_expired_deadline_stops_dispatcher(scheduler):
+    s = scheduler(pending = 0.05)
+    s.on_pod("ADDED", get_pod("pod-1", "Pending"))
+    assert get_error(s) == ("Pending Timeout Exceeded", "pod-1")
+    assert s.q_watch.get(timeout = 5) is kubejobs.DONE_EVENT
+    assert s.expired == [("pod-1", "pending")]
+
+
+def test_expired_deadline_calls_on_expire(scheduler):
+    calls = []
+    s = scheduler(on_expire = lambda *args: calls.append(args), run = 0.05)
+    s.on_pod("ADDED", get_pod("pod-1", "Running"))
+    assert get_error(s) == ("Run Timeout Exceeded", "pod-1")
+    assert calls == [("pod-1", "run")]
+    assert s.q_watch.empty()
+
+
+def test_cancelled_deadline_skipped(scheduler):
+    s = scheduler(pending = 0.1)
+    s.on_pod("ADDED", get_pod("pod-1", "Pending"))
+    s.on_pod("MODIFIED", get_pod("pod-1", "Pending", running = True))
+    s.on_pod("ADDED", get_pod("pod-2", "Pending"))
+    s.on_pod("DELETED", get_pod("pod-2", "Pending"))
+    time.sleep(0.3)
+    assert s.q_exc.empty()
+    assert s.expired == []
+
+
+def test_deadline_armed_once(scheduler):
+    s = scheduler(run = 0.2)
+    s.on_pod("ADDED", get_pod("pod-1", "Running"))
+    time.sleep(0.1)
+    s.on_pod("MODIFIED", get_pod("pod-1", "Running"))
+    assert s.arm("pod-1", "run") is False
+    time_start = time.monotonic()
+    get_error(s)
+    assert time.monotonic() - time_start < 0.2
+
+
+def test_first_pull_pauses_pending(scheduler):
+    s = scheduler(pending = 0.1, pull = 10)
+    s.on_pod("ADDED", get_pod("pod-1", "Pending"))
+    s.on_event(get_event("pod-1", "Pulling"))
+    s.on_pod("MODIFIED", get_pod("pod-1", "Pending"))
+    time.sleep(0.3)
+    assert s.q_exc.empty()
+
+    # Pending restarts with the full timeout once pulled
+    s.on_event(get_event("pod-1", "Pulled"))
+    assert get_error(s) == ("Pending Timeout Exceeded", "pod-1")
+    assert s.expired == [("pod-1", "pending")]
+
+
+def test_slow_pull_fails_with_pull_timeout(scheduler):
+    s = scheduler(pending = 10, pull = 0.05)
+    s.on_pod("ADDED", get_pod("pod-1", "Pending"))
+    s.on_event(get_event("pod-1", "Pulling"))
+    assert get_error(s) == ("Image Pull Timeout Exceeded", "pod-1")
+    assert s.expired == [("pod-1", "pull")]
+
+
+def test_later_pull_counts_as_pending(scheduler):
+    s = scheduler(pending = 10, pull = 0.05)
+    s.on_event(get_event("pod-1", "Pulling"))
+    s.on_event(get_event("pod-1", "Pulled"))
+    s.on_event(get_event("pod-1", "Pulling"))
+    time.sleep(0.2)
+    assert s.q_exc.empty()
@@ -0,0 +1,134 @@
+"""
+Tests of the informer cache of a task group (see informer.JobCache).
+"""
+
+import threading
+
+import pytest
+from kubernetes import client
+
+from runkubejobs import informer
+
+
+class FakeList:
+    """List function returning the items it is set to."""
+    def __init__(self, list_cls):
+        self.list_cls = list_cls
+        self.items = []
+        self.resource_version = 0
+
+    def __call__(self, *args, **kw_params):
+        self.resource_version += 1
+        return self.list_cls(
+            items = list(self.items),
+            metadata = client.V1ListMeta(resource_version = str(self.resource_version)),
+        )
+
+
+def get_labels(name, log_id):
+    return {"task": "runxhpl", "log-id": log_id, "job-group": name}
+
+
+def get_job(name, resource_version, log_id = "test", succeeded = None, failed = None):
+    return client.V1Job(
+        metadata = client.V1ObjectMeta(
+            name = name,
+            labels = get_labels(name, log_id),
+            resource_version = resource_version,
+        ),
+        status = client.V1JobStatus(succeeded = succeeded, failed = failed),
+    )
+
+
+def get_pod(job_name, resource_version, phase, log_id = "test"):
+    return client.V1Pod(
+        metadata = client.V1ObjectMeta(
+            name = "{0}-abcde".format(job_name),
+            labels = get_labels(job_name, log_id),
+            resource_version = resource_version,
+        ),
+        status = client.V1PodStatus(phase = phase),
+    )
+
+
+@pytest.fixture
+def informers():
+    """Shared job and pod informers, synced from their list functions."""
+    return (
+        informer.Informer(FakeList(client.V1JobList)),
+        informer.Informer(FakeList(client.V1PodList), index_label = "job-group"),
+    )
+
+
+def sync(informer_, *items):
+    informer_.list_fn.items = items
+    informer_.sync()
+    return None
+
+
+def test_job_cache_counts(informers):
+    cache = informer.JobCache("runxhpl", "test", expected = 2, informers = informers)
+    sync(informers[0], get_job("runxhpl-node-1", "1"), get_job("runxhpl-node-2", "2"))
+    assert cache.counts[""] == 2
+    assert not cache.is_finished()
+
+    sync(
+        informers[0],
+        get_job("runxhpl-node-1", "3", succeeded = 1),
+        get_job("runxhpl-node-2", "4", failed = 1),
+    )
+    assert (cache.counts[""], cache.counts["Succeeded"], cache.counts["Failed"]) == (0, 1, 1)
+    assert cache.is_failed()
+    assert cache.is_finished()
+    assert not cache.is_completed()
+    assert cache.get_failed() == ["runxhpl-node-2"]
+
+    # A deleted job is no longer counted
+    sync(informers[0], get_job("runxhpl-node-1", "3", succeeded = 1))
+    assert not cache.is_failed()
+    assert not cache.is_finished()
+    assert cache.get_failed() == []
+
+
+def test_job_cache_views(informers):
+    cache = informer.JobCache("runxhpl", "test", informers = informers)
+    other = informer.JobCache("runxhpl", "other", informers = informers)
+    sync(
+        informers[0],
+        get_job("runxhpl-node-1", "1", succeeded = 1),
+        get_job("runxhpl-node-2", "2", log_id = "other", failed = 1),
+    )
+    assert cache.is_completed()
+    assert not cache.is_failed()
+    assert other.is_failed()
+    assert cache.get_job("runxhpl-node-2") is None
+    assert other.get_job("runxhpl-node-2") is not None
+
+
+def test_job_cache_get_pod(informers):
+    cache = informer.JobCache("runxhpl", "test", informers = informers)
+    sync(informers[1], get_pod("runxhpl-node-1", "1", "Running"))
+    pod = cache.get_pod("runxhpl-node-1")
+    assert pod.metadata.name == "runxhpl-node-1-abcde"
+    assert cache.get_pod("runxhpl-node-1-abcde") is pod
+    assert cache.get_pod(get_job("runxhpl-node-1", "1")) is pod
+    assert cache.get_pod("runxhpl-node-2") is None
+
+
+def test_wait_for_pods_woken_by_pod_changes(informers):
+    cache = informer.JobCache("runxhpl", "test", informers = informers)
+    sync(informers[1], get_pod("runxhpl-node-1", "1", "Pending"))
+    names = ["runxhpl-node-1"]
+    assert cache.wait_for_pods(names, timeout = 0.05) == names
+
+    timer = threading.Timer(0.05, sync, args = (
+        informers[1], get_pod("runxhpl-node-1", "2", "Running")
+    ))
+    timer.start()
+    assert cache.wait_for_pods(names, timeout = 5) == []
+    timer.join()
+    assert cache.wait_for_pods(
+        names,
+        timeout = 0.05,
+        check = lambda pod: pod.status.phase == "Succeeded",
+    ) == names
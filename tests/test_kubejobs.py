@@ -0,0 +1,285 @@
+"""
+Tests of the pure-logic helpers of kubejobs.
+"""
+
+import pytest
+from kubernetes import client
+
+from runkubejobs import kubejobs
+
+TEMPLATE = """\
+apiVersion: batch/v1
+kind: Job
+metadata:
+  name: $TASK-$WORKER
+  labels:
+    task: $TASK
+    log-id: $LOGID
+spec:
+  template:
+    spec:
+      nodeName: $WORKER
+      containers:
+      - name: $TASK
+        image: $IMAGE
+        command: ["sh", "-c", "echo $HOSTNAME $PATH $WORKERS > /tmp/$TASK.log"]
+        resources:
+          limits:
+            cpu: 1
+      restartPolicy: Never
+"""
+
+VALUES = {
+    "WORKER": "node-1",
+    "TASK": "runxhpl",
+    "LOGID": "test",
+    "IMAGE": "image:latest",
+}
+
+
+@pytest.fixture
+def tmpl(tmp_path):
+    filename = tmp_path / "tmpl.yaml"
+    filename.write_text(TEMPLATE)
+    return kubejobs.JobTemplate(str(filename))
+
+
+def test_template_render(tmpl):
+    dict_ = tmpl.render(VALUES)
+    assert dict_["metadata"]["name"] == "runxhpl-node-1"
+    assert dict_["metadata"]["labels"] == {"task": "runxhpl", "log-id": "test"}
+    spec = dict_["spec"]["template"]["spec"]
+    assert spec["nodeName"] == "node-1"
+    assert spec["containers"][0]["image"] == "image:latest"
+
+
+def test_template_other_tokens_kept(tmpl):
+    assert tmpl.placeholders == {"WORKER", "TASK", "LOGID", "IMAGE"}
+    container = tmpl.render(VALUES)["spec"]["template"]["spec"]["containers"][0]
+    assert container["command"][2] == (
+        "echo $HOSTNAME $PATH $WORKERS > /tmp/runxhpl.log"
+    )
+
+
+def test_template_static_subtrees_shared(tmpl):
+    first = tmpl.render(VALUES)
+    second = tmpl.render(dict(VALUES, WORKER = "node-2"))
+    assert first["spec"]["template"]["spec"]["nodeName"] == "node-1"
+    assert second["spec"]["template"]["spec"]["nodeName"] == "node-2"
+    assert first["apiVersion"] == "batch/v1"
+    assert first["spec"] is not second["spec"]
+    assert (
+        first["spec"]["template"]["spec"]["containers"][0]["resources"]
+        is second["spec"]["template"]["spec"]["containers"][0]["resources"]
+    )
+    assert tmpl.tree["metadata"]["name"] == "$TASK-$WORKER"
+
+
+def test_template_missing_value(tmpl):
+    with pytest.raises(RuntimeError) as err:
+        tmpl.render(dict(VALUES, IMAGE = None))
+    assert err.value.args[0] == "Missing Template Value"
+    assert err.value.args[2] == ["$IMAGE"]
+
+
+def test_template_static(tmp_path):
+    filename = tmp_path / "static.yaml"
+    filename.write_text("kind: Job\nmetadata:\n  name: $NAME\n")
+    tmpl = kubejobs.JobTemplate(str(filename))
+    assert tmpl.placeholders == set()
+    assert tmpl.render({}) is tmpl.tree
+
+
+def get_pod(name, resource_version):
+    return client.V1Pod(metadata = client.V1ObjectMeta(
+        name = name,
+        resource_version = resource_version,
+    ))
+
+
+class FakeList:
+    """List function returning scripted pod lists."""
+    def __init__(self, *lists):
+        self.lists = list(lists)
+        self.calls = []
+
+    def __call__(self, *args, **kw_params):
+        self.calls.append((args, kw_params))
+        (resource_version, items) = self.lists.pop(0)
+        return client.V1PodList(
+            items = items,
+            metadata = client.V1ListMeta(resource_version = resource_version),
+        )
+
+
+class FakeWatch:
+    """Watch streaming scripted rounds of events, each ending in an error."""
+    def __init__(self, stop, *rounds):
+        self.stop = stop
+        self.rounds = list(rounds)
+        self.resource_versions = []
+
+    def stream(self, list_fn, *args, resource_version = None, **kw_params):
+        self.resource_versions.append(resource_version)
+        (events, err) = self.rounds.pop(0)
+        if not self.rounds:
+            self.stop.set()
+        for event in events:
+            yield event
+        if err is not None:
+            raise err
+
+
+class FakeStop:
+    """Stop event recording the backoffs waited."""
+    def __init__(self):
+        self.stopped = False
+        self.backoffs = []
+
+    def set(self):
+        self.stopped = True
+
+    def is_set(self):
+        return self.stopped
+
+    def wait(self, timeout):
+        self.backoffs.append(timeout)
+        return self.stopped
+
+
+def test_diff_objs():
+    known = {
+        "pod-1": get_pod("pod-1", "1"),
+        "pod-2": get_pod("pod-2", "2"),
+        "pod-3": get_pod("pod-3", "3"),
+    }
+    events = kubejobs.diff_objs(known, [
+        get_pod("pod-1", "1"),
+        get_pod("pod-2", "5"),
+        get_pod("pod-4", "6"),
+    ])
+    assert [(e["type"], e["object"].metadata.name) for e in events] == [
+        ("DELETED", "pod-3"),
+        ("MODIFIED", "pod-2"),
+        ("ADDED", "pod-4"),
+    ]
+    assert sorted(known) == ["pod-1", "pod-2", "pod-4"]
+    assert known["pod-2"].metadata.resource_version == "5"
+
+
+def test_relist():
+    list_fn = FakeList(("10", [get_pod("pod-1", "9")]))
+    known = {}
+    (resource_version, events) = kubejobs.relist(
+        list_fn, known, "ns", label_selector = "task=runxhpl"
+    )
+    assert resource_version == "10"
+    assert [e["type"] for e in events] == ["ADDED"]
+    assert list_fn.calls[0][0] == ("ns",)
+    assert list_fn.calls[0][1]["label_selector"] == "task=runxhpl"
+    assert list(known) == ["pod-1"]
+
+
+def test_resumable_watch_resumes_from_last_version():
+    stop = FakeStop()
+    w = FakeWatch(
+        stop,
+        ([
+            {"type": "ADDED", "object": get_pod("pod-1", "11")},
+            {"type": "BOOKMARK", "raw_object": {"metadata": {"resourceVersion": "15"}}},
+        ], OSError("Connection reset")),
+        ([], kubejobs.ApiException(status = 500, reason = "Internal Server Error")),
+        ([
+            {"type": "MODIFIED", "object": get_pod("pod-1", "16")},
+            {"type": "DELETED", "object": get_pod("pod-1", "17")},
+        ], OSError("Connection reset")),
+        ([], None),
+    )
+    known = {}
+    events = list(kubejobs.gen_resumable_watch(w, FakeList(), known, "10", stop = stop))
+    assert [e["type"] for e in events] == ["ADDED", "MODIFIED", "DELETED"]
+    assert w.resource_versions == ["10", "15", "15", "17"]
+    assert stop.backoffs == [1, 2, 1]
+    assert known == {}
+
+
+def test_resumable_watch_relists_once_gone():
+    stop = FakeStop()
+    w = FakeWatch(
+        stop,
+        ([], kubejobs.ApiException(status = 410, reason = "Gone")),
+        ([], None),
+    )
+    list_fn = FakeList(("20", [get_pod("pod-1", "11"), get_pod("pod-2", "18")]))
+    known = {"pod-1": get_pod("pod-1", "11"), "pod-3": get_pod("pod-3", "12")}
+    events = list(kubejobs.gen_resumable_watch(w, list_fn, known, "10", stop = stop))
+    assert [(e["type"], e["object"].metadata.name) for e in events] == [
+        ("DELETED", "pod-3"),
+        ("ADDED", "pod-2"),
+    ]
+    assert w.resource_versions == ["10", "20"]
+    assert stop.backoffs == []
+
+
+def test_resumable_watch_untracked_resumes_from_now():
+    stop = FakeStop()
+    w = FakeWatch(
+        stop,
+        ([], kubejobs.ApiException(status = 410, reason = "Gone")),
+        ([], None),
+    )
+    list_fn = FakeList(("30", []))
+    list(kubejobs.gen_resumable_watch(w, list_fn, None, "10", stop = stop))
+    assert w.resource_versions == ["10", "30"]
+    assert list_fn.calls[0][1]["limit"] == 1
+
+
+def test_resumable_watch_raises_client_errors():
+    stop = FakeStop()
+    w = FakeWatch(stop, ([], kubejobs.ApiException(status = 403, reason = "Forbidden")))
+    with pytest.raises(kubejobs.ApiException):
+        list(kubejobs.gen_resumable_watch(w, FakeList(), {}, "10", stop = stop))
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({}, "task=runxhpl"),
+    ({"log_id": "test"}, "task=runxhpl,log-id=test"),
+    (
+        {"log_id": "test", "exclude": ["runxhpl-node-2", "runxhpl-node-1"]},
+        "task=runxhpl,log-id=test,job-group notin (runxhpl-node-1,runxhpl-node-2)",
+    ),
+    (
+        {"include": ["runxhpl-node-2", "runxhpl-node-1"]},
+        "task=runxhpl,job-group in (runxhpl-node-1,runxhpl-node-2)",
+    ),
+])
+def test_get_group_selector(kwargs, expected):
+    assert kubejobs.get_group_selector("runxhpl", **kwargs) == expected
+
+
+def test_sweep_jobs_scoped_to_workers(monkeypatch):
+    deletes = []
+    waits = []
+    monkeypatch.setattr(kubejobs, "SWEEP_BATCH_SIZE", 2)
+    monkeypatch.setattr(kubejobs, "delete_jobs", lambda *args: deletes.append(args))
+    monkeypatch.setattr(kubejobs, "wait_for_delete", lambda **kwargs: waits.append(kwargs))
+    kubejobs.sweep_jobs(
+        "runxhpl", ["node-3", "node-1", "node-2"],
+        namespace = "perf",
+        propagation_policy = "Background",
+    )
+    assert deletes == [
+        ("task=runxhpl,job-group in (runxhpl-node-1,runxhpl-node-2)", "perf", "Background"),
+        ("task=runxhpl,job-group in (runxhpl-node-3)", "perf", "Background"),
+    ]
+    assert waits == [{
+        "names": ["runxhpl-node-1", "runxhpl-node-2", "runxhpl-node-3"],
+        "label_selector": "task=runxhpl",
+        "timeout": 300,
+        "namespace": "perf",
+    }]
+
+    deletes.clear()
+    waits.clear()
+    kubejobs.sweep_jobs("runxhpl", [])
+    assert (deletes, waits) == ([], [])
@@ -0,0 +1,49 @@
+"""
+Tests of the Prometheus metrics (see metrics).
+"""
+
+import pytest
+
+from runkubejobs import metrics
+
+
+@pytest.mark.parametrize("method, url, query_params, expected", [
+    ("GET", "/apis/batch/v1/namespaces/default/jobs/runxhpl-node-1", None, ("get", "jobs")),
+    ("GET", "/apis/batch/v1/namespaces/default/jobs?labelSelector=task", None, ("list", "jobs")),
+    ("GET", "/apis/batch/v1/namespaces/default/jobs?watch=true", None, ("watch", "jobs")),
+    ("GET", "/api/v1/namespaces/default/pods", [("watch", True)], ("watch", "pods")),
+    ("GET", "/api/v1/namespaces/default/pods/runxhpl-node-1-abcde/log", None, ("get", "pods/log")),
+    ("GET", "/api/v1/nodes", None, ("list", "nodes")),
+    ("POST", "/apis/batch/v1/namespaces/default/jobs", None, ("create", "jobs")),
+    ("DELETE", "/apis/batch/v1/namespaces/default/jobs/runxhpl-node-1", None, ("delete", "jobs")),
+    ("DELETE", "/apis/batch/v1/namespaces/default/jobs", None, ("deletecollection", "jobs")),
+    ("PATCH", "/api/v1/namespaces/default/pods/runxhpl-node-1-abcde", None, ("patch", "pods")),
+    ("PUT", "/api/v1/namespaces/default/pods/runxhpl-node-1-abcde", None, ("update", "pods")),
+    ("GET", "/version", None, ("get", "other")),
+])
+def test_get_api_labels(method, url, query_params, expected):
+    assert metrics.get_api_labels(method, url, query_params) == expected
+
+
+def test_collect(monkeypatch):
+    monkeypatch.setattr(metrics, "_metrics", [])
+    counter = metrics.Counter("test_total", "Test counter.", ("verb",))
+    counter.inc(verb = "get")
+    counter.inc(2, verb = "get")
+    histogram = metrics.Histogram("test_seconds", "Test histogram.", buckets = (0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    assert counter.get(verb = "get") == 3
+    assert histogram.get() == (3, 5.55)
+    assert metrics.generate_text().splitlines() == [
+        "# HELP test_total Test counter.",
+        "# TYPE test_total counter",
+        'test_total{verb="get"} 3',
+        "# HELP test_seconds Test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+    ]
@@ -0,0 +1,109 @@
+"""
+Tests of pod log collection (see podlogs).
+"""
+
+import datetime
+import email.utils
+import time
+
+import pytest
+import urllib3
+from kubernetes import client
+
+from runkubejobs import kubejobs
+from runkubejobs import podlogs
+
+# Clock of the API server, ahead of the local clock
+SERVER_OFFSET = 100
+
+
+def get_line(seconds_ago, msg):
+    ts = datetime.datetime.fromtimestamp(
+        time.time() + SERVER_OFFSET - seconds_ago, datetime.timezone.utc
+    )
+    return "{0} {1}".format(ts.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), msg).encode()
+
+
+class FakeResp:
+    """Log stream of lines, then dropped if drop is set."""
+    def __init__(self, lines, drop = False):
+        self.lines = lines
+        self.drop = drop
+        self.headers = {"Date": email.utils.formatdate(
+            time.time() + SERVER_OFFSET, usegmt = True
+        )}
+
+    def stream(self, chunk_size):
+        for line in self.lines:
+            yield line + b"\n"
+        if self.drop:
+            raise urllib3.exceptions.ProtocolError("Connection broken")
+
+    def release_conn(self):
+        return None
+
+
+class FakeCoreApi:
+    """Pod log API serving a log in two streams, the first one dropped."""
+    def __init__(self, log, dropped_after):
+        self.log = log
+        self.dropped_after = dropped_after
+        self.calls = []
+
+    def read_namespaced_pod_log(self, pod_name, namespace, since_seconds = None, **kw_params):
+        self.calls.append(since_seconds)
+        if len(self.calls) == 1:
+            return FakeResp(self.log[:self.dropped_after], drop = True)
+        since = time.time() + SERVER_OFFSET - since_seconds
+        return FakeResp([line for line in self.log if podlogs.get_ts(line) >= since])
+
+
+@pytest.fixture
+def follow(monkeypatch, tmp_path):
+    """Follow a pod's log from a fake API, returning its lines written."""
+    def _follow(core):
+        monkeypatch.setattr(kubejobs, "get_core_api", lambda: core)
+        monkeypatch.setattr(kubejobs, "get_pod", lambda *args: client.V1Pod(
+            status = client.V1PodStatus(phase = "Succeeded"),
+        ))
+        follower = podlogs.LogFollower(str(tmp_path), max_workers = 1)
+        follower.follow("pod-1")
+        (filename, tail) = follower.get_result("pod-1", timeout = 10)
+        follower.stop()
+        with open(filename, "rb") as f:
+            return f.read().decode().splitlines()
+
+    return _follow
+
+
+def test_get_ts():
+    line = b"2024-01-01T00:00:01.5Z msg"
+    assert podlogs.get_ts(line) == datetime.datetime(
+        2024, 1, 1, 0, 0, 1, 500000, datetime.timezone.utc
+    ).timestamp()
+    assert podlogs.get_ts(b"2024-01-01T00:00:01Z msg") % 1 == 0
+    assert podlogs.get_ts(b"msg") is None
+
+
+def test_log_follower_resume_skips_replayed_lines(follow):
+    line_b = get_line(120, "b")
+    log = [
+        get_line(130, "a"),
+        line_b,
+        line_b.replace(b" b", b" c"),
+        line_b.replace(b" b", b" c2"),  # Same timestamp, not yet written
+        get_line(110, "d"),
+    ]
+    core = FakeCoreApi(log, dropped_after = 3)
+    assert follow(core) == ["a", "b", "c", "c2", "d"]
+
+    # Resumed from the last timestamp written on the server's clock
+    (_, since_seconds) = core.calls
+    assert 120 + podlogs.LogFollower.RESUME_MARGIN <= since_seconds
+    assert since_seconds <= 125 + podlogs.LogFollower.RESUME_MARGIN
+
+
+def test_log_follower_resume_with_lagging_stream(follow):
+    log = [get_line(300, "a"), get_line(290, "b")]
+    core = FakeCoreApi(log, dropped_after = 1)
+    assert follow(core) == ["a", "b"]
@@ -0,0 +1,59 @@
+"""
+Tests of rollout waves (see rollout.get_waves).
+"""
+
+import pytest
+from kubernetes import client
+
+from runkubejobs import rollout
+
+NODES = ["node-{0}".format(i) for i in range(1, 6)]
+
+
+class FakeInventory:
+    """Node inventory of nodes with zone labels."""
+    def __init__(self, zones):
+        self.nodes = {
+            name: client.V1Node(metadata = client.V1ObjectMeta(
+                name = name,
+                labels = {"zone": zone} if zone else None,
+            ))
+            for name, zone in zones.items()
+        }
+
+    def get(self, name):
+        return self.nodes.get(name)
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({}, [NODES]),
+    ({"size": 2}, [NODES[0:2], NODES[2:4], NODES[4:5]]),
+    ({"size": 10}, [NODES]),
+    ({"percent": 40}, [NODES[0:2], NODES[2:4], NODES[4:5]]),
+    ({"percent": 1}, [[node] for node in NODES]),
+])
+def test_get_waves(kwargs, expected):
+    assert rollout.get_waves(NODES, **kwargs) == expected
+
+
+def test_get_waves_no_nodes():
+    assert rollout.get_waves([]) == []
+    assert rollout.get_waves([], size = 2) == []
+
+
+def test_get_waves_by_label():
+    inventory = FakeInventory({
+        "node-1": "b",
+        "node-2": "a",
+        "node-3": "b",
+        "node-4": None,
+    })
+    waves = rollout.get_waves(NODES, label = "zone", inventory = inventory)
+    assert waves == [["node-4", "node-5"], ["node-2"], ["node-1", "node-3"]]
+
+
+def test_get_wave_summary():
+    lines = rollout.get_wave_summary([
+        {"wave": 1, "nodes": 2, "spawn": 0.5, "gate": 1.25},
+    ])
+    assert lines == ["wave 1: nodes: 2, spawn: 0.50s, gate: 1.25s"]
@@ -0,0 +1,259 @@
+"""
+Tests of runs kept warm in one process (see runner.Session).
+"""
+
+import contextlib
+import logging
+import types
+
+import pytest
+from kubernetes import client
+
+from runkubejobs import cli
+from runkubejobs import kubejobs
+from runkubejobs import runner
+
+
+class FakeCLI:
+    """CLI helper writing to plain loggers."""
+    def __init__(self, project_name, d):
+        self.log_id = d["logid"] or "test"
+        self.logger = logging.getLogger("test.runner")
+        self.logger_noformat = logging.getLogger("test.runner.noformat")
+
+    def print_versions(self):
+        return None
+
+    def print_logdir(self):
+        return None
+
+
+class FakeSession:
+    """Session with no cluster behind it."""
+    kubeconfig = None
+
+    def get_inventory(self, label_selector = None):
+        return None
+
+    def start_metrics_server(self, port):
+        return None
+
+
+class FakeHandlers:
+    def add_handler(self, handler):
+        return None
+
+
+class FakeCache:
+    jobs = FakeHandlers()
+    pods = FakeHandlers()
+
+
+class FakeMultiplexer:
+    """Multiplexer with no watches or informers."""
+    def __init__(self, log_id, q_watch):
+        self.groups = []
+
+    def add_group(self, group, expected = None):
+        group.cache = FakeCache()
+        self.groups.append(group)
+        return group
+
+    def start(self):
+        return 0
+
+    def stop(self):
+        return None
+
+    def dispatch(self, q_exc, sources, fail_fast = True):
+        return None
+
+
+class FakeDeadlineScheduler:
+    """Deadline scheduler with no thread."""
+    def __init__(self, q_watch, q_exc, timeouts = None, on_expire = None):
+        return None
+
+    def on_pod(self, event_type, pod):
+        return None
+
+    def start(self, name = None):
+        return None
+
+    def stop(self):
+        return None
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Run with no cluster, keeping the job dicts each run renders."""
+    dicts = []
+
+    def _render(group):
+        dicts.append(kubejobs.get_dict_from_yaml(
+            group.task, "node-1", group.tmpl, "test", group.image,
+            pull_policy = group.pull_policy,
+            barrier = group.barrier,
+        ))
+        return None
+
+    def _start_group(group, d, log_id, nodes, node_inventory, logger):
+        _render(group)
+        raise RuntimeError("Spawn Failed", group.name)
+
+    def _run_async(d, my_cli, kubeconfig, group, nodes):
+        _render(group)
+        return None
+
+    def _prepull(tmpl, task, nodes, log_id, image, max_in_flight, **kwargs):
+        dicts.append(kubejobs.get_dict_from_yaml(task, "node-1", tmpl, log_id, image))
+        return ({"node-1": 0.0}, {})
+
+    monkeypatch.setattr(runner.clihelper, "CLI", FakeCLI)
+    monkeypatch.setattr(runner.multiplex, "Multiplexer", FakeMultiplexer)
+    monkeypatch.setattr(runner.deadlines, "DeadlineScheduler", FakeDeadlineScheduler)
+    monkeypatch.setattr(runner, "start_group", _start_group)
+    monkeypatch.setattr(runner, "run_async", _run_async)
+    monkeypatch.setattr(runner, "clean_up_groups", lambda *args: None)
+    monkeypatch.setattr(runner.prepull, "prepull", _prepull)
+    monkeypatch.setattr(kubejobs, "get_task_nodes", lambda *args: ["node-1"])
+    monkeypatch.setattr(kubejobs, "sweep_jobs", lambda *args, **kwargs: None)
+    return dicts
+
+
+def get_init_containers(dict_):
+    return [
+        c["name"]
+        for c in dict_["spec"]["template"]["spec"].get("initContainers") or []
+    ]
+
+
+def run_session(args):
+    d = cli.get_command(["-t", "runxhpl", "-n", "node-1"] + args)
+    with contextlib.suppress(SystemExit):
+        runner.run(d, FakeSession())
+    return None
+
+
+@pytest.mark.parametrize("args", [
+    ["--engine", "async"],
+    ["--prepull"],
+    [],
+])
+def test_barrier_not_kept_across_sessions(rendered, args):
+    run_session(["--barrier"])
+    assert kubejobs.BARRIER_CONTAINER in get_init_containers(rendered[-1])
+    first = len(rendered)
+    run_session(args)
+    assert len(rendered) > first
+    for dict_ in rendered[first:]:
+        assert kubejobs.BARRIER_CONTAINER not in get_init_containers(dict_)
+
+
+def test_pull_policy_not_kept_across_sessions(rendered):
+    run_session(["--prepull"])
+    containers = rendered[-1]["spec"]["template"]["spec"]["containers"]
+    assert all(c.get("imagePullPolicy") == "IfNotPresent" for c in containers)
+    first = len(rendered)
+    run_session([])
+    assert len(rendered) > first
+    for dict_ in rendered[first:]:
+        containers = dict_["spec"]["template"]["spec"]["containers"]
+        assert all(c.get("imagePullPolicy") != "IfNotPresent" for c in containers)
+
+
+def test_job_options_by_group():
+    d = cli.get_command([
+        "-t", "runxhpl",
+        "--group", "runxhpl@perf",
+        "--prepull",
+        "--barrier",
+        "--propagation-policy", "Background",
+    ])
+    groups = runner.get_groups(d)
+    assert len(groups) == 2
+    for group in groups:
+        assert group.pull_policy == "IfNotPresent"
+        assert group.barrier
+        assert group.propagation_policy == "Background"
+    group = runner.get_groups(cli.get_command(["-t", "runxhpl"]))[0]
+    assert (group.pull_policy, group.barrier, group.propagation_policy) == (
+        None, False, "Foreground"
+    )
+
+
+def test_task_timeouts_by_group():
+    d = cli.get_command([
+        "-t", "runxhpl",
+        "--run-timeout", "100",
+        "--task-timeout", "runxhpl@perf:run=3600",
+        "--task-timeout", "runxhpl:run=600",
+        "--task-timeout", "runxhpl:pending=0",
+    ])
+    timeouts = {
+        group.namespace: runner.deadlines.get_timeouts(
+            group.task,
+            task_overrides = runner.get_task_timeouts(d, group),
+            run = d["run_timeout"],
+        )
+        for group in [
+            runner.multiplex.TaskGroup("runxhpl", namespace, None, None)
+            for namespace in ("default", "perf")
+        ]
+    }
+    assert timeouts["default"] == {"pending": None, "pull": 600, "run": 600}
+    assert timeouts["perf"] == {"pending": None, "pull": 600, "run": 3600}
+
+
+@pytest.mark.parametrize("args, runs", [
+    (["--pending-timeout", "10"], 1),
+    (["--task-timeout", "runxhpl:pending=10"], 1),
+    (["--pull-timeout", "10"], 0),
+    (["--run-timeout", "10"], 0),
+    (["--task-timeout", "runxhpl:run=10"], 0),
+])
+def test_async_engine_timeouts(rendered, args, runs):
+    run_session(["--engine", "async"] + args)
+    assert len(rendered) == runs
+
+
+class FakeJobCache:
+    """Job cache of one running job and its pod."""
+    def __init__(self, job, pod):
+        self.job = job
+        self.pods = types.SimpleNamespace(get_by_index = lambda name: [pod])
+
+    def get_job(self, name):
+        return self.job
+
+
+def test_clean_up_logs_failed_partial_saves(monkeypatch, caplog):
+    d = cli.get_command(["-t", "runxhpl", "-n", "node-1", "--propagation-policy", "Background"])
+    group = runner.get_groups(d)[0]
+    job = client.V1Job(
+        metadata = client.V1ObjectMeta(name = "runxhpl-node-1"),
+        status = client.V1JobStatus(active = 1),
+    )
+    pod = client.V1Pod(
+        metadata = client.V1ObjectMeta(name = "runxhpl-node-1-abcde"),
+        status = client.V1PodStatus(phase = "Running"),
+    )
+    group.workers = {"node-1": types.SimpleNamespace(job = job)}
+    group.cache = FakeJobCache(job, pod)
+    saves = []
+    deletes = []
+
+    def _save_pod_logs(pod_names, **kwargs):
+        saves.append(pod_names)
+        return {name: RuntimeError("Stream Failed", name) for name in pod_names}
+
+    monkeypatch.setattr(runner.podlogs, "save_pod_logs", _save_pod_logs)
+    monkeypatch.setattr(runner, "get_pod_logger", lambda my_cli: my_cli.logger_noformat)
+    monkeypatch.setattr(kubejobs, "delete_jobs", lambda *args: deletes.append(args))
+    with caplog.at_level(logging.INFO, logger = "test.runner"):
+        runner.clean_up(group, FakeCLI("runkubejobs", d), d)
+    assert saves == [["runxhpl-node-1-abcde"], []]
+    assert deletes == [("task=runxhpl,log-id=test", "default", "Background")]
+    messages = [r.getMessage() for r in caplog.records if r.name == "test.runner"]
+    assert "Saved partial logs of 0/1 running pods" in messages
+    assert "Failed to save partial logs of pods: runxhpl-node-1-abcde" in messages
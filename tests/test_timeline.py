@@ -0,0 +1,154 @@
+"""
+Tests of the per-node phase timeline (see timeline.Timeline).
+"""
+
+import datetime
+
+from dateutil.tz import tzutc
+from kubernetes import client
+
+from runkubejobs import timeline
+
+T0 = datetime.datetime(2024, 1, 1, tzinfo = tzutc())
+
+
+def at(seconds):
+    return T0 + datetime.timedelta(seconds = seconds)
+
+
+def get_pod(name, node, created, scheduled = None, started = None, finished = None):
+    conditions = None
+    if scheduled is not None:
+        conditions = [client.V1PodCondition(
+            type = "PodScheduled",
+            status = "True",
+            last_transition_time = at(scheduled),
+        )]
+    state = None
+    if finished is not None:
+        state = client.V1ContainerState(terminated = client.V1ContainerStateTerminated(
+            exit_code = 0,
+            started_at = at(started),
+            finished_at = at(finished),
+        ))
+    elif started is not None:
+        state = client.V1ContainerState(
+            running = client.V1ContainerStateRunning(started_at = at(started)),
+        )
+    phase = "Pending"
+    statuses = None
+    if state is not None:
+        phase = "Succeeded" if finished is not None else "Running"
+        statuses = [client.V1ContainerStatus(
+            name = "main",
+            image = "image",
+            image_id = "",
+            ready = True,
+            restart_count = 0,
+            state = state,
+        )]
+    return client.V1Pod(
+        metadata = client.V1ObjectMeta(
+            name = name,
+            labels = {"job-group": name.rsplit("-", 1)[0]},
+            creation_timestamp = at(created),
+        ),
+        spec = client.V1PodSpec(node_name = node, containers = []),
+        status = client.V1PodStatus(
+            phase = phase,
+            conditions = conditions,
+            container_statuses = statuses,
+        ),
+    )
+
+
+def get_event(kind, name, reason, seconds, field_path = None):
+    return client.CoreV1Event(
+        metadata = client.V1ObjectMeta(name = "{0}.{1}".format(name, reason)),
+        involved_object = client.V1ObjectReference(
+            kind = kind,
+            name = name,
+            field_path = field_path,
+        ),
+        reason = reason,
+        last_timestamp = at(seconds),
+    )
+
+
+def get_phases(spans, pod):
+    return {
+        span["phase"]: (span["start"] - T0.timestamp(), span["end"] - T0.timestamp())
+        for span in spans if span["pod"] == pod
+    }
+
+
+def test_get_spans():
+    tl = timeline.Timeline()
+    tl.on_pod("ADDED", get_pod("job-1-abcde", "node-1", 0, scheduled = 1))
+    tl.on_event(get_event("Pod", "job-1-abcde", "Pulling", 2))
+    tl.on_event(get_event("Pod", "job-1-abcde", "Pulled", 5))
+    tl.on_pod("MODIFIED", get_pod("job-1-abcde", "node-1", 0, 1, started = 6, finished = 10))
+    tl.on_event(get_event("Job", "job-1", "Completed", 11))
+
+    # Without a pull, the container starts from when it was scheduled
+    tl.on_pod("ADDED", get_pod("job-2-abcde", "node-2", 0, scheduled = 2, started = 3))
+
+    spans = tl.get_spans()
+    assert [span["node"] for span in spans] == ["node-1"] * 5 + ["node-2"] * 2
+    assert get_phases(spans, "job-1-abcde") == {
+        "scheduling": (0, 1),
+        "image pull": (2, 5),
+        "container start": (5, 6),
+        "run": (6, 10),
+        "completion": (10, 11),
+    }
+    assert get_phases(spans, "job-2-abcde") == {
+        "scheduling": (0, 2),
+        "container start": (2, 3),
+    }
+
+
+def test_earliest_mark_kept():
+    tl = timeline.Timeline()
+    tl.mark("pod-1", "created", at(0))
+    tl.mark("pod-1", "scheduled", at(4))
+    tl.mark("pod-1", "scheduled", at(2))
+    tl.mark("pod-1", "scheduled", at(3))
+    assert get_phases(tl.get_spans(), "pod-1") == {"scheduling": (0, 2)}
+
+
+def test_init_container_events_ignored():
+    tl = timeline.Timeline()
+    tl.on_event(get_event(
+        "Pod", "pod-1", "Started", 1,
+        field_path = "spec.initContainers{barrier}",
+    ))
+    assert tl.get_start_skew() is None
+    tl.on_event(get_event("Pod", "pod-1", "Started", 5, field_path = "spec.containers{main}"))
+    assert tl.get_start_skew()["nodes"] == 1
+
+
+def test_get_start_skew():
+    tl = timeline.Timeline()
+    assert tl.get_start_skew() is None
+    for i, started in enumerate([10, 10.5, 11, 14]):
+        tl.mark("pod-{0}".format(i), "started", at(started))
+    assert tl.get_start_skew() == {
+        "nodes": 4,
+        "p50": 0.5,
+        "p95": 4.0,
+        "p99": 4.0,
+        "max": 4.0,
+    }
+
+
+def test_get_trace():
+    tl = timeline.Timeline()
+    tl.on_pod("ADDED", get_pod("job-1-abcde", "node-1", 1, scheduled = 2))
+    tl.on_pod("ADDED", get_pod("job-2-abcde", "node-2", 0, scheduled = 3))
+    trace = tl.get_trace()
+    events = trace["traceEvents"]
+    assert [e["args"]["name"] for e in events if e["ph"] == "M"] == ["node-1", "node-2"]
+    spans = [(e["tid"], e["ts"], e["dur"]) for e in events if e["ph"] == "X"]
+    assert spans == [(1, 1000000, 1000000), (2, 0, 3000000)]
+    assert trace["otherData"]["origin"] == T0.isoformat()